@@ -0,0 +1,149 @@
+"""Scraper actor module.
+A Worker run as a gevent actor, fetching, waiting and writing
+cooperatively, so a Monitor in the same process keeps answering while it
+harvests. It can be paused, resumed, re-paced and stopped with messages.
+"""
+
+import gevent
+import gevent.event
+import pykka.gevent
+from scraper import rate
+from scraper import scraper
+
+
+class _Stopped(BaseException):
+    """Ends a WorkerActor's run before its next request.
+    Not an Exception, so the Worker does not take it for a failed request.
+    """
+
+
+class _Control:
+    """Stands in for the Worker's rate.RateLimiter, holding the Worker
+    back before each request while paused, and ending its run once
+    stopped. Its sleep is the Worker's, waking early to stop.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.running = gevent.event.Event()
+        self.running.set()
+        self.stopping = gevent.event.Event()
+
+    def stop(self):
+        self.stopping.set()
+        self.running.set()
+
+    def sleep(self, seconds):
+        if self.stopping.wait(seconds):
+            raise _Stopped()
+
+    def reserve(self):
+        self.running.wait()
+        if self.stopping.is_set():
+            raise _Stopped()
+        return self.limiter.reserve()
+
+    def is_throttled(self):
+        return self.limiter.is_throttled()
+
+    def on_success(self):
+        self.limiter.on_success()
+
+    def on_throttle(self, retry_after):
+        self.limiter.on_throttle(retry_after)
+
+
+class WorkerActor(pykka.gevent.GeventActor):
+    """Follows a resumption chain, as scraper.Worker.run does, in a
+    greenlet of its own.
+    response_handler - must yield to the gevent hub while it waits, e.g.
+    one from partition.green_handler; initial should send through it too
+    initial, max_requests, suggested_wait, skip, restart - see
+    scraper.Worker.run
+    worker_options - passed on to scraper.Worker
+    Messages, {'msg': ...}:
+    pause - hold the harvest before its next request
+    resume - carry on after a pause
+    rate - slow down or speed up to at most one request every 'interval'
+    seconds, for every worker on the host; Return: {'error'} if the
+    interval is missing or out of range
+    stop - end the harvest before its next request
+    status - Return: {'state', 'pages' stored, 'complete', 'error'}
+    """
+
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    STOPPED = 'stopped'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    # Messages that may be passed on from outside, see monitor.Monitor.
+    CONTROLS = {'pause', 'resume', 'rate', 'stop', 'status'}
+
+    def __init__(self, storage, response_handler, initial,
+                 max_requests=None, suggested_wait=0, skip=0, restart=None,
+                 **worker_options):
+        super().__init__()
+        limiter = worker_options.pop('limiter', None) \
+            or rate.handler_limiter(response_handler,
+                                    min_interval=suggested_wait)
+        self._control = _Control(limiter)
+        self._worker = scraper.Worker(storage, response_handler,
+                                      sleep=self._control.sleep,
+                                      limiter=self._control,
+                                      **worker_options)
+        self._run_args = (initial, max_requests, suggested_wait, skip,
+                          restart)
+        self._first_page = storage.page_count()
+        self._state = WorkerActor.RUNNING
+        self._error = None
+        self._harvest = None
+
+    def on_start(self):
+        self._harvest = gevent.spawn(self._run)
+
+    def on_stop(self):
+        # Lets a request in flight finish and be stored.
+        self._control.stop()
+        self._harvest.join()
+
+    def _run(self):
+        try:
+            self._worker.run(*self._run_args)
+            self._state = WorkerActor.DONE
+        except _Stopped:
+            self._state = WorkerActor.STOPPED
+            print(f'Stopped harvesting.')
+        except Exception as err:
+            self._state = WorkerActor.FAILED
+            self._error = str(err)
+            print(f'Harvest failed: {err}')
+
+    def _status(self):
+        return {'state': self._state,
+                'pages': self._worker.storage.page_count() - self._first_page,
+                'complete': self._worker.complete,
+                'error': self._error}
+
+    def on_receive(self, message):
+        if message['msg'] == 'pause':
+            self._control.running.clear()
+            if self._state == WorkerActor.RUNNING:
+                self._state = WorkerActor.PAUSED
+        elif message['msg'] == 'resume':
+            self._control.running.set()
+            if self._state == WorkerActor.PAUSED:
+                self._state = WorkerActor.RUNNING
+        elif message['msg'] == 'rate':
+            interval = message.get('interval')
+            max_interval = self._control.limiter.max_interval
+            if isinstance(interval, bool) \
+                    or not isinstance(interval, (int, float)) \
+                    or not 0 <= interval <= max_interval:
+                return {'error': f'rate needs an interval of 0 to '
+                                 f'{max_interval} seconds'}
+            self._control.limiter.set_min_interval(interval)
+        elif message['msg'] == 'stop':
+            self._control.stop()
+        elif message['msg'] == 'status':
+            return self._status()
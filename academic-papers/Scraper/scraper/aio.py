@@ -0,0 +1,154 @@
+"""Scraper asyncio module.
+An asyncio harvest engine, as an alternative to the blocking scraper.Worker.
+Many resumption chains (against one or many endpoints) share one event loop;
+storage writes, which block, run in an executor.
+"""
+
+import asyncio
+from collections import namedtuple
+from functools import partial
+import aiohttp
+from scraper import oai
+from scraper import rate
+from scraper import scraper
+
+
+HttpResponse = namedtuple('HttpResponse', ['status_code', 'headers', 'content'])
+
+
+class AiohttpHandler:
+    """Async response handler with a pooled aiohttp session.
+    The session is created lazily, inside the running event loop.
+    """
+
+    def __init__(self, url, pool_size=4, timeout=120):
+        self.url = url
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._session = None
+
+    async def __call__(self, data):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+        async with self._session.post(self.url, data=data) as response:
+            content = await response.read()
+            return HttpResponse(response.status, response.headers, content)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def base_oai_request(response_handler, verb, arguments={}):
+    """Async counterpart of oai.base_oai_request.
+    response_handler - coroutine function, see AiohttpHandler
+    Return: see oai.base_oai_request
+    """
+    data = arguments.copy()
+    data['verb'] = verb
+    response = await response_handler(data)
+    if response.status_code != 200:
+        raise oai.HttpStatusError(response.status_code, response)
+    else:
+        return oai.parse_response(response.content)
+
+
+async def request_list_records(response_handler, metadata_prefix='oai_dc',
+                               time_from=None, time_until=None,
+                               select_set=None):
+    arguments = {}
+    arguments['metadataPrefix'] = metadata_prefix
+    if time_from:
+        arguments['from'] = time_from
+    if time_until:
+        arguments['until'] = time_until
+    if select_set:
+        arguments['set'] = select_set
+    return await base_oai_request(response_handler, oai.Verbs.LIST_RECORDS,
+                                  arguments)
+
+
+async def resume_request_list_records(response_handler, resumption_token):
+    return await base_oai_request(response_handler, oai.Verbs.LIST_RECORDS,
+                                  {'resumptionToken': resumption_token})
+
+
+class AsyncWorker:
+    """Follows one resumption chain, like scraper.Worker, without blocking.
+    executor - where storage writes run; None for the loop's default
+    """
+
+    def __init__(self, storage, response_handler, executor=None,
+                 limiter=None):
+        self.storage = storage
+        self.response_handler = response_handler
+        self.limiter = limiter
+        self._executor = executor
+
+    async def store_single_request(self, request):
+        try:
+            data = await request()
+        except oai.HttpStatusError as err:
+            scraper.check_wait(err)
+            raise
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, scraper.store, data, self.storage)
+
+    async def run(self, initial, max_requests=None, suggested_wait=0):
+        """Follows a resumption token chain, starting with initial.
+        initial - coroutine function taking no arguments
+        Return: the number of requests stored
+        """
+        assert suggested_wait >= 0
+        assert max_requests is None or max_requests >= 1
+        limiter = self.limiter or rate.handler_limiter(
+            self.response_handler, min_interval=suggested_wait)
+        request = initial
+        num_requests = 0
+        while max_requests is None or num_requests < max_requests:
+            await asyncio.sleep(limiter.reserve())
+            try:
+                response = await self.store_single_request(request)
+                limiter.on_success()
+                num_requests += 1
+                resumption_token = \
+                    oai.resumption_token_from_response(response)
+                if resumption_token is None:
+                    break
+                request = partial(resume_request_list_records,
+                                  self.response_handler, resumption_token)
+            except oai.HttpStatusError as err:
+                raise RuntimeError(f'Unhandled http response with code '
+                                   f'{err.code}') from err
+            except oai.ApplicationError as err:
+                if err.error == oai.ApplicationError.NO_RECORDS_MATCH:
+                    break
+                raise RuntimeError(f'Unhandled OAI error of type '
+                                   f'{err.error}') from err
+            except scraper.WaitError as err:
+                limiter.on_throttle(err.wait)
+            except scraper.OutOfSpaceError:
+                print(f'Ran out of space.')
+                break
+            except oai.MalformedResponseError as err:
+                raise RuntimeError(f'Malformed response of '
+                                   f'{len(err.data)} bytes') from err
+            except Exception as err:
+                raise RuntimeError(f'Encountered error of unexpected type '
+                                   f'{type(err).__name__}.') from err
+        return num_requests
+
+
+async def run_chains(chains, max_requests=None, suggested_wait=0):
+    """Runs many (worker, initial) chains concurrently.
+    Return: the number of requests each chain stored, or the error it
+    failed with
+    """
+    return await asyncio.gather(
+        *(worker.run(initial, max_requests, suggested_wait)
+          for worker, initial in chains),
+        return_exceptions=True)
@@ -0,0 +1,183 @@
+"""Scraper cache module.
+An on-disk cache of OAI responses, wrapped around a response handler, so
+that re-running a harvest against pages already fetched happens at disk
+speed and without asking the server again.
+
+Responses are keyed by the handler's url and the request arguments (verb
+included), and their bodies are stored content-addressed, so identical
+pages are kept once. Once the bodies outgrow max_bytes, the least recently
+used are evicted. In replay mode the server is never asked at all.
+
+Only successful, well formed responses that are not OAI errors are
+cached. Resumption
+tokens are part of the key, so a chain only replays from the cache if the
+server hands out the same tokens each time.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from scraper import oai
+from scraper import spool
+
+
+CachedResponse = namedtuple('CachedResponse',
+                            ['status_code', 'headers', 'content'])
+
+
+class CacheMiss(KeyError):
+    """A replaying CachingHandler was asked for a response it does not have.
+    """
+
+
+def request_key(url, data):
+    """Return: the cache key of a request of data (arguments) to url"""
+    request = json.dumps([url, sorted(data.items())])
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class CachingHandler:
+    """Response handler answering from a cache in directory when it can,
+    and from response_handler otherwise.
+    max_bytes - total size of the cached bodies kept
+    replay - never call response_handler; a request that is not cached
+    raises CacheMiss
+    hits and misses count the requests answered with and without the cache.
+    """
+
+    INDEX_FILENAME = 'index.sqlite'
+
+    def __init__(self, response_handler, directory, max_bytes=1 << 30,
+                 replay=False, clock=time.time):
+        self.url = getattr(response_handler, 'url', None)
+        self.hits = 0
+        self.misses = 0
+        self._response_handler = response_handler
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._replay = replay
+        self._clock = clock
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._connection = sqlite3.connect(
+            os.path.join(directory, self.INDEX_FILENAME),
+            check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS objects ('
+                ' digest TEXT PRIMARY KEY, size INTEGER NOT NULL,'
+                ' used REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS objects_used ON objects (used)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                ' key TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        (self.cached_bytes,) = self._connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()
+
+    def _object_path(self, digest):
+        return os.path.join(self._directory, 'objects', digest[:2], digest)
+
+    def _get(self, key):
+        """Return: the cached body for key, or None"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            (digest,) = row
+            try:
+                with open(self._object_path(digest), 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                # Removed from under the index; fetch it again.
+                with self._connection:
+                    self._connection.execute(
+                        'DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            with self._connection:
+                self._connection.execute(
+                    'UPDATE objects SET used = ? WHERE digest = ?',
+                    (self._clock(), digest))
+            return body
+
+    def _write_object(self, digest, content):
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f'{path}.{threading.get_ident()}.partial'
+        with open(partial_path, 'wb') as f:
+            for chunk in spool.chunks(content):
+                f.write(chunk)
+        os.replace(partial_path, path)
+
+    def _put(self, key, content):
+        digest = hashlib.sha256()
+        for chunk in spool.chunks(content):
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        with self._lock:
+            known = self._connection.execute(
+                'SELECT 1 FROM objects WHERE digest = ?', (digest,)).fetchone()
+            if known is None:
+                self._write_object(digest, content)
+                self.cached_bytes += len(content)
+            with self._connection:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO objects (digest, size, used)'
+                    ' VALUES (?, ?, ?)', (digest, len(content), self._clock()))
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO entries (key, digest)'
+                    ' VALUES (?, ?)', (key, digest))
+            self._evict()
+
+    def _evict(self):
+        """Drops the least recently used bodies until they fit max_bytes."""
+        while self.cached_bytes > self._max_bytes:
+            row = self._connection.execute(
+                'SELECT digest, size FROM objects'
+                ' ORDER BY used LIMIT 1').fetchone()
+            if row is None:
+                return
+            (digest, size) = row
+            with self._connection:
+                self._connection.execute(
+                    'DELETE FROM entries WHERE digest = ?', (digest,))
+                self._connection.execute(
+                    'DELETE FROM objects WHERE digest = ?', (digest,))
+            try:
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+            self.cached_bytes -= size
+
+    def __call__(self, data):
+        key = request_key(self.url, data)
+        body = self._get(key)
+        if body is not None:
+            self.hits += 1
+            return CachedResponse(200, {}, body)
+        self.misses += 1
+        if self._replay:
+            raise CacheMiss(data)
+        response = self._response_handler(data)
+        if response.status_code == 200:
+            # A cut short page or an error (an expired token, say) is not
+            # worth replaying.
+            checked = oai.Response(response.content)
+            if checked.error is None and not checked.malformed:
+                self._put(key, response.content)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
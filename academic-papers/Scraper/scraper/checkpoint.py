@@ -0,0 +1,112 @@
+"""Scraper checkpoint module.
+Crash-safe record of how far a harvest has got, so it can be resumed.
+"""
+
+import json
+import os
+import threading
+
+
+class Checkpoint:
+    """The last stored page of a harvest, and the token that follows it,
+    along with the arguments of the harvest's first ListRecords request, to
+    follow it again from the start should the token expire.
+    sync_every - pages recorded between writes to disk
+    on_sync - called before each write, to make the pages it refers to
+    durable first (see LocalStorage.sync)
+    The file is replaced atomically, so a crash leaves either the old or
+    the new checkpoint, never a torn one.
+    """
+
+    FILENAME = 'checkpoint.json'
+
+    def __init__(self, directory, sync_every=10, on_sync=None):
+        assert sync_every >= 1
+        self._directory = directory
+        self._path = os.path.join(directory, self.FILENAME)
+        self._sync_every = sync_every
+        self._on_sync = on_sync
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self.part = 0
+        self.token = None
+        self.complete = False
+        self.arguments = None
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                state = json.load(f)
+            self.part = state['part']
+            self.token = state['token']
+            self.complete = state['complete']
+            # Not kept by checkpoints written before it was.
+            self.arguments = state.get('arguments')
+
+    def exists(self):
+        return os.path.exists(self._path)
+
+    def begin(self, arguments):
+        """Records the keyword arguments of oai.request_list_records that
+        start the harvest; written with the first page recorded.
+        """
+        with self._lock:
+            self.arguments = arguments
+
+    def record(self, part, token):
+        """Records that part was stored, and token continues after it.
+        token - None once the list is complete
+        """
+        with self._lock:
+            self.part = part
+            self.token = token
+            self.complete = token is None
+            self._unsynced += 1
+            if self._unsynced >= self._sync_every or self.complete:
+                self._sync()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._unsynced == 0:
+            return
+        if self._on_sync is not None:
+            self._on_sync()
+        write_json_atomically(self._path, {'part': self.part,
+                                           'token': self.token,
+                                           'complete': self.complete,
+                                           'arguments': self.arguments})
+        self._unsynced = 0
+
+    def reset(self):
+        """Forgets the harvest, so the next one starts from the beginning."""
+        with self._lock:
+            self.part = 0
+            self.token = None
+            self.complete = False
+            self.arguments = None
+            self._unsynced = 0
+            if os.path.exists(self._path):
+                os.remove(self._path)
+
+    def close(self):
+        self.sync()
+
+
+def write_json_atomically(path, state):
+    """Replaces the json file at path, durably and all at once."""
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    _fsync_directory(os.path.dirname(path) or '.')
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
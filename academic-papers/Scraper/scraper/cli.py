@@ -1,34 +1,294 @@
 import argparse
-import requests
+import contextlib
+import os
+import time
+from datetime import date
 from functools import partial
+import gevent
+from scraper import actor
+from scraper import cache
+from scraper import checkpoint
+from scraper import client
+from scraper import coordinator
+from scraper import dedup
+from scraper import incremental
+from scraper import index
+from scraper import monitor
+from scraper import partition
+from scraper import pipeline
+from scraper import records
+from scraper import retry
+from scraper import schedule
 from scraper import storage
+from scraper import timing
 from scraper import oai
 from scraper import scraper
 
 
-def handler(url):
-    def _handler(data):
-        return requests.post(url, data)
-    return _handler
+def handler(url, pool_size=4, timeout=120, timer=timing.NULL_TIMER,
+            spool_directory=None):
+    return client.SessionHandler(url, pool_size=pool_size,
+                                 timeout=(10, timeout), timer=timer,
+                                 spool_directory=spool_directory)
+
+
+def _timer(args):
+    timers = []
+    if args.timings:
+        timers.append(timing.HistogramTimer())
+    if args.timings_log:
+        timers.append(timing.JsonLinesTimer(args.timings_log))
+    if not timers:
+        return (timing.NULL_TIMER, None)
+    histogram = timers[0] if args.timings else None
+    if len(timers) == 1:
+        return (timers[0], histogram)
+    return (timing.TeeTimer(*timers), histogram)
+
+
+def _retry_options(args):
+    """Return: Worker options for retrying failed requests"""
+    if not args.retries:
+        return {}
+    return {'retry_policy': retry.RetryPolicy(max_attempts=args.retries),
+            'breaker': retry.breaker_for(args.source,
+                                         reset_timeout=args.circuit_reset)}
+
+
+def _partitions(args, my_handler):
+    if args.partition_by == 'set':
+        return partition.set_partitions(my_handler)
+    return partition.window_partitions(
+        date.fromisoformat(args.time_from),
+        date.fromisoformat(args.time_until) if args.time_until
+        else date.today(),
+        args.window_days)
+
+
+def _initial_request(token, my_handler, my_checkpoint, my_storage,
+                     my_state=None):
+    """Return: (first request of the chain, pages to skip, restart - see
+    scraper.Worker.run)
+    """
+    # A chain resumed from a token is started over with the arguments it
+    # was checkpointed with, should the token have expired.
+    arguments = my_checkpoint.arguments or {}
+    first = partial(oai.request_list_records, my_handler, **arguments)
+    if token:
+        my_checkpoint.begin(arguments)
+        return (partial(oai.resume_request_list_records, my_handler, token),
+                0, (first, my_storage.page_count()))
+    resume = scraper.resume_point(my_checkpoint, my_storage)
+    if resume:
+        (token, skip) = resume
+        print(f'Resuming from checkpoint after part {my_checkpoint.part}.')
+        return (partial(oai.resume_request_list_records, my_handler, token),
+                skip, (first, my_checkpoint.part))
+    if my_state is not None:
+        arguments = my_state.list_arguments(my_handler)
+    my_checkpoint.begin(arguments)
+    return (partial(oai.request_list_records, my_handler, **arguments), 0,
+            None)
+
+
+def _coordinate(args):
+    """Hands partitions out to --coordinator workers until all are done."""
+    with handler(args.source, args.pool_size, args.timeout) as my_handler:
+        partitions = _partitions(args, my_handler)
+    my_monitor = monitor.Monitor.start(
+        args.monitor_port, partitions=partitions,
+        lease_seconds=args.lease_seconds, host='*')
+    try:
+        while not my_monitor.ask({'msg': 'finished'}):
+            gevent.sleep(5)
+        for (name, status) in my_monitor.ask({'msg': 'status'}).items():
+            print(f'{name}: {status["state"]}, {status["pages"]} pages')
+        # Idle workers are still polling; answer them before stopping, but
+        # wait no longer than a lease for any that have died.
+        deadline = time.monotonic() + args.lease_seconds
+        while not my_monitor.ask({'msg': 'drained'}) \
+                and time.monotonic() < deadline:
+            gevent.sleep(1)
+    finally:
+        my_monitor.stop()
+
+
+def _storage(args, directory):
+    if args.storage == 'segment':
+        my_storage = storage.SegmentStorage(directory)
+    elif args.storage == 'records':
+        my_storage = records.RecordStorage(directory)
+    else:
+        my_storage = storage.LocalStorage(directory)
+    if args.index:
+        my_storage = index.IndexingStorage(
+            my_storage, index.InvertedIndex(os.path.join(directory,
+                                                         'index')))
+    if args.dedup:
+        my_storage = dedup.DedupStorage(
+            my_storage,
+            dedup.RecordIndex(
+                os.path.join(directory, dedup.RecordIndex.FILENAME)),
+            os.path.join(directory, 'delta'))
+    return my_storage
+
+
+def _schedule(args):
+    """Harvests every endpoint in --endpoints, each into a directory of its
+    own under --directory.
+    """
+    chains = []
+    with contextlib.ExitStack() as stack:
+        for endpoint in schedule.read_endpoints(args.endpoints):
+            directory = os.path.join(args.directory, endpoint.name)
+            os.makedirs(directory, exist_ok=True)
+            my_handler = stack.enter_context(
+                handler(endpoint.url, 1, args.timeout))
+            chains.append((endpoint, _storage(args, directory), my_handler))
+        scheduler = schedule.Scheduler(
+            chains, concurrency=args.concurrency,
+            bytes_per_second=args.bandwidth and args.bandwidth * 1024,
+            retry_policy=(retry.RetryPolicy(max_attempts=args.retries)
+                          if args.retries else retry.NO_RETRY),
+            circuit_reset=args.circuit_reset if args.retries else None,
+            max_requests=args.max)
+        scheduler.run()
+    for (_, my_storage, _) in chains:
+        my_storage.sync()
+    print(scheduler.report())
 
 
 def _main(args):
     print(args)
+    if args.coordinate:
+        _coordinate(args)
+        return
+    if args.endpoints:
+        _schedule(args)
+        return
     token = args.token
     max_times = args.max
     suggested_wait = args.wait_time
-    my_handler = handler(args.source)
-    my_storage = storage.LocalStorage(args.directory)
-    scraper.send_and_store_many_requests(
-        my_storage, my_handler, partial(oai.request_list_records, my_handler),
-        max_times, suggested_wait
-    )
+    my_storage = _storage(args, args.directory)
+    my_monitor = None
+    if args.monitor_port:
+        my_monitor = monitor.Monitor.start(args.monitor_port)
+    (my_timer, histogram) = _timer(args)
+    try:
+        _harvest(args, my_storage, my_monitor, my_timer, token, max_times,
+                 suggested_wait)
+    finally:
+        if my_monitor is not None:
+            my_monitor.stop()
+        my_timer.close()
+        if histogram is not None:
+            print(histogram.report())
+
+
+def _harvest(args, my_storage, my_monitor, my_timer, token, max_times,
+             suggested_wait):
+    pool_size = max(args.pool_size, args.concurrency)
+    spool_directory = args.directory if args.spool else None
+    with contextlib.ExitStack() as stack:
+        my_handler = stack.enter_context(
+            handler(args.source, pool_size, args.timeout, my_timer,
+                    spool_directory))
+        if args.cache:
+            my_handler = stack.enter_context(cache.CachingHandler(
+                my_handler, args.cache, max_bytes=args.cache_size << 20,
+                replay=args.replay))
+        if args.coordinator:
+            my_client = coordinator.CoordinatorClient(args.coordinator)
+            try:
+                coordinator.work(my_client, my_storage, my_handler,
+                                 suggested_wait=suggested_wait,
+                                 monitor=my_monitor, timer=my_timer,
+                                 **_retry_options(args))
+            finally:
+                my_client.close()
+            return
+        if args.partition_by:
+            harvester = partition.PartitionedHarvester(
+                my_storage, my_handler, _partitions(args, my_handler),
+                concurrency=args.concurrency, monitor=my_monitor,
+                timer=my_timer, **_retry_options(args))
+            harvester.run(max_times, suggested_wait)
+            my_storage.sync()
+            print(harvester.report())
+            return
+        my_checkpoint = checkpoint.Checkpoint(
+            args.directory, args.checkpoint_every, on_sync=my_storage.sync)
+        my_state = None
+        if args.incremental:
+            my_state = incremental.IncrementalState(args.directory)
+            if my_checkpoint.complete:
+                my_checkpoint.reset()
+        if my_checkpoint.complete and not token:
+            print(f'Harvest in {args.directory} is already complete.')
+            return
+        worker_options = {'checkpoint': my_checkpoint, 'timer': my_timer,
+                          **_retry_options(args)}
+        if my_monitor is not None:
+            # The monitor runs in a greenlet, so requests and sleeps must
+            # yield to the gevent hub for it to answer.
+            my_handler = partition.green_handler(my_handler, 1)
+            worker_options['monitor'] = my_monitor
+        (initial, skip, restart) = _initial_request(
+            token, my_handler, my_checkpoint, my_storage, my_state)
+        if my_monitor is not None and not args.pipeline:
+            complete = _run_actor(my_monitor, my_storage, my_handler,
+                                  initial, max_times, suggested_wait, skip,
+                                  restart, worker_options)
+        else:
+            if my_monitor is not None:
+                worker_options['sleep'] = gevent.sleep
+            if args.pipeline:
+                worker = pipeline.PipelinedWorker(my_storage, my_handler,
+                                                  queue_size=args.pipeline,
+                                                  **worker_options)
+            else:
+                worker = scraper.Worker(my_storage, my_handler,
+                                        **worker_options)
+            worker.run(initial, max_times, suggested_wait, skip, restart)
+            complete = worker.complete
+        if my_state is not None and complete:
+            my_state.finish()
+
+
+def _run_actor(my_monitor, my_storage, my_handler, initial, max_times,
+               suggested_wait, skip, restart, worker_options):
+    """Harvests in an actor.WorkerActor, which the monitor passes controls
+    on to.
+    Return: whether the chain was harvested to its end
+    """
+    my_actor = actor.WorkerActor.start(my_storage, my_handler, initial,
+                                       max_times, suggested_wait, skip,
+                                       restart, **worker_options)
+    my_monitor.tell({'msg': 'worker', 'worker': my_actor})
+    try:
+        status = my_actor.ask({'msg': 'status'})
+        while status['state'] in (actor.WorkerActor.RUNNING,
+                                  actor.WorkerActor.PAUSED):
+            gevent.sleep(1)
+            status = my_actor.ask({'msg': 'status'})
+    finally:
+        my_actor.stop()
+    if status['state'] == actor.WorkerActor.FAILED:
+        raise RuntimeError(status['error'])
+    return status['complete']
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Scraper (worker)')
     parser.add_argument('-s', '--source',
-                        help='base url of source', required=True)
+                        help='base url of source')
+    parser.add_argument('--endpoints', metavar='PATH',
+                        help='harvest every endpoint listed in the json '
+                             'file at PATH instead of --source, each into '
+                             'a directory of its own')
+    parser.add_argument('--bandwidth', metavar='KB',
+                        help='kilobytes per second downloaded at most, over '
+                             'all --endpoints', type=int)
     parser.add_argument('-w', '--wait-time',
                         help='suggested wait time', type=int, default=0)
     parser.add_argument('-t', '--token',
@@ -37,5 +297,90 @@ if __name__ == '__main__':
                         help='output directory', required=True)
     parser.add_argument('-m', '--max',
                         help='maximum number of requests to process', type=int)
+    parser.add_argument('--storage',
+                        choices=['local', 'segment', 'records'],
+                        help='one file per page, compressed segments, or '
+                             'a SQLite database of the records',
+                        default='local')
+    parser.add_argument('--spool', action='store_true',
+                        help='download pages straight to the output '
+                             'directory rather than into memory')
+    parser.add_argument('--dedup', action='store_true',
+                        help='skip records unchanged since they were stored')
+    parser.add_argument('--index', action='store_true',
+                        help='keep an inverted index of titles and abstracts')
+    parser.add_argument('--cache', metavar='DIRECTORY',
+                        help='keep every page fetched in DIRECTORY, and '
+                             'answer requests from it when it can')
+    parser.add_argument('--cache-size', metavar='MB',
+                        help='megabytes of pages the cache keeps before '
+                             'dropping the least recently used',
+                        type=int, default=1024)
+    parser.add_argument('--replay', action='store_true',
+                        help='answer every request from --cache, never '
+                             'asking the source')
+    parser.add_argument('--pool-size',
+                        help='connections kept alive to the source',
+                        type=int, default=4)
+    parser.add_argument('--timeout',
+                        help='read timeout in seconds', type=int, default=120)
+    parser.add_argument('--retries',
+                        help='times a failed request is retried, with '
+                             'backoff, before the harvest stops; 0 to stop '
+                             'on the first failure', type=int, default=8)
+    parser.add_argument('--circuit-reset',
+                        help='seconds every chain pauses once the source '
+                             'keeps failing', type=int, default=60)
+    parser.add_argument('--partition-by', choices=['set', 'window'],
+                        help='harvest independent chains concurrently')
+    parser.add_argument('--concurrency',
+                        help='chains harvested at once when partitioning, '
+                             'or requests in flight over all --endpoints',
+                        type=int, default=4)
+    parser.add_argument('--from', dest='time_from',
+                        help='first day (YYYY-MM-DD) for window partitions')
+    parser.add_argument('--until', dest='time_until',
+                        help='last day (YYYY-MM-DD) for window partitions')
+    parser.add_argument('--window-days',
+                        help='days per window partition', type=int, default=30)
+    parser.add_argument('--pipeline', metavar='QUEUE_SIZE',
+                        help='write pages in the background, letting up to '
+                             'QUEUE_SIZE pages wait for the disk',
+                        type=int, default=0)
+    parser.add_argument('--incremental', action='store_true',
+                        help='only harvest records changed since the last '
+                             'complete harvest into the directory')
+    parser.add_argument('--checkpoint-every',
+                        help='pages stored between checkpoint syncs',
+                        type=int, default=10)
+    parser.add_argument('--monitor-port',
+                        help='serve live harvest metrics as json on this '
+                             'localhost port, and take pause, resume, rate '
+                             'and stop controls', type=int)
+    parser.add_argument('--coordinate', action='store_true',
+                        help='hand --partition-by partitions out to '
+                             '--coordinator workers on --monitor-port '
+                             'instead of harvesting')
+    parser.add_argument('--coordinator', metavar='ADDRESS',
+                        help='harvest partitions handed out by the '
+                             'coordinator at ADDRESS, e.g. tcp://host:8080')
+    parser.add_argument('--lease-seconds',
+                        help='time a coordinator waits for a silent worker '
+                             'before handing its partition out again',
+                        type=int, default=300)
+    parser.add_argument('--timings', action='store_true',
+                        help='print how long each phase of a page took')
+    parser.add_argument('--timings-log', metavar='PATH',
+                        help='append the time of every phase to PATH as '
+                             'json lines')
     args = parser.parse_args()
+    if args.partition_by == 'window' and not args.time_from:
+        parser.error('--partition-by window requires --from')
+    if not (args.source or args.endpoints):
+        parser.error('one of --source or --endpoints is required')
+    if args.replay and not args.cache:
+        parser.error('--replay requires --cache')
+    if args.coordinate and not (args.partition_by and args.monitor_port):
+        parser.error('--coordinate requires --partition-by and '
+                     '--monitor-port')
     _main(args)
@@ -0,0 +1,115 @@
+"""Scraper client module.
+Pooled, keep-alive http response handlers for talking to an OAI server.
+"""
+
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from scraper import spool
+from scraper import timing
+
+
+# A response whose body (content) was spooled to disk; see SessionHandler.
+SpooledResponse = namedtuple('SpooledResponse',
+                             ['status_code', 'headers', 'content'])
+
+
+def _timed_pool_classes(timer):
+    """Connection pools whose connections time sending the request, and
+    waiting for the first byte of the response, with timer.
+    """
+    class TimedConnectionMixin:
+
+        def request(self, *args, **kwargs):
+            started = timer.start()
+            result = super().request(*args, **kwargs)
+            self._sent = timer.lap(timing.SEND, started)
+            return result
+
+        def getresponse(self, *args, **kwargs):
+            response = super().getresponse(*args, **kwargs)
+            timer.lap(timing.TTFB, self._sent)
+            return response
+
+    class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+        pass
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    return {'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool}
+
+
+class SessionHandler:
+    """Response handler that reuses connections to a single base url.
+    url - base url of the OAI server
+    pool_size - maximum number of connections kept alive to the host
+    timeout - (connect, read) timeout in seconds, or a single number
+    timer - timing.Timer for the send, ttfb and download phases
+    spool_directory - directory successful response bodies are written to
+    as they download, and returned from as a spool.Spool, instead of being
+    read into memory; it should be the storage directory, so storing the
+    page is a rename. Spool files a crashed harvest left there are removed.
+    """
+
+    DEFAULT_HEADERS = {
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    }
+
+    def __init__(self, url, pool_size=4, timeout=(10, 120),
+                 timer=timing.NULL_TIMER, spool_directory=None):
+        self.url = url
+        self.timeout = timeout
+        self.timer = timer
+        self.spool_directory = spool_directory
+        if spool_directory is not None:
+            removed = spool.remove_stale(spool_directory)
+            if removed:
+                print(f'Removed {removed} spool files left by an earlier '
+                      f'harvest.')
+        self._session = requests.Session()
+        self._session.headers.update(self.DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+        if timer is not timing.NULL_TIMER:
+            adapter.poolmanager.pool_classes_by_scheme = \
+                _timed_pool_classes(timer)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __call__(self, data):
+        response = self._session.post(self.url, data, timeout=self.timeout,
+                                      stream=True)
+        # Reading the body here also hands the connection back to the pool.
+        started = self.timer.start()
+        try:
+            if self.spool_directory is None or response.status_code != 200:
+                response.content
+                return response
+            body = spool.Spool.write(
+                self.spool_directory,
+                response.iter_content(spool.CHUNK_SIZE))
+            return SpooledResponse(response.status_code, response.headers,
+                                   body)
+        finally:
+            self.timer.lap(timing.DOWNLOAD, started)
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
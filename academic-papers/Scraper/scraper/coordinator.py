@@ -0,0 +1,350 @@
+"""Scraper coordinator module.
+Hands the partitions of one harvest out to worker processes, on any
+machine, that ask the Monitor for work over zmq.
+
+A worker holds a lease on its partition for as long as it keeps sending
+heartbeats. Each heartbeat carries the last resumption token stored, so a
+partition whose worker dies is given to the next idle worker to continue
+from that token rather than from the start.
+"""
+
+from collections import OrderedDict
+from functools import partial
+import os
+import socket
+import time
+import zmq
+from scraper import oai
+from scraper import partition
+from scraper import scraper
+
+
+class LeaseLost(Exception):
+    """The coordinator gave this worker's partition to someone else."""
+
+
+class _Lease:
+
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.state = _Lease.PENDING
+        self.worker = None
+        self.expires = None
+        self.token = None
+        self.pages = 0
+        self.attempts = 0
+        self.error = None
+
+
+class Coordinator:
+    """Which worker is harvesting which partition.
+    lease_seconds - time without a heartbeat after which a worker is
+    presumed dead, and its partition handed out again
+    max_attempts - times a partition is handed out before it is failed
+    """
+
+    def __init__(self, partitions, lease_seconds=300, max_attempts=3,
+                 clock=time.monotonic):
+        self._leases = OrderedDict(
+            (partition.name, _Lease(partition)) for partition in partitions)
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._clock = clock
+        self._workers = set()
+        self._told_finished = set()
+
+    def _held(self, worker, name):
+        lease = self._leases.get(name)
+        if lease is None or lease.state != _Lease.LEASED \
+                or lease.worker != worker:
+            return None
+        return lease
+
+    def _give_up(self, lease, error):
+        lease.worker = None
+        lease.expires = None
+        lease.error = error
+        if lease.attempts >= self._max_attempts:
+            lease.state = _Lease.FAILED
+        else:
+            lease.state = _Lease.PENDING
+
+    def expire(self):
+        """Takes partitions back from workers that stopped heartbeating.
+        Return: names of the partitions taken back
+        """
+        now = self._clock()
+        expired = []
+        for lease in self._leases.values():
+            if lease.state == _Lease.LEASED and lease.expires <= now:
+                print(f'Lease on {lease.partition.name} held by '
+                      f'{lease.worker} expired.')
+                self._give_up(lease, 'lease expired')
+                expired.append(lease.partition.name)
+        return expired
+
+    def claim(self, worker):
+        """Leases the next pending partition to worker.
+        Return: (partition, token to resume from, pages stored before it),
+        or None if there is nothing to hand out right now
+        """
+        self.expire()
+        for lease in self._leases.values():
+            if lease.state == _Lease.PENDING:
+                lease.state = _Lease.LEASED
+                lease.worker = worker
+                lease.expires = self._clock() + self._lease_seconds
+                lease.attempts += 1
+                return (lease.partition, lease.token, lease.pages)
+        return None
+
+    def heartbeat(self, worker, name, token=None, pages=0):
+        """Renews worker's lease, recording how far it has got.
+        Return: whether worker still holds the lease
+        """
+        lease = self._held(worker, name)
+        if lease is None:
+            return False
+        lease.expires = self._clock() + self._lease_seconds
+        if token is not None:
+            lease.token = token
+        lease.pages += pages
+        return True
+
+    def complete(self, worker, name):
+        lease = self._held(worker, name)
+        if lease is None:
+            return False
+        lease.state = _Lease.DONE
+        lease.worker = None
+        lease.token = None
+        return True
+
+    def fail(self, worker, name, error=None):
+        """Returns a partition worker could not finish."""
+        lease = self._held(worker, name)
+        if lease is None:
+            return False
+        self._give_up(lease, error)
+        return True
+
+    def finished(self):
+        """Whether every partition is either done or failed."""
+        self.expire()
+        return all(lease.state in (_Lease.DONE, _Lease.FAILED)
+                   for lease in self._leases.values())
+
+    def drained(self):
+        """Whether every worker seen so far has been told it is finished,
+        so the coordinator can stop without leaving one waiting on a reply.
+        """
+        return self.finished() and self._workers <= self._told_finished
+
+    def status(self):
+        return {name: {'state': lease.state, 'worker': lease.worker,
+                       'pages': lease.pages, 'attempts': lease.attempts,
+                       'error': lease.error}
+                for (name, lease) in self._leases.items()}
+
+    # Operations on the partition a request names.
+    _NAMED_OPS = {'heartbeat', 'complete', 'fail'}
+
+    def handle(self, request):
+        """Answers a request from CoordinatorClient.
+        request - dict with an 'op' of claim, heartbeat, complete, fail or
+        status, and the arguments of the method of that name
+        """
+        op = request['op']
+        worker = request.get('worker')
+        if op in self._NAMED_OPS and not isinstance(request.get('name'), str):
+            return {'error': f'{op} needs the name of a partition'}
+        self._workers.add(worker)
+        if op == 'claim':
+            claimed = self.claim(worker)
+            if claimed is None:
+                finished = self.finished()
+                if finished:
+                    self._told_finished.add(worker)
+                return {'partition': None, 'finished': finished}
+            (claimed_partition, token, pages) = claimed
+            return {'partition': claimed_partition._asdict(), 'token': token,
+                    'pages': pages}
+        if op == 'heartbeat':
+            return {'ok': self.heartbeat(worker, request['name'],
+                                         request.get('token'),
+                                         request.get('pages', 0))}
+        if op == 'complete':
+            return {'ok': self.complete(worker, request['name'])}
+        if op == 'fail':
+            return {'ok': self.fail(worker, request['name'],
+                                    request.get('error'))}
+        if op == 'status':
+            return {'partitions': self.status(), 'finished': self.finished()}
+        return {'error': f'unknown op {op}'}
+
+
+class CoordinatorClient:
+    """Talks to a Monitor coordinating partitions at address.
+    address - e.g. tcp://harvest-host:8080
+    timeout - seconds to wait for each reply
+    """
+
+    def __init__(self, address, worker=None, timeout=30):
+        self.address = address
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        self._timeout_ms = int(timeout * 1000)
+        self._context = zmq.Context.instance()
+        self._socket = None
+
+    def _connect(self):
+        self._socket = self._context.socket(zmq.REQ)
+        self._socket.setsockopt(zmq.RCVTIMEO, self._timeout_ms)
+        self._socket.setsockopt(zmq.LINGER, 0)
+        self._socket.connect(self.address)
+
+    def _call(self, **request):
+        if self._socket is None:
+            self._connect()
+        request['worker'] = self.worker
+        self._socket.send_json(request)
+        try:
+            return self._socket.recv_json()['response']
+        except zmq.Again:
+            # A REQ socket cannot send again until it has had a reply.
+            self.close()
+            raise
+
+    def claim(self):
+        """Return: (partition, token, pages), None if there is nothing to
+        do yet, or False once every partition is finished
+        """
+        response = self._call(op='claim')
+        if response['partition'] is None:
+            return False if response['finished'] else None
+        return (partition.Partition(**response['partition']),
+                response['token'], response['pages'])
+
+    def heartbeat(self, name, token=None, pages=0):
+        return self._call(op='heartbeat', name=name, token=token,
+                          pages=pages)['ok']
+
+    def complete(self, name):
+        return self._call(op='complete', name=name)['ok']
+
+    def fail(self, name, error=None):
+        return self._call(op='fail', name=name, error=error)['ok']
+
+    def status(self):
+        return self._call(op='status')
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class _LeaseCheckpoint:
+    """Stands in for a checkpoint.Checkpoint, heartbeating each page.
+    Its sleep is the Worker's, heartbeating every heartbeat_every seconds
+    of a pause too, as a Retry-After, backoff or open circuit can outlast
+    the lease.
+    """
+
+    def __init__(self, client, name, sleep=time.sleep, heartbeat_every=60):
+        assert heartbeat_every > 0
+        self._client = client
+        self._name = name
+        self._sleep = sleep
+        self._heartbeat_every = heartbeat_every
+        # Seconds paused since the last heartbeat.
+        self._quiet = 0
+
+    def _heartbeat(self, token=None, pages=0):
+        self._quiet = 0
+        if not self._client.heartbeat(self._name, token, pages=pages):
+            raise LeaseLost(self._name)
+
+    def record(self, part, token):
+        self._heartbeat(token, pages=1)
+
+    def sleep(self, seconds):
+        while seconds > 0:
+            interval = min(seconds, self._heartbeat_every - self._quiet)
+            self._sleep(interval)
+            seconds -= interval
+            self._quiet += interval
+            if self._quiet >= self._heartbeat_every:
+                self._heartbeat()
+
+    def sync(self):
+        pass
+
+
+def work(client, storage, response_handler, metadata_prefix='oai_dc',
+         suggested_wait=0, idle_wait=5, sleep=time.sleep, heartbeat_every=60,
+         **worker_options):
+    """Harvests partitions handed out by the coordinator until none remain.
+    idle_wait - seconds to wait before asking again when every remaining
+    partition is leased to someone else, or the coordinator does not answer
+    heartbeat_every - longest a pause goes without a heartbeat, in seconds;
+    well under the coordinator's lease_seconds
+    worker_options - passed to scraper.Worker
+    Return: the number of partitions completed
+    """
+    completed = 0
+    while True:
+        try:
+            claimed = client.claim()
+        except zmq.Again:
+            if completed > 0:
+                # The coordinator stops once every partition is done.
+                print(f'Coordinator stopped answering, finishing.')
+                return completed
+            print(f'Coordinator did not answer, asking again.')
+            sleep(idle_wait)
+            continue
+        if claimed is False:
+            return completed
+        if claimed is None:
+            sleep(idle_wait)
+            continue
+        (claimed_partition, token, pages) = claimed
+        name = claimed_partition.name
+        first = partition.initial_request(
+            response_handler, claimed_partition, metadata_prefix)
+        if token:
+            print(f'Continuing partition {name} from token {token}.')
+            initial = partial(oai.resume_request_list_records,
+                              response_handler, token)
+            restart = (first, pages)
+        else:
+            print(f'Starting partition {name}.')
+            (initial, restart) = (first, None)
+        lease = _LeaseCheckpoint(client, name, sleep, heartbeat_every)
+        worker = scraper.Worker(storage, response_handler, sleep=lease.sleep,
+                                checkpoint=lease, **worker_options)
+        try:
+            worker.run(initial, suggested_wait=suggested_wait,
+                       restart=restart)
+        except LeaseLost:
+            # Found out while pausing.
+            print(f'Lost the lease on partition {name}.')
+            continue
+        except RuntimeError as err:
+            if isinstance(err.__cause__, LeaseLost):
+                print(f'Lost the lease on partition {name}.')
+                continue
+            print(f'Partition {name} failed: {err}')
+            client.fail(name, str(err))
+            continue
+        storage.sync()
+        if not worker.complete:
+            client.fail(name, 'ran out of space')
+            return completed
+        client.complete(name)
+        completed += 1
@@ -0,0 +1,157 @@
+"""Scraper dedup module.
+Skips records that have not changed since they were last stored, using an
+on-disk identifier -> datestamp index.
+"""
+
+import sqlite3
+import threading
+from lxml import etree
+from scraper import oai
+from scraper import spool
+
+
+class RecordIndex:
+    """Datestamp last stored for each record identifier.
+    Kept in SQLite with a bounded page cache, so memory use does not grow
+    with the number of identifiers.
+    """
+
+    FILENAME = 'records.sqlite'
+    # SQLite's default limit on bound parameters is 999.
+    LOOKUP_BATCH = 500
+
+    def __init__(self, path, cache_kib=64 * 1024):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(f'PRAGMA cache_size=-{int(cache_kib)}')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            ' identifier TEXT PRIMARY KEY,'
+            ' datestamp TEXT NOT NULL) WITHOUT ROWID')
+        self._connection.commit()
+
+    def datestamps(self, identifiers):
+        """Return: {identifier: datestamp} for the identifiers indexed"""
+        identifiers = list(identifiers)
+        found = {}
+        with self._lock:
+            for start in range(0, len(identifiers), self.LOOKUP_BATCH):
+                batch = identifiers[start:start + self.LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                found.update(self._connection.execute(
+                    f'SELECT identifier, datestamp FROM records'
+                    f' WHERE identifier IN ({placeholders})', batch))
+        return found
+
+    def update(self, headers):
+        """headers - (identifier, datestamp) pairs, committed together"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO records (identifier, datestamp)'
+                ' VALUES (?, ?)', headers)
+
+    def close(self):
+        self._connection.close()
+
+
+def _is_item(element):
+    return isinstance(element.tag, str) \
+        and oai.local_name(element) != 'resumptionToken'
+
+
+def _list_items(root):
+    for container in root.iterchildren('{*}ListRecords',
+                                       '{*}ListIdentifiers'):
+        return container, list(filter(_is_item, container))
+    return None, []
+
+
+def _keep_items(data, keep):
+    """data with only the list items flagged in keep.
+    Builds the whole tree, so is only used for pages that are partly
+    unchanged.
+    """
+    root = etree.fromstring(data)
+    (container, elements) = _list_items(root)
+    for element, kept in zip(elements, keep):
+        if not kept:
+            container.remove(element)
+    return etree.tostring(root.getroottree(), encoding='UTF-8',
+                          xml_declaration=True)
+
+
+class DedupStorage:
+    """Wraps a storage, dropping records whose datestamp is unchanged.
+    delta_path - file each stored change is appended to, one
+    'identifier<TAB>datestamp<TAB>new|updated|deleted' line per record
+    A page with no changed records is not stored at all; otherwise it is
+    stored with the unchanged records removed.
+    """
+
+    def __init__(self, storage, index, delta_path):
+        self._storage = storage
+        self._index = index
+        self._delta_path = delta_path
+        self.skipped_records = 0
+
+    def available_storage(self):
+        return self._storage.available_storage()
+
+    def has_space(self, data):
+        return self._storage.has_space(data)
+
+    def reserve(self, nbytes):
+        return self._storage.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        """See LocalStorage.store.
+        items - the oai.Items of data; data is parsed for them if None
+        Return: None if every record in data was unchanged, and nothing
+        was stored
+        """
+        if items is None:
+            response = oai.Response(data)
+            if response.malformed:
+                return self._storage.store(data, records=records, token=token,
+                                           reservation=reservation)
+            items = response.items
+        known = self._index.datestamps(
+            item.identifier for item in items if item.identifier)
+        keep = []
+        changed = []
+        delta = []
+        for item in items:
+            previous = known.get(item.identifier)
+            if item.identifier is not None and previous == item.datestamp:
+                keep.append(False)
+                self.skipped_records += 1
+                continue
+            keep.append(True)
+            if item.identifier is None:
+                continue
+            changed.append((item.identifier, item.datestamp))
+            status = 'deleted' if item.deleted \
+                else 'new' if previous is None else 'updated'
+            delta.append(f'{item.identifier}\t{item.datestamp}\t{status}\n')
+        if items and not changed:
+            return None
+        if not all(keep):
+            data = _keep_items(spool.as_bytes(data), keep)
+            items = [item for item, kept in zip(items, keep) if kept]
+        part = self._storage.store(data, records=len(items), token=token,
+                                   items=items, reservation=reservation)
+        with open(self._delta_path, 'a') as f:
+            f.writelines(delta)
+        self._index.update(changed)
+        return part
+
+    def log_resumption(self, token):
+        self._storage.log_resumption(token)
+
+    def page_count(self):
+        return self._storage.page_count()
+
+    def sync(self):
+        self._storage.sync()
@@ -0,0 +1,203 @@
+"""Scraper extract module.
+Turns harvested pages into chunked, columnar NumPy record files, so
+analyses load header and Dublin Core fields without re-parsing xml.
+
+Each chunk file holds one string table (utf-8 bytes plus offsets) and,
+per field, either one string id per record (-1 when missing) or, for
+multi-valued fields, a flat array of string ids with per-record offsets.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+from scraper import oai
+from scraper import storage
+from scraper.manifest import Manifest
+
+
+SINGLE_FIELDS = ('identifier', 'datestamp', 'title', 'date')
+MULTI_FIELDS = ('set_spec', 'creators', 'subjects')
+
+_DC = '{http://purl.org/dc/elements/1.1/}'
+
+
+def extract_records(data):
+    """The header and Dublin Core fields of every record in a page.
+    Return: list of dicts keyed by SINGLE_FIELDS and MULTI_FIELDS
+    """
+    records = []
+    for element in oai.Response(data).records():
+        header = element.find('{*}header')
+        if header is None:
+            continue
+        metadata = element.find('{*}metadata')
+        record = {
+            'identifier': header.findtext('{*}identifier'),
+            'datestamp': header.findtext('{*}datestamp'),
+            'set_spec': [spec.text for spec in header.iterfind('{*}setSpec')],
+            'title': None,
+            'date': None,
+            'creators': [],
+            'subjects': [],
+        }
+        if metadata is not None:
+            record['title'] = metadata.findtext(f'.//{_DC}title')
+            record['date'] = metadata.findtext(f'.//{_DC}date')
+            record['creators'] = [
+                creator.text for creator in metadata.iter(f'{_DC}creator')]
+            record['subjects'] = [
+                subject.text for subject in metadata.iter(f'{_DC}subject')]
+        records.append(record)
+    return records
+
+
+class _StringTable:
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+
+    def id(self, string):
+        if string is None:
+            return -1
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._ids[string] = string_id
+            self._strings.append(string)
+        return string_id
+
+    def arrays(self):
+        encoded = [string.encode('utf-8') for string in self._strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return data, offsets
+
+
+def to_columns(records):
+    """Packs records into the arrays stored in a chunk file."""
+    table = _StringTable()
+    columns = {}
+    for field in SINGLE_FIELDS:
+        columns[field] = np.array(
+            [table.id(record[field]) for record in records], dtype=np.int32)
+    for field in MULTI_FIELDS:
+        ids = [table.id(value) for record in records
+               for value in record[field]]
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        np.cumsum([len(record[field]) for record in records],
+                  out=offsets[1:])
+        columns[f'{field}_ids'] = np.array(ids, dtype=np.int32)
+        columns[f'{field}_offsets'] = offsets
+    (columns['string_data'], columns['string_offsets']) = table.arrays()
+    return columns
+
+
+class RecordChunk:
+    """A loaded chunk file."""
+
+    def __init__(self, path):
+        with np.load(path) as arrays:
+            self._arrays = dict(arrays)
+        self._string_data = self._arrays['string_data'].tobytes()
+        self._string_offsets = self._arrays['string_offsets']
+
+    def __len__(self):
+        return len(self._arrays['identifier'])
+
+    def string(self, string_id):
+        if string_id < 0:
+            return None
+        start = self._string_offsets[string_id]
+        end = self._string_offsets[string_id + 1]
+        return self._string_data[start:end].decode('utf-8')
+
+    def ids(self, field):
+        """The raw string ids of a field, for vectorised analyses."""
+        if field in SINGLE_FIELDS:
+            return self._arrays[field]
+        return self._arrays[f'{field}_ids'], self._arrays[f'{field}_offsets']
+
+    def column(self, field):
+        """A field's values as strings (lists for multi-valued fields)."""
+        if field in SINGLE_FIELDS:
+            return [self.string(string_id)
+                    for string_id in self._arrays[field]]
+        (ids, offsets) = self.ids(field)
+        return [[self.string(string_id)
+                 for string_id in ids[offsets[n]:offsets[n + 1]]]
+                for n in range(len(self))]
+
+
+def stored_pages(directory):
+    """Every page stored in directory so far, in order, without writing to
+    it, so extraction can run alongside a harvest.
+    Return: ('segment', page numbers) or ('part', part file paths)
+    """
+    if os.path.exists(os.path.join(directory,
+                                   storage.SegmentStorage.INDEX_FILENAME)):
+        with storage.SegmentReader(directory) as reader:
+            return ('segment', list(range(1, reader.page_count() + 1)))
+    manifest_path = os.path.join(directory, Manifest.FILENAME)
+    if os.path.exists(manifest_path):
+        manifest = Manifest(manifest_path, read_only=True)
+        filenames = [part.filename for part in manifest.parts()]
+        manifest.close()
+    else:
+        filenames = sorted(storage._get_part_files(directory))
+    return ('part', [os.path.join(directory, filename)
+                     for filename in filenames])
+
+
+def _read_pages(kind, directory, pages):
+    if kind == 'segment':
+        with storage.SegmentReader(directory) as reader:
+            for page in pages:
+                yield reader.read(page)
+        return
+    for path in pages:
+        with open(path, 'rb') as f:
+            yield f.read()
+
+
+def _extract_chunk(task):
+    (kind, directory, pages, path) = task
+    records = []
+    for data in _read_pages(kind, directory, pages):
+        records.extend(extract_records(data))
+    np.savez(path, **to_columns(records))
+    return (path, len(records))
+
+
+def extract(directory, out_directory, pages_per_chunk=50, processes=None):
+    """Extracts every page stored in directory into chunk files.
+    Return: (chunk path, record count) per chunk, in page order
+    """
+    (kind, pages) = stored_pages(directory)
+    tasks = []
+    for start in range(0, len(pages), pages_per_chunk):
+        chunk = len(tasks)
+        tasks.append((kind, directory, pages[start:start + pages_per_chunk],
+                      os.path.join(out_directory, f'chunk_{chunk:06d}.npz')))
+    with ProcessPoolExecutor(processes) as executor:
+        return list(executor.map(_extract_chunk, tasks))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract harvested records')
+    parser.add_argument('-d', '--directory',
+                        help='harvest output directory', required=True)
+    parser.add_argument('-o', '--out',
+                        help='directory for chunk files', required=True)
+    parser.add_argument('-p', '--processes',
+                        help='worker processes', type=int)
+    parser.add_argument('--pages-per-chunk',
+                        help='pages extracted into each chunk file',
+                        type=int, default=50)
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+    for (path, count) in extract(args.directory, args.out,
+                                 args.pages_per_chunk, args.processes):
+        print(f'{path}: {count} records')
@@ -0,0 +1,92 @@
+"""Scraper incremental module.
+Remembers when the last complete harvest of a repository started, so the
+next one only asks for records changed since then.
+"""
+
+import json
+import os
+from functools import partial
+from scraper import checkpoint
+from scraper import oai
+
+
+DAY_GRANULARITY = 'YYYY-MM-DD'
+SECONDS_GRANULARITY = 'YYYY-MM-DDThh:mm:ssZ'
+
+
+def identify(response_handler):
+    """Return: (datestamp granularity, responseDate) from Identify"""
+    response = oai.request_identify(response_handler)
+    server_granularity = DAY_GRANULARITY
+    for element in response.records():
+        if oai.local_name(element) == 'granularity':
+            server_granularity = (element.text or '').strip() \
+                or DAY_GRANULARITY
+    return (server_granularity, response.response_date)
+
+
+def format_from(response_date, server_granularity):
+    """A from argument for response_date the server will accept.
+    response_date - an OAI responseDate, always at seconds granularity
+    """
+    if server_granularity == SECONDS_GRANULARITY:
+        return response_date
+    return response_date[:len('YYYY-MM-DD')]
+
+
+class IncrementalState:
+    """When the last complete harvest into a directory started.
+    The server's responseDate from just before a harvest is kept as pending
+    until the list is complete, so a harvest resumed after a crash still
+    counts from when it really started.
+    """
+
+    FILENAME = 'incremental.json'
+
+    def __init__(self, directory):
+        self._path = os.path.join(directory, self.FILENAME)
+        self.last_harvest = None
+        self.pending = None
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                state = json.load(f)
+            self.last_harvest = state['last_harvest']
+            self.pending = state['pending']
+
+    def _save(self):
+        checkpoint.write_json_atomically(
+            self._path, {'last_harvest': self.last_harvest,
+                         'pending': self.pending})
+
+    def begin(self, response_date):
+        if self.pending is None and response_date is not None:
+            self.pending = response_date
+            self._save()
+
+    def finish(self):
+        if self.pending is not None:
+            self.last_harvest = self.pending
+            self.pending = None
+            self._save()
+
+    def list_arguments(self, response_handler, metadata_prefix='oai_dc'):
+        """Begins a harvest of the records changed since last_harvest, or
+        of every record if there has not been one.
+        Return: keyword arguments of oai.request_list_records for its first
+        request
+        """
+        (server_granularity, response_date) = identify(response_handler)
+        self.begin(response_date)
+        time_from = None
+        if self.last_harvest is not None:
+            time_from = format_from(self.last_harvest, server_granularity)
+            print(f'Harvesting records changed since {time_from}.')
+        return {'metadata_prefix': metadata_prefix, 'time_from': time_from}
+
+    def initial_request(self, response_handler, metadata_prefix='oai_dc'):
+        """See list_arguments.
+        Return: the first ListRecords request of the harvest
+        """
+        return partial(oai.request_list_records, response_handler,
+                       **self.list_arguments(response_handler,
+                                             metadata_prefix))
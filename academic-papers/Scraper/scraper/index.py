@@ -0,0 +1,223 @@
+"""Scraper index module.
+An on-disk inverted index over harvested titles and abstracts, built as
+pages are stored.
+
+New postings are buffered in memory and flushed as immutable SQLite
+segments. Segments are merged size-tiered: once merge_factor segments of
+about the same size exist, they are merged into one of the next size up,
+so each posting is rewritten about log(postings) times in all.
+"""
+
+from collections import defaultdict, namedtuple
+import argparse
+import math
+import os
+import re
+import sqlite3
+from scraper import oai
+
+
+Hit = namedtuple('Hit', ['identifier', 'part', 'position'])
+
+_WORD = re.compile(r'\w{2,}')
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+def page_terms(items):
+    """Terms of each record in a page.
+    items - the oai.Items of the page
+    Return: (identifier, position in page, set of terms) per record
+    """
+    for position, item in enumerate(items):
+        if item.identifier is None or item.text is None:
+            continue
+        yield (item.identifier, position, set(tokenize(item.text)))
+
+
+def _create_segment(path, postings):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute('CREATE TABLE postings ('
+                           ' term TEXT, identifier TEXT,'
+                           ' part INTEGER, position INTEGER)')
+        connection.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+                               postings)
+        connection.execute('CREATE INDEX postings_term ON postings (term)')
+    return connection
+
+
+def _segment_size(connection):
+    (size,) = connection.execute('SELECT COUNT(*) FROM postings').fetchone()
+    return size
+
+
+class InvertedIndex:
+    """Term -> record locations, kept in directory.
+    flush_postings - postings buffered in memory before a segment is written
+    merge_factor - number of segments of one size tier that are merged
+    postings_written counts every posting written to a segment, merges
+    included, as a measure of write amplification.
+    """
+
+    def __init__(self, directory, flush_postings=100000, merge_factor=4):
+        assert merge_factor >= 2
+        self._directory = directory
+        self._flush_postings = flush_postings
+        self._merge_factor = merge_factor
+        os.makedirs(directory, exist_ok=True)
+        self._buffer = defaultdict(list)
+        self._buffered = 0
+        self._segments = []
+        self.postings_written = 0
+        numbers = [int(name[len('seg_'):-len('.sqlite')])
+                   for name in os.listdir(directory)
+                   if re.fullmatch(r'seg_\d+\.sqlite', name)]
+        for number in sorted(numbers):
+            connection = sqlite3.connect(self._segment_path(number))
+            self._segments.append(
+                (number, connection, _segment_size(connection)))
+        self._next_segment = max(numbers, default=0) + 1
+
+    def _segment_path(self, number):
+        return os.path.join(self._directory, f'seg_{number:06d}.sqlite')
+
+    def add_page(self, part, data, items=None):
+        """Indexes the records of a stored page.
+        items - the oai.Items of data; data is parsed for them if None
+        """
+        if items is None:
+            items = oai.Response(data).items
+        for (identifier, position, terms) in page_terms(items):
+            for term in terms:
+                self._buffer[term].append((identifier, part, position))
+            self._buffered += len(terms)
+        if self._buffered >= self._flush_postings:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered postings out as a new segment."""
+        if not self._buffered:
+            return
+        postings = ((term, identifier, part, position)
+                    for term in sorted(self._buffer)
+                    for (identifier, part, position) in self._buffer[term])
+        self._add_segment(postings, self._buffered)
+        self._buffer.clear()
+        self._buffered = 0
+        self._merge_tiers()
+
+    def _add_segment(self, postings, size):
+        number = self._next_segment
+        self._next_segment += 1
+        connection = _create_segment(self._segment_path(number), postings)
+        self._segments.append((number, connection, size))
+        self.postings_written += size
+
+    def _tier(self, size):
+        return int(math.log(max(size, 1), self._merge_factor))
+
+    def _merge_tiers(self):
+        while True:
+            tiers = defaultdict(list)
+            for segment in self._segments:
+                tiers[self._tier(segment[2])].append(segment)
+            full = [segments for segments in tiers.values()
+                    if len(segments) >= self._merge_factor]
+            if not full:
+                return
+            self._merge(full[0])
+
+    def merge(self):
+        """Merges every segment into one."""
+        if len(self._segments) >= 2:
+            self._merge(list(self._segments))
+
+    def _merge(self, merging):
+        def postings():
+            for (_, connection, _) in merging:
+                yield from connection.execute('SELECT * FROM postings')
+        self._add_segment(postings(), sum(size for (_, _, size) in merging))
+        for (old_number, connection, _) in merging:
+            connection.close()
+            os.remove(self._segment_path(old_number))
+        self._segments = [segment for segment in self._segments
+                          if segment not in merging]
+
+    def _term_hits(self, term):
+        hits = {Hit(*posting) for posting in self._buffer.get(term, ())}
+        for (_, connection, _) in self._segments:
+            hits.update(Hit(*row) for row in connection.execute(
+                'SELECT identifier, part, position FROM postings'
+                ' WHERE term = ?', (term,)))
+        return hits
+
+    def search(self, query):
+        """Records containing every term in query.
+        Return: Hits sorted by part and position
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        hits = None
+        for term in sorted(terms, key=len, reverse=True):
+            term_hits = self._term_hits(term)
+            hits = term_hits if hits is None else hits & term_hits
+            if not hits:
+                return []
+        return sorted(hits, key=lambda hit: (hit.part, hit.position))
+
+    def close(self):
+        self.flush()
+        for (_, connection, _) in self._segments:
+            connection.close()
+        self._segments = []
+
+
+class IndexingStorage:
+    """Wraps a storage, indexing each page once it is stored."""
+
+    def __init__(self, storage, index):
+        self._storage = storage
+        self._index = index
+
+    def available_storage(self):
+        return self._storage.available_storage()
+
+    def has_space(self, data):
+        return self._storage.has_space(data)
+
+    def reserve(self, nbytes):
+        return self._storage.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        part = self._storage.store(data, records=records, token=token,
+                                   items=items, reservation=reservation)
+        if part is not None:
+            self._index.add_page(part, data, items)
+        return part
+
+    def log_resumption(self, token):
+        self._storage.log_resumption(token)
+
+    def page_count(self):
+        return self._storage.page_count()
+
+    def sync(self):
+        self._storage.sync()
+        self._index.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search harvested records')
+    parser.add_argument('-i', '--index',
+                        help='index directory', required=True)
+    parser.add_argument('query', help='terms that must all match')
+    args = parser.parse_args()
+    index = InvertedIndex(args.index)
+    for hit in index.search(args.query):
+        print(f'{hit.identifier}\tpart {hit.part}\trecord {hit.position}')
+    index.close()
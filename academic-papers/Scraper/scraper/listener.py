@@ -1,16 +1,35 @@
 import gevent
 import zmq.green as zmq
 
-def create_server(port):
-    context = zmq.Context()
+def create_server(port=None, host='127.0.0.1'):
+    """Binds a reply socket; on a random port if port is None.
+    host - interface to listen on, * for all of them
+    """
+    context = zmq.Context.instance()
     socket = context.socket(zmq.REP)
-    socket.bind(f'127.0.0.1:{port}')
+    if port is None:
+        socket.bind_to_random_port(f'tcp://{host}')
+    else:
+        socket.bind(f'tcp://{host}:{port}')
     return socket
 
+def server_port(server):
+    endpoint = server.getsockopt_string(zmq.LAST_ENDPOINT)
+    return int(endpoint.rsplit(':', 1)[1])
+
 def serve_request(monitor, server):
+    """Waits for the next request in a greenlet, and passes it on.
+    Return: the greenlet, which must be killed before server is closed
+    """
     def _serve_request():
-        request = server.recv_json()
+        while True:
+            try:
+                request = server.recv_json()
+                break
+            except ValueError as err:
+                server.send_json({'request': None,
+                                  'response': {'error': f'not json: {err}'}})
         monitor.tell({'msg': 'serve',
                       'request': request,
                       'server': server})
-    gevent.spawn(_serve_request)
+    return gevent.spawn(_serve_request)
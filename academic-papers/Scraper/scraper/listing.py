@@ -0,0 +1,157 @@
+"""Scraper listing module.
+Iterates over every item of a paged list - the records of ListRecords,
+headers of ListIdentifiers or sets of ListSets - following resumption
+tokens for the caller.
+
+A background thread keeps up to prefetch pages fetched ahead of the
+consumer, so the network stays busy while items are processed, and memory
+stays bounded by those few pages however long the list is.
+"""
+
+import copy
+from functools import partial
+import queue
+import threading
+import time
+from scraper import oai
+from scraper import rate
+from scraper import scraper
+
+
+_END = object()
+
+
+def _page_items(response):
+    """Return: (items of response, its resumption token)
+    The items are copied out of the streaming parse, so they outlive it.
+    """
+    items = [copy.deepcopy(element) for element in response.records()]
+    return (items, oai.resumption_token_from_response(response))
+
+
+def _fetch_pages(first, resume, limiter, sleep):
+    """Yields the items of each page of a list, in order."""
+    request = first
+    while True:
+        sleep(limiter.reserve())
+        try:
+            response = request()
+        except oai.HttpStatusError as err:
+            try:
+                scraper.check_wait(err)
+            except scraper.WaitError as wait:
+                limiter.on_throttle(wait.wait)
+                continue
+            raise
+        except oai.ApplicationError as err:
+            if err.error == oai.ApplicationError.NO_RECORDS_MATCH:
+                return
+            raise
+        limiter.on_success()
+        (items, token) = _page_items(response)
+        yield items
+        if token is None:
+            return
+        request = partial(resume, token)
+
+
+def _prefetched(pages, prefetch):
+    """Runs the pages generator in a thread, up to prefetch pages ahead.
+    Errors are raised to the consumer when it reaches them.
+    """
+    results = queue.Queue(maxsize=prefetch)
+    stopped = threading.Event()
+
+    def _put(result):
+        while not stopped.is_set():
+            try:
+                results.put(result, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch():
+        try:
+            for items in pages:
+                if not _put((items, None)):
+                    return
+        except Exception as err:
+            _put((None, err))
+            return
+        _put((_END, None))
+
+    thread = threading.Thread(target=_fetch, name='listing-prefetch',
+                              daemon=True)
+    thread.start()
+    try:
+        while True:
+            (items, err) = results.get()
+            if err is not None:
+                raise err
+            if items is _END:
+                return
+            yield items
+    finally:
+        # Lets the thread finish once its request in flight returns.
+        stopped.set()
+
+
+def items(first, resume, prefetch=2, limiter=None, sleep=time.sleep):
+    """Every item of a paged list, in order.
+    first - function taking no arguments, requesting the first page
+    resume - function taking a resumption token, requesting a later page
+    prefetch - pages fetched ahead in a background thread; 0 to fetch each
+    page only once the last one is used up
+    limiter - rate.RateLimiter pacing the requests, and honoring any
+    Retry-After; by default one of its own, or for the list_ functions the
+    one rate.handler_limiter gives
+    Return: generator of elements; closing it stops the prefetching
+    """
+    assert prefetch >= 0
+    pages = _fetch_pages(first, resume, limiter or rate.RateLimiter(), sleep)
+    if prefetch > 0:
+        pages = _prefetched(pages, prefetch)
+    try:
+        for page in pages:
+            yield from page
+    finally:
+        pages.close()
+
+
+def _options(response_handler, options):
+    options.setdefault('limiter', rate.handler_limiter(response_handler))
+    return options
+
+
+def list_records(response_handler, metadata_prefix='oai_dc', time_from=None,
+                 time_until=None, select_set=None, **options):
+    """Every record element of a ListRecords request.
+    options - see items
+    """
+    return items(partial(oai.request_list_records, response_handler,
+                         metadata_prefix, time_from, time_until, select_set),
+                 partial(oai.resume_request_list_records, response_handler),
+                 **_options(response_handler, options))
+
+
+def list_identifiers(response_handler, metadata_prefix='oai_dc',
+                     time_from=None, time_until=None, select_set=None,
+                     **options):
+    """Every header element of a ListIdentifiers request.
+    options - see items
+    """
+    return items(partial(oai.request_list_identifiers, response_handler,
+                         metadata_prefix, time_from, time_until, select_set),
+                 partial(oai.resume_request_list_identifiers,
+                         response_handler),
+                 **_options(response_handler, options))
+
+
+def list_sets(response_handler, **options):
+    """Every set element of a ListSets request.
+    options - see items
+    """
+    return items(partial(oai.request_list_sets, response_handler),
+                 partial(oai.resume_request_list_sets, response_handler),
+                 **_options(response_handler, options))
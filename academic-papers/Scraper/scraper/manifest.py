@@ -0,0 +1,91 @@
+"""Scraper manifest module.
+A persistent SQLite index of the parts stored in an output directory, so
+storage can be opened (and its contents listed) without walking it.
+"""
+
+from collections import namedtuple
+import sqlite3
+import threading
+import time
+
+
+Part = namedtuple('Part',
+                  ['part', 'filename', 'bytes', 'records', 'token',
+                   'stored_at'])
+
+
+class Manifest:
+    """Index of stored parts, kept in FILENAME inside directory.
+    Additions are only committed by commit() (or close()), so that storing
+    a page does not cost a transaction of its own.
+    read_only - open an existing manifest without ever writing to it, e.g.
+    while a harvest is still adding to it
+    """
+
+    FILENAME = 'manifest.sqlite'
+
+    def __init__(self, path, read_only=False):
+        self._lock = threading.Lock()
+        if read_only:
+            self._connection = sqlite3.connect(
+                f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+            return
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS parts ('
+            ' part INTEGER PRIMARY KEY,'
+            ' filename TEXT NOT NULL,'
+            ' bytes INTEGER NOT NULL,'
+            ' records INTEGER,'
+            ' token TEXT,'
+            ' stored_at REAL NOT NULL)')
+        self._connection.commit()
+
+    def is_empty(self):
+        return self.last_part() == 0
+
+    def last_part(self):
+        with self._lock:
+            (last,) = self._connection.execute(
+                'SELECT MAX(part) FROM parts').fetchone()
+        return last or 0
+
+    def add(self, part, filename, nbytes, records=None, token=None,
+            stored_at=None):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO parts'
+                ' (part, filename, bytes, records, token, stored_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (part, filename, nbytes, records, token,
+                 stored_at if stored_at is not None else time.time()))
+
+    def add_many(self, parts):
+        """Bulk insert of (part, filename, bytes, stored_at) tuples."""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO parts'
+                ' (part, filename, bytes, stored_at) VALUES (?, ?, ?, ?)',
+                parts)
+
+    def get(self, part):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT * FROM parts WHERE part = ?', (part,)).fetchone()
+        return Part(*row) if row else None
+
+    def parts(self):
+        """Every stored part, in order."""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT * FROM parts ORDER BY part').fetchall()
+        return [Part(*row) for row in rows]
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
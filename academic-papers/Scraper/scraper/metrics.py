@@ -0,0 +1,81 @@
+"""Scraper metrics module.
+Rolling aggregates of harvest progress, fed by Worker updates.
+"""
+
+from collections import deque
+import time
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1,
+                int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class HarvestMetrics:
+    """Aggregates updates over the last window seconds.
+    Updates are dicts, as sent by Worker to the Monitor:
+        {'kind': 'page', 'bytes': n, 'latency': seconds, 'headroom': n}
+        {'kind': 'sleep', 'seconds': s, 'retry_after': bool}
+        {'kind': 'retry', 'error': name of the exception retried}
+    """
+
+    def __init__(self, window=60, clock=time.monotonic):
+        self._window = window
+        self._clock = clock
+        self._started = clock()
+        self._pages = deque()
+        self._sleeps = deque()
+        self.pages_total = 0
+        self.bytes_total = 0
+        self.retry_after_total = 0.0
+        self.retries_total = 0
+        self.headroom = None
+
+    def update(self, update):
+        now = self._clock()
+        if update['kind'] == 'page':
+            self._pages.append((now, update['bytes'], update['latency']))
+            self.pages_total += 1
+            self.bytes_total += update['bytes']
+            if update.get('headroom') is not None:
+                self.headroom = update['headroom']
+        elif update['kind'] == 'sleep':
+            self._sleeps.append((now, update['seconds'],
+                                 update.get('retry_after', False)))
+            if update.get('retry_after'):
+                self.retry_after_total += update['seconds']
+        elif update['kind'] == 'retry':
+            self.retries_total += 1
+        self._expire(now)
+
+    def _expire(self, now):
+        for events in (self._pages, self._sleeps):
+            while events and events[0][0] < now - self._window:
+                events.popleft()
+
+    def snapshot(self):
+        """Rolling aggregates, ready to be sent as json."""
+        now = self._clock()
+        self._expire(now)
+        span = max(min(self._window, now - self._started), 1e-9)
+        latencies = sorted(latency for (_, _, latency) in self._pages)
+        return {
+            'window_seconds': self._window,
+            'pages_per_second': len(self._pages) / span,
+            'bytes_per_second':
+                sum(nbytes for (_, nbytes, _) in self._pages) / span,
+            'latency_p50': percentile(latencies, 0.50),
+            'latency_p90': percentile(latencies, 0.90),
+            'latency_p99': percentile(latencies, 0.99),
+            'sleep_seconds': sum(seconds for (_, seconds, _) in self._sleeps),
+            'retry_after_seconds': sum(
+                seconds for (_, seconds, retry) in self._sleeps if retry),
+            'retry_after_seconds_total': self.retry_after_total,
+            'retries_total': self.retries_total,
+            'pages_total': self.pages_total,
+            'bytes_total': self.bytes_total,
+            'storage_headroom': self.headroom,
+        }
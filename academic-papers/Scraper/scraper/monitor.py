@@ -1,28 +1,88 @@
 import pykka.gevent
+from scraper import actor
+from scraper import coordinator
 from scraper import listener
+from scraper import metrics
 
 
 class Monitor(pykka.gevent.GeventActor):
+    """Collects Worker updates, and serves their rolling aggregates as json
+    to anyone asking on the listener port.
+    Given partitions, it also coordinates them: requests with an 'op' are
+    answered by a coordinator.Coordinator (see coordinator.work).
+    Requests with a 'control' (see actor.WorkerActor.CONTROLS) are passed
+    on to the worker actor registered with a 'worker' message.
+    host - interface to listen on, * to accept remote workers
+    """
 
-    def __init__(self):
-        pass
+    # Seconds to wait for the worker to answer a control.
+    CONTROL_TIMEOUT = 5
+
+    def __init__(self, port=8080, window=60, partitions=None,
+                 lease_seconds=300, host='127.0.0.1'):
+        super().__init__()
+        self.port = port
+        self.host = host
+        self.metrics = metrics.HarvestMetrics(window)
+        self.coordinator = None
+        if partitions is not None:
+            self.coordinator = coordinator.Coordinator(partitions,
+                                                       lease_seconds)
+        self.worker = None
+        self._server = None
+        self._serving = None
 
     def on_start(self):
-        server = listener.create_server(8080)
-        listener.serve_request(self, server)
+        self._server = listener.create_server(self.port, self.host)
+        self.port = listener.server_port(self._server)
+        self._serving = listener.serve_request(self.actor_ref, self._server)
 
     def on_stop(self):
-        pass
+        # The socket must not be closed under a greenlet waiting on it.
+        if self._serving is not None:
+            self._serving.kill()
+        if self._server is not None:
+            self._server.close(linger=0)
 
     def on_failure(self, exception_type, exception_value, traceback):
         pass
 
+    def _respond(self, request):
+        """Return: the answer to request, or {'error'} if it could not be
+        answered, so the requester is never left without a reply
+        """
+        try:
+            return self._answer(request)
+        except Exception as err:
+            return {'error': f'{type(err).__name__}: {err}'}
+
+    def _answer(self, request):
+        if self.coordinator is not None and isinstance(request, dict) \
+                and 'op' in request:
+            return self.coordinator.handle(request)
+        if self.worker is not None and isinstance(request, dict) \
+                and request.get('control') in actor.WorkerActor.CONTROLS:
+            return self.worker.ask(dict(request, msg=request['control']),
+                                   timeout=self.CONTROL_TIMEOUT)
+        return self.metrics.snapshot()
+
     def on_receive(self, message):
         if message['msg'] == 'serve':
             request = message['request']
             server = message['server']
-            response = { 'request': request, 'response': 'data' }
-            server.send(str(response))
-            listener.serve_request(self, server)
+            response = {'request': request,
+                        'response': self._respond(request)}
+            server.send_json(response)
+            self._serving = listener.serve_request(self.actor_ref, server)
         elif message['msg'] == 'update':
-            pass
+            self.metrics.update(message['update'])
+        elif message['msg'] == 'worker':
+            self.worker = message['worker']
+        elif message['msg'] == 'port':
+            return self.port
+        elif message['msg'] == 'finished':
+            return self.coordinator is None or self.coordinator.finished()
+        elif message['msg'] == 'drained':
+            return self.coordinator is None or self.coordinator.drained()
+        elif message['msg'] == 'status':
+            return self.coordinator and self.coordinator.status()
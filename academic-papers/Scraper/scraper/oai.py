@@ -4,7 +4,9 @@ with an OAI server.
 OAI version 2.
 """
 
-from bs4 import BeautifulSoup
+from collections import namedtuple
+from lxml import etree
+from scraper import spool
 
 
 class Verbs:
@@ -96,12 +98,203 @@ class ApplicationError(Exception):
         return f'ApplicationError[{self.error}, {self.error_text}]'
 
 
+class MalformedResponseError(Exception):
+    """The response was not a complete OAI-PMH document, e.g. a truncated
+    body or an html page from a proxy.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return f'MalformedResponse[{len(self.data)} bytes]'
+
+
+ResumptionToken = namedtuple(
+    'ResumptionToken',
+    ['token', 'cursor', 'complete_list_size', 'expiration_date'])
+
+# What storages need to know about a list item, taken while it is parsed.
+# text - its Dublin Core titles and descriptions, or None without metadata
+Item = namedtuple('Item', ['identifier', 'datestamp', 'deleted', 'text'])
+
+_DC = '{http://purl.org/dc/elements/1.1/}'
+
+
+def local_name(element):
+    return etree.QName(element).localname
+
+
+def item_summary(element):
+    """Return: the Item of a record, header or set element"""
+    header = element if local_name(element) == 'header' \
+        else element.find('{*}header')
+    if header is None:
+        return Item(None, None, False, None)
+    metadata = element.find('{*}metadata')
+    text = None
+    if metadata is not None:
+        text = '\n'.join(value.text for value in
+                         metadata.iter(f'{_DC}title', f'{_DC}description')
+                         if value.text)
+    return Item(header.findtext('{*}identifier'),
+                header.findtext('{*}datestamp'),
+                header.get('status') == 'deleted', text)
+
+
+def _int_or_none(text):
+    if text is None or not text.isdigit():
+        return None
+    return int(text)
+
+
+class Response:
+    """A single OAI-PMH response, parsed lazily in one streaming pass.
+    data - the raw xml of the response, as bytes or a spool.Spool
+
+    The parser only advances as far as the caller needs: the error code is
+    known after the first few elements, the resumption token only once the
+    whole document has been read. Records (or headers, or sets) are yielded
+    from the same pass and discarded once the consumer moves on; an Item
+    summary of each is kept, so storages need not parse the page again.
+    A response that is not well formed, or is not OAI-PMH at all, is
+    flagged as malformed once it has been read.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    # Elements that may appear before the verb element.
+    _HEAD_ELEMENTS = {'responseDate', 'request', 'error'}
+
+    def __init__(self, data):
+        self.data = data
+        self.record_count = 0
+        self._response_date = None
+        self._error = None
+        self._error_text = None
+        self._resumption_token = None
+        self._past_head = False
+        self._finished = False
+        self._malformed = False
+        self._summaries = []
+        self._items = self._parse()
+
+    @property
+    def response_date(self):
+        self._advance_until(lambda: self._past_head)
+        return self._response_date
+
+    @property
+    def error(self):
+        self._advance_until(lambda: self._past_head)
+        return self._error
+
+    @property
+    def error_text(self):
+        self._advance_until(lambda: self._past_head)
+        return self._error_text
+
+    @property
+    def resumption_token(self):
+        """The resumptionToken element, or None if the list is not paged.
+        Reads the rest of the response.
+        """
+        self._advance_until(lambda: False)
+        return self._resumption_token
+
+    @property
+    def malformed(self):
+        """Whether the response was cut short or is not OAI-PMH.
+        Reads the rest of the response.
+        """
+        self._advance_until(lambda: False)
+        return self._malformed
+
+    @property
+    def items(self):
+        """Item summaries of every record (or header, or set), in order.
+        Reads the rest of the response.
+        """
+        self._advance_until(lambda: False)
+        return self._summaries
+
+    def records(self):
+        """Lazily iterate over the items of a list response.
+        Yields the record, header or set elements, depending on the verb.
+        An element is cleared as soon as iteration moves past it.
+        If the response has already been read past its first item, it is
+        parsed again from the start.
+        """
+        if self.record_count > 0:
+            yield from Response(self.data).records()
+        else:
+            yield from self._items
+
+    def _advance_until(self, condition):
+        while not self._finished and not condition():
+            next(self._items, None)
+
+    def _feed(self, parser):
+        for chunk in spool.chunks(self.data, self.CHUNK_SIZE):
+            parser.feed(chunk)
+            yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+
+    def _parse(self):
+        parser = etree.XMLPullParser(events=('start', 'end'))
+        depth = 0
+        try:
+            for event, element in self._feed(parser):
+                if event == 'start':
+                    depth += 1
+                    if depth == 1 and local_name(element) != 'OAI-PMH':
+                        self._malformed = True
+                        break
+                    if depth == 2 \
+                            and local_name(element) not in self._HEAD_ELEMENTS:
+                        self._past_head = True
+                    continue
+                depth -= 1
+                if depth == 1:
+                    self._end_top_level(element)
+                elif depth == 2:
+                    name = local_name(element)
+                    if name == 'resumptionToken':
+                        self._end_resumption_token(element)
+                    else:
+                        self.record_count += 1
+                        self._summaries.append(item_summary(element))
+                        yield element
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+        except etree.XMLSyntaxError:
+            self._malformed = True
+        self._past_head = True
+        self._finished = True
+
+    def _end_top_level(self, element):
+        name = local_name(element)
+        if name == 'responseDate':
+            self._response_date = element.text
+        elif name == 'error':
+            self._error = element.get('code')
+            self._error_text = ''.join(element.itertext())
+
+    def _end_resumption_token(self, element):
+        self._resumption_token = ResumptionToken(
+            token=(element.text or '').strip(),
+            cursor=_int_or_none(element.get('cursor')),
+            complete_list_size=_int_or_none(element.get('completeListSize')),
+            expiration_date=element.get('expirationDate'))
+
 
 def base_oai_request(response_handler, verb, arguments={}):
     """ Sends a raw OAI-PMH request, and returns the response.
     Return:
         | Success:
-            | Data (raw xml)
+            | Response (parsed lazily, raw xml in Response.data)
         + HttpStatus
             | 302 Redirect
             + 503 Unavailable
@@ -120,15 +313,27 @@ def base_oai_request(response_handler, verb, arguments={}):
     if response.status_code != 200:
         raise HttpStatusError(response.status_code, response)
     else:
-        response.encoding = 'utf-8'
-        xml_text = response.text
-        xml_soup = BeautifulSoup(xml_text, 'lxml-xml')
-        if xml_soup.error is not None:
-            error = xml_soup.error['code']
-            error_text = xml_soup.error.get_text()
-            raise ApplicationError(error, error_text, response.content)
-        else:
-            return response.content
+        return parse_response(response.content)
+
+
+def parse_response(data):
+    """Wraps raw xml in a Response, raising if it carries an OAI error.
+    Return: see base_oai_request
+    """
+    response = Response(data)
+    if response.error is not None:
+        raise ApplicationError(response.error, response.error_text, data)
+    return response
+
+
+def request_identify(response_handler):
+    """Calls the Identify method.
+    Return: see base_oai_request
+    """
+    return base_oai_request(
+        response_handler=response_handler,
+        verb='Identify'
+    )
 
 
 def request_list_records(response_handler, metadata_prefix='oai_dc',
@@ -164,10 +369,74 @@ def resume_request_list_records(response_handler, resumption_token):
     )
 
 
-def resumption_token_from_response(response_data):
-    """Might raise, for now"""
-    xml_data = BeautifulSoup(response_data, 'lxml-xml')
-    resumption_token = xml_data.resumptionToken
-    if not resumption_token:
+def request_list_identifiers(response_handler, metadata_prefix='oai_dc',
+                             time_from=None, time_until=None,
+                             select_set=None):
+    """Calls the ListIdentifiers method, with an initial set of parameters.
+    Return: see base_oai_request
+    """
+    arguments = {}
+    arguments['metadataPrefix'] = metadata_prefix
+    if time_from:
+        arguments['from'] = time_from
+    if time_until:
+        arguments['until'] = time_until
+    if select_set:
+        arguments['set'] = select_set
+    return base_oai_request(
+        response_handler=response_handler,
+        verb='ListIdentifiers',
+        arguments=arguments
+    )
+
+
+def resume_request_list_identifiers(response_handler, resumption_token):
+    """Calls the ListIdentifiers method, using a resumption token.
+    Return: see base_oai_request
+    """
+    return base_oai_request(
+        response_handler=response_handler,
+        verb='ListIdentifiers',
+        arguments={
+            'resumptionToken': resumption_token
+        }
+    )
+
+
+def request_list_sets(response_handler):
+    """Calls the ListSets method.
+    Return: see base_oai_request
+    """
+    return base_oai_request(
+        response_handler=response_handler,
+        verb='ListSets'
+    )
+
+
+def resume_request_list_sets(response_handler, resumption_token):
+    """Calls the ListSets method, using a resumption token.
+    Return: see base_oai_request
+    """
+    return base_oai_request(
+        response_handler=response_handler,
+        verb='ListSets',
+        arguments={
+            'resumptionToken': resumption_token
+        }
+    )
+
+
+def resumption_token_from_response(response):
+    """Returns the resumption token text, or None at the end of a list.
+    response - a Response, or raw xml bytes
+    Raises MalformedResponseError rather than mistake a response that was
+    cut short for the end of the list.
+    """
+    if not isinstance(response, Response):
+        response = Response(response)
+    if response.malformed:
+        raise MalformedResponseError(response.data)
+    resumption_token = response.resumption_token
+    if not resumption_token or not resumption_token.token:
         return None
-    return resumption_token.text
+    return resumption_token.token
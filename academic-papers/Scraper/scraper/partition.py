@@ -0,0 +1,213 @@
+"""Scraper partition module.
+Splits a single repository harvest into independent resumption chains
+(by set, or by datestamp window) and runs them concurrently under gevent.
+"""
+
+from collections import namedtuple
+from datetime import timedelta
+from functools import partial
+import gevent
+import gevent.lock
+import gevent.pool
+from scraper import oai
+from scraper import rate
+from scraper import retry
+from scraper import scraper
+from scraper import timing
+
+
+Partition = namedtuple('Partition',
+                       ['name', 'time_from', 'time_until', 'select_set'])
+
+
+def set_partitions(response_handler):
+    """One partition per set, following the ListSets token chain."""
+    partitions = []
+    request = partial(oai.request_list_sets, response_handler)
+    while request is not None:
+        response = request()
+        for element in response.records():
+            spec = element.findtext('{*}setSpec')
+            if spec:
+                partitions.append(Partition(spec, None, None, spec))
+        token = oai.resumption_token_from_response(response)
+        request = token and partial(oai.resume_request_list_sets,
+                                    response_handler, token)
+    return partitions
+
+
+def window_partitions(start, end, days):
+    """Partitions covering [start, end] in windows of the given length.
+    start, end - datetime.date, both inclusive
+    """
+    assert days >= 1
+    partitions = []
+    window_start = start
+    while window_start <= end:
+        window_end = min(window_start + timedelta(days=days - 1), end)
+        time_from = window_start.isoformat()
+        time_until = window_end.isoformat()
+        partitions.append(Partition(f'{time_from}..{time_until}',
+                                    time_from, time_until, None))
+        window_start = window_end + timedelta(days=1)
+    return partitions
+
+
+def initial_request(response_handler, partition, metadata_prefix='oai_dc'):
+    return partial(oai.request_list_records, response_handler,
+                   metadata_prefix=metadata_prefix,
+                   time_from=partition.time_from,
+                   time_until=partition.time_until,
+                   select_set=partition.select_set)
+
+
+def green_handler(response_handler, max_per_host):
+    """Wraps a blocking response handler for use from greenlets.
+    Requests run on the gevent threadpool, at most max_per_host at a time.
+    """
+    semaphore = gevent.lock.BoundedSemaphore(max_per_host)
+    threadpool = gevent.get_hub().threadpool
+    threadpool.maxsize = max(threadpool.maxsize, max_per_host)
+
+    def _handler(data):
+        with semaphore:
+            return threadpool.apply(response_handler, (data,))
+    # Keeps the host known, for rate.handler_limiter.
+    _handler.url = getattr(response_handler, 'url', None)
+    return _handler
+
+
+class PartitionProgress:
+    """How far the harvest of one partition has got.
+    pages, bytes - stored so far
+    skipped - pages fetched but not stored, as a wrapped storage (see
+    dedup.DedupStorage) found nothing new in them
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.state = PartitionProgress.PENDING
+        self.pages = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.error = None
+
+    def __str__(self):
+        skipped = f', {self.skipped} unchanged pages skipped' \
+            if self.skipped else ''
+        return (f'{self.partition.name}: {self.state}, {self.pages} pages, '
+                f'{self.bytes} bytes{skipped}')
+
+
+class ProgressStorage:
+    """Forwards to the shared storage, counting what one partition stores.
+    tag_resumptions - log each resumption token after the partition's name
+    and a tab, so the chains sharing the storage can be told apart in its
+    resumption log; the end of the chain is logged as NONE
+    """
+
+    def __init__(self, storage, progress, tag_resumptions=False):
+        self._storage = storage
+        self._progress = progress
+        self._tag_resumptions = tag_resumptions
+
+    def available_storage(self):
+        return self._storage.available_storage()
+
+    def has_space(self, data):
+        return self._storage.has_space(data)
+
+    def reserve(self, nbytes):
+        return self._storage.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        part = self._storage.store(data, records=records, token=token,
+                                   items=items, reservation=reservation)
+        if part is None:
+            self._progress.skipped += 1
+        else:
+            self._progress.pages += 1
+            self._progress.bytes += len(data)
+        return part
+
+    def log_resumption(self, token):
+        if self._tag_resumptions:
+            token = f'{self._progress.partition.name}\t{token or "NONE"}'
+        self._storage.log_resumption(token)
+
+    def page_count(self):
+        return self._storage.page_count()
+
+    def sync(self):
+        self._storage.sync()
+
+
+class PartitionedHarvester:
+    """Harvests every partition of one repository into one storage.
+    concurrency - number of resumption chains run at once
+    max_per_host - number of requests in flight to the host at once
+    limiter - rate.RateLimiter pacing all chains together; by default
+    the one rate.handler_limiter gives for response_handler
+    monitor - ActorRef of a monitor.Monitor every chain reports to
+    timer - timing.Timer shared by every chain
+    retry_policy, breaker - see scraper.Worker; the breaker pauses every
+    chain at once
+    """
+
+    def __init__(self, storage, response_handler, partitions,
+                 concurrency=4, max_per_host=None,
+                 metadata_prefix='oai_dc', limiter=None, monitor=None,
+                 timer=timing.NULL_TIMER, retry_policy=retry.NO_RETRY,
+                 breaker=None):
+        self.storage = storage
+        self.limiter = limiter
+        self.monitor = monitor
+        self.timer = timer
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self.response_handler = green_handler(
+            response_handler, max_per_host or concurrency)
+        self.progress = [PartitionProgress(partition)
+                         for partition in partitions]
+        self._pool = gevent.pool.Pool(concurrency)
+        self._metadata_prefix = metadata_prefix
+
+    def _harvest(self, progress, limiter, max_requests, suggested_wait):
+        progress.state = PartitionProgress.RUNNING
+        worker = scraper.Worker(ProgressStorage(self.storage, progress,
+                                                tag_resumptions=True),
+                                self.response_handler, sleep=gevent.sleep,
+                                limiter=limiter, monitor=self.monitor,
+                                timer=self.timer,
+                                retry_policy=self.retry_policy,
+                                breaker=self.breaker)
+        initial = initial_request(self.response_handler, progress.partition,
+                                  self._metadata_prefix)
+        try:
+            worker.run(initial, max_requests, suggested_wait)
+            progress.state = PartitionProgress.DONE
+        except RuntimeError as err:
+            progress.state = PartitionProgress.FAILED
+            progress.error = err
+        print(f'Partition {progress}.')
+
+    def run(self, max_requests=None, suggested_wait=0):
+        """Runs all partitions, returning their progress once finished.
+        max_requests - applies to each partition separately
+        """
+        limiter = self.limiter or rate.handler_limiter(
+            self.response_handler, min_interval=suggested_wait)
+        for progress in self.progress:
+            self._pool.spawn(self._harvest, progress, limiter,
+                             max_requests, suggested_wait)
+        self._pool.join()
+        return self.progress
+
+    def report(self):
+        return '\n'.join(str(progress) for progress in self.progress)
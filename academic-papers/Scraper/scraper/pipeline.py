@@ -0,0 +1,103 @@
+"""Scraper pipeline module.
+A Worker that overlaps fetching the next page with writing the last one.
+Pages are parsed for their resumption token as soon as they arrive, then
+handed to a background writer through a bounded queue; when the disk falls
+behind, the queue fills and fetching waits.
+"""
+
+import queue
+import threading
+from scraper import oai
+from scraper import scraper
+from scraper import timing
+
+
+_STOP = object()
+
+
+class PipelinedWorker(scraper.Worker):
+    """scraper.Worker with storage writes moved to a background thread.
+    queue_size - pages that may wait for the writer before fetching blocks
+    """
+
+    def __init__(self, storage, response_handler, queue_size=2, **kwargs):
+        super().__init__(storage, response_handler, **kwargs)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending_bytes = 0
+        self._pending_lock = threading.Lock()
+        self._writer = None
+        self._writer_error = None
+
+    def _write_pages(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                (data, records, resumption_token, items) = item
+                if self._writer_error is None:
+                    started = self.timer.start()
+                    self.storage.store(data, records=records,
+                                       token=resumption_token, items=items)
+                    self.storage.log_resumption(resumption_token)
+                    self.timer.lap(timing.STORE, started)
+                    super()._record_checkpoint(resumption_token)
+            except Exception as err:
+                self._writer_error = err
+            finally:
+                if item is not _STOP:
+                    with self._pending_lock:
+                        self._pending_bytes -= len(item[0])
+                self._queue.task_done()
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            err = self._writer_error
+            raise RuntimeError(f'Background write failed with '
+                               f'{type(err).__name__}.') from err
+
+    def _enqueue(self, response):
+        self._raise_writer_error()
+        data = response.data
+        with self._pending_lock:
+            available = self.storage.available_storage() - self._pending_bytes
+            if len(data) > available:
+                raise scraper.OutOfSpaceError(len(data), available)
+            self._pending_bytes += len(data)
+        started = self.timer.start()
+        resumption_token = oai.resumption_token_from_response(response)
+        records = response.record_count
+        self.timer.lap(timing.PARSE, started)
+        self._queue.put((data, records, resumption_token, response.items))
+
+    def _record_checkpoint(self, resumption_token):
+        # Pages are only checkpointed once the writer has stored them.
+        pass
+
+    def store_single_request(self, request):
+        try:
+            data = self._send(request)
+        except oai.HttpStatusError as err:
+            scraper.check_wait(err)
+            raise
+        response = scraper.as_response(data)
+        self._enqueue(response)
+        return response
+
+    def run(self, initial, max_requests=None, suggested_wait=0, skip=0,
+            restart=None):
+        """See scraper.Worker.run. Returns once every page is written."""
+        self._writer_error = None
+        self._writer = threading.Thread(target=self._write_pages,
+                                        name='pipeline-writer', daemon=True)
+        self._writer.start()
+        try:
+            num_requests = super().run(initial, max_requests, suggested_wait,
+                                       skip, restart)
+        finally:
+            self._queue.put(_STOP)
+            self._writer.join()
+            if self.checkpoint is not None:
+                self.checkpoint.sync()
+        self._raise_writer_error()
+        return num_requests
@@ -0,0 +1,175 @@
+"""Scraper rate module.
+Per-host token bucket rate limiting, adapting to the throttling the server
+actually asks for, and a cap on the bandwidth used across hosts.
+"""
+
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """Token bucket controlling when requests to one host may start.
+    min_interval - fastest allowed pace, in seconds between requests
+    max_interval - slowest pace backed off to while being throttled
+    burst - number of requests that may start back to back
+    The bucket is kept as the time the next request may start once the
+    burst is used up, so the bucket refills while a request is in flight,
+    and a request's own latency is subtracted from the wait before the
+    next one.
+    """
+
+    BACKOFF_FACTOR = 2.0
+    RECOVERY_FACTOR = 0.5
+
+    def __init__(self, min_interval=0, max_interval=300, burst=1,
+                 clock=time.monotonic):
+        assert 0 <= min_interval <= max_interval
+        assert burst >= 1
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._burst = burst
+        self._clock = clock
+        self._next = clock()
+        self._blocked_until = None
+        self._lock = threading.Lock()
+
+    def _earliest(self):
+        """The time the next request may start."""
+        earliest = self._next - (self._burst - 1) * self.interval
+        if self._blocked_until is not None:
+            earliest = max(earliest, self._blocked_until)
+        return earliest
+
+    def _set_interval(self, interval):
+        # Requests already made are paced by the new interval too.
+        self._next += interval - self.interval
+        self.interval = interval
+
+    def delay(self):
+        """Seconds to wait before the next request may start.
+        Only a hint; use reserve to actually take the slot.
+        """
+        with self._lock:
+            return max(0, self._earliest() - self._clock())
+
+    def reserve(self):
+        """Takes the next slot for a request.
+        Return: seconds to wait before sending it; concurrent callers
+        are each given a slot of their own, one interval apart
+        """
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._earliest())
+            self._next = max(self._next, start) + self.interval
+            if self._blocked_until is not None \
+                    and self._blocked_until <= now:
+                self._blocked_until = None
+            return start - now
+
+    def acquire(self):
+        """Records the start of a request sent without waiting."""
+        self.reserve()
+
+    def is_throttled(self):
+        """Whether the next request is held back by a Retry-After."""
+        with self._lock:
+            return self._blocked_until is not None \
+                and self._blocked_until > self._clock()
+
+    def on_success(self):
+        """The server answered normally; speed back up towards min_interval."""
+        with self._lock:
+            interval = max(self.min_interval,
+                           self.interval * self.RECOVERY_FACTOR)
+            if interval - self.min_interval < 0.01:
+                interval = self.min_interval
+            self._set_interval(interval)
+
+    def set_min_interval(self, min_interval):
+        """Changes the fastest allowed pace, from the next request on.
+        A pace backed off to by throttling is kept if it is slower.
+        """
+        assert 0 <= min_interval <= self.max_interval
+        with self._lock:
+            if self.interval == self.min_interval:
+                self._set_interval(min_interval)
+            else:
+                self._set_interval(max(self.interval, min_interval))
+            self.min_interval = min_interval
+
+    def on_throttle(self, retry_after):
+        """The server asked us to wait retry_after seconds.
+        The wait applies once: a single request is let through when it
+        ends, and the rest follow at the pace, which is also slowed so
+        that we do not immediately run into the limit again.
+        """
+        with self._lock:
+            now = self._clock()
+            self._set_interval(min(self.max_interval,
+                                   max(self.interval * self.BACKOFF_FACTOR,
+                                       self.min_interval, 1)))
+            self._blocked_until = now + retry_after
+            self._next = max(self._next, self._blocked_until
+                             + (self._burst - 1) * self.interval)
+
+
+class BandwidthLimiter:
+    """Caps the bytes downloaded per second, summed over every host.
+    A page is only counted once it has downloaded, so a large one may
+    overdraw the allowance; requests then wait until it is paid back.
+    """
+
+    def __init__(self, bytes_per_second, clock=time.monotonic):
+        assert bytes_per_second > 0
+        self.bytes_per_second = bytes_per_second
+        self._clock = clock
+        self._allowance = bytes_per_second
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._allowance = min(self.bytes_per_second,
+                              self._allowance
+                              + elapsed * self.bytes_per_second)
+        self._updated = now
+
+    def delay(self):
+        """Seconds to wait before the next request may start."""
+        with self._lock:
+            self._refill(self._clock())
+            return max(0, -self._allowance / self.bytes_per_second)
+
+    def consume(self, nbytes):
+        """Records nbytes downloaded."""
+        with self._lock:
+            self._refill(self._clock())
+            self._allowance -= nbytes
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(url, **kwargs):
+    """The shared RateLimiter for the host serving url.
+    kwargs - passed to RateLimiter when the host is first seen
+    """
+    host = urlparse(url).netloc or url
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(**kwargs)
+        return _limiters[host]
+
+
+def handler_limiter(response_handler, **kwargs):
+    """The shared RateLimiter for the host response_handler sends to.
+    A handler without a url (e.g. a test fake) gets a limiter of its own.
+    kwargs - see limiter_for
+    """
+    url = getattr(response_handler, 'url', None)
+    if url is None:
+        return RateLimiter(**kwargs)
+    return limiter_for(url, **kwargs)
@@ -0,0 +1,171 @@
+"""Scraper records module.
+A storage that keeps records rather than pages: each page is split into
+its records, which are written to a SQLite table keyed by identifier, so
+they can be looked up and exported without a pass over the pages.
+"""
+
+from collections import namedtuple
+import os
+import sqlite3
+import threading
+from lxml import etree
+from scraper import oai
+from scraper import storage
+
+
+Record = namedtuple('Record', ['identifier', 'datestamp', 'deleted', 'xml'])
+
+
+class RecordStorage:
+    """Stores the records of each page as rows of a SQLite database.
+    A record replaces the stored one with the same identifier unless its
+    datestamp is older. Datestamps are compared as strings, which orders
+    them correctly as long as the repository's granularity does not change.
+    batch_size - records written per transaction; records waiting for a
+    full batch are written by sync
+    Records without an identifier (a set, say) are not kept.
+    """
+
+    # Not dedup.RecordIndex.FILENAME, which may share the directory.
+    FILENAME = 'record_store.sqlite'
+    EXPORT_BATCH = 1000
+
+    def __init__(self, root_directory, batch_size=5000, budget=None):
+        """budget - storage.SpaceBudget to account against; by default the
+        one shared by the directory
+        """
+        self._path = os.path.join(root_directory, self.FILENAME)
+        self._budget = budget or storage.space_budget(root_directory)
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self._path,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                ' identifier TEXT PRIMARY KEY, datestamp TEXT NOT NULL,'
+                ' deleted INTEGER NOT NULL, part INTEGER NOT NULL,'
+                ' xml BLOB NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS records_datestamp'
+                ' ON records (datestamp, identifier)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                ' part INTEGER PRIMARY KEY, records INTEGER, token TEXT)')
+        (self._page_count,) = self._connection.execute(
+            'SELECT COALESCE(MAX(part), 0) FROM pages').fetchone()
+        self._pending_records = []
+        self._pending_pages = []
+
+    def available_storage(self):
+        return self._budget.available()
+
+    def has_space(self, data):
+        """See if storage has enough space.
+        data - must by bytes
+        Checks against the size of the page, an upper bound on its records.
+        """
+        return len(data) <= self.available_storage()
+
+    def reserve(self, nbytes):
+        """See storage.SpaceBudget.reserve."""
+        return self._budget.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        """Splits data into its records, and queues them to be written.
+        data - bytes, or a spool.Spool
+        items - unused, as the page is parsed again for the records' xml
+        reservation - see storage.SpaceBudget.charge
+        Return: the part number of the page
+        """
+        if not self._budget.charge(len(data), reservation):
+            raise RuntimeError('Not enough space remaining to store data.')
+        with self._lock:
+            self._page_count += 1
+            part = self._page_count
+            count = 0
+            for element in oai.Response(data).records():
+                item = oai.item_summary(element)
+                if item.identifier is None or item.datestamp is None:
+                    continue
+                self._pending_records.append(
+                    (item.identifier, item.datestamp, item.deleted, part,
+                     etree.tostring(element, encoding='UTF-8')))
+                count += 1
+            self._pending_pages.append((part, count, token))
+            if len(self._pending_records) >= self._batch_size:
+                self._flush()
+        return part
+
+    def _flush(self):
+        """Writes the queued records and pages in one transaction."""
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO records'
+                ' (identifier, datestamp, deleted, part, xml)'
+                ' VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT (identifier) DO UPDATE SET'
+                ' datestamp = excluded.datestamp,'
+                ' deleted = excluded.deleted, part = excluded.part,'
+                ' xml = excluded.xml'
+                ' WHERE excluded.datestamp >= records.datestamp',
+                self._pending_records)
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO pages (part, records, token)'
+                ' VALUES (?, ?, ?)', self._pending_pages)
+        self._pending_records = []
+        self._pending_pages = []
+
+    def log_resumption(self, token):
+        """Tokens are kept with their page; see store."""
+
+    def page_count(self):
+        return self._page_count
+
+    def sync(self):
+        """Writes the queued records, and flushes the database to disk."""
+        with self._lock:
+            self._flush()
+            self._connection.execute('PRAGMA wal_checkpoint(FULL)')
+
+    def get(self, identifier):
+        """Return: the Record stored for identifier, or None"""
+        with self._lock:
+            self._flush()
+            row = self._connection.execute(
+                'SELECT identifier, datestamp, deleted, xml FROM records'
+                ' WHERE identifier = ?', (identifier,)).fetchone()
+        return row and Record(row[0], row[1], bool(row[2]), row[3])
+
+    def export(self, since=None, deleted=True):
+        """Every stored record, in datestamp order.
+        since - only records with a datestamp from this one on
+        deleted - whether to include deleted records
+        Return: generator of Records, read on a connection of its own, so
+        storing may go on while it is used
+        """
+        self.sync()
+        query = 'SELECT identifier, datestamp, deleted, xml FROM records' \
+                ' WHERE datestamp >= ?'
+        if not deleted:
+            query += ' AND NOT deleted'
+        query += ' ORDER BY datestamp, identifier'
+        connection = sqlite3.connect(self._path)
+        try:
+            cursor = connection.execute(query, (since or '',))
+            while True:
+                rows = cursor.fetchmany(self.EXPORT_BATCH)
+                if not rows:
+                    return
+                for row in rows:
+                    yield Record(row[0], row[1], bool(row[2]), row[3])
+        finally:
+            connection.close()
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,158 @@
+"""Scraper retry module.
+Decides which failures of a request are worth trying again, how long to
+back off before doing so, and when a host has failed often enough that
+every chain harvesting it should pause for a while.
+"""
+
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from scraper import oai
+
+
+class RequestError(Exception):
+    """A request got no answer, e.g. the connection dropped or timed out.
+    error - the exception the response handler raised
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+    def __str__(self):
+        return f'RequestError[{type(self.error).__name__}: {self.error}]'
+
+
+class RetryPolicy:
+    """Classifies request failures, and spaces out the retries.
+    max_attempts - retries of one request before giving up, None for no
+    limit
+    base_delay - backoff before the first retry, in seconds; it doubles
+    with every failure after that, up to max_delay
+    Backoffs are jittered between half and all of the doubled delay, so
+    chains that failed together do not all come back at once.
+    """
+
+    FATAL = 'fatal'
+    TRANSIENT = 'transient'          # the same request may well succeed
+    BAD_TOKEN = 'bad_token'          # the chain must be followed again
+
+    TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts=8, base_delay=1, max_delay=300,
+                 random=random.random):
+        assert max_attempts is None or max_attempts >= 0
+        assert 0 <= base_delay <= max_delay
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random
+
+    def classify(self, error):
+        """Return: FATAL, TRANSIENT or BAD_TOKEN"""
+        if isinstance(error, oai.HttpStatusError):
+            return self.TRANSIENT if error.code in self.TRANSIENT_STATUS \
+                else self.FATAL
+        if isinstance(error, oai.ApplicationError):
+            return self.BAD_TOKEN \
+                if error.error == oai.ApplicationError.BAD_RESUMPTION_TOKEN \
+                else self.FATAL
+        if isinstance(error, (RequestError, oai.MalformedResponseError)):
+            # A malformed response is usually a body cut short.
+            return self.TRANSIENT
+        return self.FATAL
+
+    def allows(self, attempt):
+        """Whether a request that has failed attempt times may be retried."""
+        return self.max_attempts is None or attempt <= self.max_attempts
+
+    def delay(self, attempt):
+        """Seconds to back off after a request failed for the attempt'th
+        time in a row.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + self._random() * delay / 2
+
+
+NO_RETRY = RetryPolicy(max_attempts=0)
+
+
+class CircuitBreaker:
+    """Stops every chain harvesting a host once it keeps failing.
+    failure_threshold - failures in a row, from any chain, that open the
+    circuit
+    reset_timeout - seconds the circuit stays open before one request is
+    let through to try the host again; if that trial never reports back,
+    another is let through after as long again
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # How often chains waiting on a trial request check back, in seconds.
+    TRIAL_POLL = 1
+
+    def __init__(self, failure_threshold=5, reset_timeout=60,
+                 clock=time.monotonic):
+        assert failure_threshold >= 1
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds to wait before the next request may be sent.
+        Once the circuit has been open for reset_timeout, the first caller
+        gets 0 and makes the trial request; the others keep waiting on it.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0
+            now = self._clock()
+            if self.state == self.HALF_OPEN:
+                if now - self._trial_at < self.reset_timeout:
+                    return min(self.TRIAL_POLL, self.reset_timeout)
+            else:
+                remaining = self._opened_at + self.reset_timeout - now
+                if remaining > 0:
+                    return remaining
+                self.state = self.HALF_OPEN
+            self._trial_at = now
+            return 0
+
+    def on_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def on_failure(self):
+        """Return: whether this failure opened the circuit"""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN \
+                    or (self.state == self.CLOSED
+                        and self._failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                return True
+            return False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url, **kwargs):
+    """The shared CircuitBreaker for the host serving url.
+    kwargs - passed to CircuitBreaker when the host is first seen
+    """
+    host = urlparse(url).netloc or url
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(**kwargs)
+        return _breakers[host]
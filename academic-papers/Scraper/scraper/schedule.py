@@ -0,0 +1,237 @@
+"""Scraper schedule module.
+Harvests many OAI endpoints from one process, each politely paced, so the
+throughput is the sum over the hosts rather than that of the slowest.
+
+Every endpoint follows its own resumption chain, one request at a time.
+Endpoints waiting for their next request sit in a heap keyed on when their
+host next allows one; the earliest is sent as soon as a slot is free under
+the global concurrency and bandwidth caps.
+"""
+
+from collections import namedtuple
+from functools import partial
+import heapq
+import itertools
+import json
+import time
+import gevent
+import gevent.event
+import gevent.pool
+from scraper import oai
+from scraper import partition
+from scraper import rate
+from scraper import retry
+from scraper import scraper
+from scraper import timing
+
+
+Endpoint = namedtuple('Endpoint',
+                      ['name', 'url', 'wait', 'metadata_prefix',
+                       'time_from', 'time_until', 'select_set'])
+
+
+def read_endpoints(path):
+    """Reads the endpoints to harvest from a json file, a list of objects
+    with a name and url, and optionally:
+    wait - fewest seconds between requests to the host
+    metadata_prefix, from, until, set - arguments of the ListRecords request
+    Return: list of Endpoint
+    """
+    with open(path) as f:
+        config = json.load(f)
+    endpoints = [Endpoint(entry['name'], entry['url'],
+                          entry.get('wait', 0),
+                          entry.get('metadata_prefix', 'oai_dc'),
+                          entry.get('from'), entry.get('until'),
+                          entry.get('set'))
+                 for entry in config]
+    names = [endpoint.name for endpoint in endpoints]
+    if len(set(names)) != len(names):
+        raise ValueError('Endpoint names must be unique.')
+    return endpoints
+
+
+class _Chain:
+    """The state of one endpoint's resumption chain."""
+
+    def __init__(self, endpoint, storage, response_handler, breaker,
+                 timer):
+        self.endpoint = endpoint
+        self.progress = partition.PartitionProgress(endpoint)
+        self.handler = partition.green_handler(response_handler, 1)
+        self.limiter = rate.limiter_for(endpoint.url,
+                                        min_interval=endpoint.wait)
+        self.breaker = breaker
+        self.worker = scraper.Worker(
+            partition.ProgressStorage(storage, self.progress),
+            self.handler, timer=timer)
+        self.initial = partial(oai.request_list_records, self.handler,
+                               endpoint.metadata_prefix, endpoint.time_from,
+                               endpoint.time_until, endpoint.select_set)
+        self.request = self.initial
+        # As in scraper.Worker.run, for following the chain again after a
+        # bad token.
+        self.skip = 0
+        self.stored = 0
+        self.followed = 0
+        self.attempt = 0
+        self.num_requests = 0
+
+
+class Scheduler:
+    """Harvests every endpoint's ListRecords chain into its own storage.
+    chains - list of (Endpoint, storage, response handler)
+    concurrency - requests in flight at once, over all endpoints
+    bytes_per_second - cap on the download rate over all endpoints, or None
+    retry_policy - retry.RetryPolicy for failed requests; by default a
+    failure ends the endpoint's harvest, but not the others'
+    circuit_reset - if given, hosts that keep failing are paused this many
+    seconds (see retry.CircuitBreaker)
+    max_requests - pages stored per endpoint at most
+    """
+
+    def __init__(self, chains, concurrency=8, bytes_per_second=None,
+                 retry_policy=retry.NO_RETRY, circuit_reset=None,
+                 max_requests=None, timer=timing.NULL_TIMER,
+                 clock=time.monotonic):
+        assert concurrency >= 1
+        self.retry_policy = retry_policy
+        self.max_requests = max_requests
+        self._chains = [
+            _Chain(endpoint, storage, response_handler,
+                   None if circuit_reset is None
+                   else retry.breaker_for(endpoint.url,
+                                          reset_timeout=circuit_reset),
+                   timer)
+            for (endpoint, storage, response_handler) in chains]
+        self.progress = [chain.progress for chain in self._chains]
+        self._concurrency = concurrency
+        self._bandwidth = bytes_per_second and rate.BandwidthLimiter(
+            bytes_per_second, clock=clock)
+        self._clock = clock
+        self._heap = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._wakeup = gevent.event.Event()
+        self._group = gevent.pool.Group()
+
+    def _push(self, chain, delay=0):
+        """Queues chain's next request, at the earliest delay seconds on."""
+        ready = self._clock() + max(delay, chain.limiter.delay())
+        heapq.heappush(self._heap, (ready, next(self._order), chain))
+        self._wakeup.set()
+
+    def _wait(self, seconds=None):
+        """Waits seconds, or until a request finishes or is queued."""
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def run(self):
+        """Harvests until every chain is done or has failed.
+        Return: the partition.PartitionProgress of every endpoint
+        """
+        for chain in self._chains:
+            chain.progress.state = partition.PartitionProgress.RUNNING
+            self._push(chain)
+        while self._heap or self._in_flight:
+            if not self._heap or self._in_flight >= self._concurrency:
+                self._wait()
+                continue
+            wait = self._heap[0][0] - self._clock()
+            if self._bandwidth:
+                wait = max(wait, self._bandwidth.delay())
+            if wait > 0:
+                self._wait(wait)
+                continue
+            (_, _, chain) = heapq.heappop(self._heap)
+            # Other endpoints on the same host may have gone since chain
+            # was queued.
+            wait = chain.limiter.delay()
+            if wait <= 0 and chain.breaker is not None:
+                wait = chain.breaker.delay()
+            if wait > 0:
+                self._push(chain, wait)
+                continue
+            chain.limiter.acquire()
+            self._in_flight += 1
+            self._group.spawn(self._step, chain)
+        self._group.join()
+        return self.progress
+
+    def _step(self, chain):
+        try:
+            self._send(chain)
+        finally:
+            self._in_flight -= 1
+            self._wakeup.set()
+
+    def _finish(self, chain, state, error=None):
+        chain.progress.state = state
+        chain.progress.error = error
+        print(f'Endpoint {chain.progress}.')
+
+    def _send(self, chain):
+        """Sends chain's next request, and queues the one after it."""
+        try:
+            if chain.skip > 0:
+                response = chain.worker.skip_single_request(chain.request)
+                chain.skip -= 1
+            else:
+                response = chain.worker.store_single_request(chain.request)
+                chain.num_requests += 1
+        except scraper.WaitError as err:
+            chain.limiter.on_throttle(err.wait)
+            print(f'{chain.endpoint.name}: recieved wait with time '
+                  f'{err.wait}.')
+            self._push(chain)
+            return
+        except scraper.OutOfSpaceError as err:
+            self._finish(chain, partition.PartitionProgress.FAILED, err)
+            return
+        except Exception as err:
+            self._retry(chain, err)
+            return
+        if self._bandwidth:
+            self._bandwidth.consume(len(response.data))
+        chain.followed += 1
+        chain.attempt = 0
+        chain.limiter.on_success()
+        if chain.breaker is not None:
+            chain.breaker.on_success()
+        token = oai.resumption_token_from_response(response)
+        if token is None:
+            self._finish(chain, partition.PartitionProgress.DONE)
+        elif self.max_requests is not None \
+                and chain.num_requests >= self.max_requests:
+            # Stopped short; the rest of the chain is still to harvest.
+            self._finish(chain, partition.PartitionProgress.PENDING)
+        else:
+            chain.request = partial(oai.resume_request_list_records,
+                                    chain.handler, token)
+            self._push(chain)
+
+    def _retry(self, chain, err):
+        """Queues chain's request again after a failure, if it may be."""
+        if isinstance(err, oai.ApplicationError) \
+                and err.error == oai.ApplicationError.NO_RECORDS_MATCH:
+            self._finish(chain, partition.PartitionProgress.DONE)
+            return
+        chain.attempt += 1
+        kind = self.retry_policy.classify(err)
+        if kind == retry.RetryPolicy.FATAL \
+                or not self.retry_policy.allows(chain.attempt):
+            self._finish(chain, partition.PartitionProgress.FAILED, err)
+            return
+        if kind == retry.RetryPolicy.TRANSIENT and chain.breaker is not None:
+            chain.breaker.on_failure()
+        if kind == retry.RetryPolicy.BAD_TOKEN:
+            chain.stored = max(chain.stored, chain.followed)
+            chain.request = chain.initial
+            chain.skip = chain.stored
+            chain.followed = 0
+        print(f'{chain.endpoint.name}: retrying after {err} '
+              f'(attempt {chain.attempt}).')
+        self._push(chain, self.retry_policy.delay(chain.attempt))
+
+    def report(self):
+        return '\n'.join(str(progress) for progress in self.progress)
@@ -1,6 +1,9 @@
 from functools import partial
-from time import sleep
+from time import monotonic, sleep
 from scraper import oai
+from scraper import rate
+from scraper import retry
+from scraper import timing
 
 
 class WaitError(Exception):
@@ -27,68 +30,308 @@ def _convert_to_wait_error(error):
     return WaitError(int(msg.headers['Retry-After']))
 
 
+def check_wait(error):
+    """Raises a WaitError if an http error asks us to come back later."""
+    if _is_http_wait(error):
+        raise _convert_to_wait_error(error)
+
+
+def as_response(data):
+    if isinstance(data, oai.Response):
+        return data
+    return oai.Response(data)
+
+
+def store(data, storage, timer=timing.NULL_TIMER, reservation=None):
+    """Stores a single response and logs its resumption token.
+    data - an oai.Response, or raw xml bytes
+    timer - timing.Timer for the parse and store phases
+    reservation - storage.Reservation made for data, settled into the
+    charge for it once stored
+    Return: the oai.Response, for reuse by the caller
+    """
+    response = as_response(data)
+    if reservation is None or not reservation.is_held():
+        has_space = storage.has_space(response.data)
+    else:
+        has_space = len(response.data) <= \
+            storage.available_storage() + reservation.nbytes
+    if not has_space:
+        raise OutOfSpaceError(len(response.data),
+                              storage.available_storage())
+    started = timer.start()
+    resumption_token = oai.resumption_token_from_response(response)
+    records = response.record_count
+    started = timer.lap(timing.PARSE, started)
+    storage.store(response.data, records=records, token=resumption_token,
+                  items=response.items, reservation=reservation)
+    storage.log_resumption(resumption_token)
+    timer.lap(timing.STORE, started)
+    return response
+
+
+def _reserve(storage, nbytes):
+    if nbytes <= 0:
+        return None
+    reservation = storage.reserve(nbytes)
+    if reservation is None:
+        raise OutOfSpaceError(nbytes, storage.available_storage())
+    return reservation
+
+
+def send_and_store_single_request(storage, request, expected_size=0,
+                                  timer=timing.NULL_TIMER):
+    """Sends a request and stores its response.
+    expected_size - bytes reserved in storage while the request is in
+    flight, so concurrent writers cannot claim the same space
+    timer - see store
+    """
+    reservation = _reserve(storage, expected_size)
+    try:
+        try:
+            data = request()
+        except oai.HttpStatusError as err:
+            check_wait(err)
+            raise
+        return store(data, storage, timer, reservation)
+    finally:
+        # Only frees the space if the page was not stored, as storing
+        # settles the reservation into the charge for it.
+        if reservation is not None:
+            reservation.release()
+
+
+def send_and_store_many_requests(storage, response_handler, initial,
+                                 max_requests=None, suggested_wait=0,
+                                 checkpoint=None, skip=0):
+    worker = Worker(storage, response_handler, checkpoint=checkpoint)
+    return worker.run(initial, max_requests, suggested_wait, skip)
+
+
+def _unhandled(err):
+    """Return: the RuntimeError a Worker gives up on err with"""
+    if isinstance(err, oai.HttpStatusError):
+        return RuntimeError(f'Unhandled http response with code {err.code}')
+    if isinstance(err, oai.ApplicationError):
+        return RuntimeError(f'Unhandled OAI error of type {err.error}')
+    if isinstance(err, oai.MalformedResponseError):
+        return RuntimeError(f'Malformed response of {len(err.data)} bytes')
+    if isinstance(err, retry.RequestError):
+        return RuntimeError(f'Request failed with '
+                            f'{type(err.error).__name__}.')
+    return RuntimeError(f'Encountered error of unexpected type '
+                        f'{type(err).__name__}.')
+
+
+def resume_point(checkpoint, storage):
+    """Where to pick a checkpointed harvest back up.
+    Pages stored after the checkpoint was last synced are fetched again to
+    follow the chain, but not stored twice.
+    Return: (token, number of pages to skip), or None to start over
+    """
+    if not checkpoint.exists() or checkpoint.token is None:
+        return None
+    return (checkpoint.token,
+            max(0, storage.page_count() - checkpoint.part))
+
+
 class Worker:
 
-    def __init__(self, storage, response_handler):
+    def __init__(self, storage, response_handler, sleep=sleep, limiter=None,
+                 checkpoint=None, monitor=None, timer=timing.NULL_TIMER,
+                 retry_policy=retry.NO_RETRY, breaker=None):
+        """limiter - rate.RateLimiter shared with other workers on the same
+        host; by default the one rate.handler_limiter gives for
+        response_handler, paced by suggested_wait when first made
+        checkpoint - checkpoint.Checkpoint updated as pages are stored
+        monitor - ActorRef of a monitor.Monitor to send progress updates to
+        timer - timing.Timer for the parse, store and sleep phases; the
+        response handler times the http phases (see client.SessionHandler)
+        retry_policy - retry.RetryPolicy for failed requests; by default
+        any failure ends the run
+        breaker - retry.CircuitBreaker shared with other workers on the
+        same host, pausing them all while it is open
+        """
         self.storage = storage
         self.response_handler = response_handler
+        self.limiter = limiter
+        self.checkpoint = checkpoint
+        self.monitor = monitor
+        self.timer = timer
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self._sleep = sleep
+        self._last_size = 0
+        self._latency = 0
+        self.complete = False
+
+    def _update_monitor(self, **update):
+        if self.monitor is not None:
+            self.monitor.tell({'msg': 'update', 'update': update})
+
+    def _pause(self, seconds, retry_after=False):
+        self._update_monitor(kind='sleep', seconds=seconds,
+                             retry_after=retry_after)
+        print(f'Sleeping for {seconds:.2f} seconds.')
+        started = self.timer.start()
+        self._sleep(seconds)
+        self.timer.lap(timing.SLEEP, started)
+
+    def _wait_for_turn(self, limiter):
+        if self.breaker is not None:
+            while True:
+                sleep_time = self.breaker.delay()
+                if sleep_time <= 0:
+                    break
+                print(f'Host is failing, pausing.')
+                self._pause(sleep_time)
+        sleep_time = limiter.reserve()
+        if sleep_time > 0:
+            self._pause(sleep_time, limiter.is_throttled())
+
+    def _back_off(self, err, attempt):
+        """Waits before retrying after the attempt'th failure in a row.
+        Return: the retry.RetryPolicy class of err
+        Raises: RuntimeError if err should not be retried
+        """
+        kind = self.retry_policy.classify(err)
+        if kind == retry.RetryPolicy.FATAL \
+                or not self.retry_policy.allows(attempt):
+            raise _unhandled(err) from err
+        self._update_monitor(kind='retry', error=type(err).__name__)
+        if kind == retry.RetryPolicy.TRANSIENT and self.breaker is not None \
+                and self.breaker.on_failure():
+            print(f'Too many failures in a row, pausing the host.')
+        print(f'Retrying after {err} (attempt {attempt}).')
+        self._pause(self.retry_policy.delay(attempt))
+        return kind
 
     def _can_continue(self, have_space, num_requests, max_requests):
         return (have_space
                 and (max_requests is None
                      or num_requests < max_requests))
 
-    def run(self, initial, max_requests = None, suggested_wait = 0):
+    def run(self, initial, max_requests = None, suggested_wait = 0,
+            skip = 0, restart = None):
+        """Follows a resumption token chain, starting with initial.
+        skip - number of leading pages that are already stored, and are
+        only fetched to follow the chain (see resume_point)
+        restart - (first request of the chain, number of its pages before
+        initial), when initial resumes the chain from a token; by default
+        the chain starts with initial
+        Failed requests are retried as retry_policy allows; after a
+        badResumptionToken the chain is followed again from its first
+        request, skipping the pages already stored.
+        Return: the number of requests stored
+        """
         assert suggested_wait >= 0
         assert max_requests is None or max_requests >= 1
-        request = self.initial
+        limiter = self.limiter or rate.handler_limiter(
+            self.response_handler, min_interval=suggested_wait)
+        request = initial
+        (first, before) = restart or (initial, 0)
         num_requests = 0
-        wait_time = 0
+        # Leading pages of the chain from request known to be stored, and
+        # pages of it followed so far, for following it again after a bad
+        # token.
+        stored = skip
+        followed = 0
+        attempt = 0
         has_space = True
-        while self.can_continue(has_space, num_requests, max_requests):
-            try:
-                data = self.store_single_request(request)
-                resumption_token = oai.resumption_token_from_response(data)
-                request = partial(oai.resume_request_list_records,
-                                  self.response_handler, resumption_token)
-                num_requests += 1
-                print(f'Downloaded request #{num_requests}.')
-            except oai.HttpStatusError as err:
-                raise RuntimeError(f'Unhandled http response with code '
-                                   f'{err.code}') from err
-            except oai.ApplicationError as err:
-                raise RuntimeError(f'Unhandled OAI error of type '
-                                   f'{err.error}') from err
-            except WaitError as err:
-                wait_time = err.wait
-                print(f'Recieved wait with time {wait_time}.')
-            except OutOfSpaceError as err:
-                has_space = False
-                print(f'Ran out of space.')
-            except Exception as err:
-                raise RuntimeError(f'Encountered error of unexpected type '
-                                   f'{type(err).__name__}.')
-
-            sleep_time = max(self.suggested_wait, wait_time)
-            print(f'Sleeping for {sleep_time} seconds.')
-            sleep(sleep_time)
+        self.complete = False
+        try:
+            while self._can_continue(has_space, num_requests, max_requests):
+                self._wait_for_turn(limiter)
+                try:
+                    if skip > 0:
+                        response = self.skip_single_request(request)
+                        skip -= 1
+                        print(f'Skipped stored request.')
+                    else:
+                        response = self.store_single_request(request)
+                        num_requests += 1
+                        self._update_monitor(
+                            kind='page', bytes=len(response.data),
+                            latency=self._latency,
+                            headroom=self.storage.available_storage())
+                        print(f'Downloaded request #{num_requests}.')
+                    followed += 1
+                    attempt = 0
+                    limiter.on_success()
+                    if self.breaker is not None:
+                        self.breaker.on_success()
+                    resumption_token = \
+                        oai.resumption_token_from_response(response)
+                    if skip == 0:
+                        self._record_checkpoint(resumption_token)
+                    if resumption_token is None:
+                        print(f'Reached end of list.')
+                        self.complete = True
+                        break
+                    request = partial(oai.resume_request_list_records,
+                                      self.response_handler, resumption_token)
+                except WaitError as err:
+                    limiter.on_throttle(err.wait)
+                    print(f'Recieved wait with time {err.wait}.')
+                except OutOfSpaceError as err:
+                    has_space = False
+                    print(f'Ran out of space.')
+                except Exception as err:
+                    if isinstance(err, oai.ApplicationError) \
+                            and err.error == \
+                            oai.ApplicationError.NO_RECORDS_MATCH:
+                        print(f'No records match the request.')
+                        self.complete = True
+                        break
+                    attempt += 1
+                    kind = self._back_off(err, attempt)
+                    if kind == retry.RetryPolicy.BAD_TOKEN:
+                        print(f'Following the chain again from the start.')
+                        stored = before + max(stored, followed)
+                        before = 0
+                        request = first
+                        skip = stored
+                        followed = 0
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.sync()
+        return num_requests
 
-    def store_single_request(self, request):
+    def _record_checkpoint(self, resumption_token):
+        if self.checkpoint is not None:
+            self.checkpoint.record(self.storage.page_count(),
+                                   resumption_token)
+
+    def skip_single_request(self, request):
         try:
-            data = request()
-            self.store(data)
-            return data
+            data = self._send(request)
         except oai.HttpStatusError as err:
-            if _is_http_wait(err):
-                raise _convert_to_wait_error(err)
-            else:
+            check_wait(err)
+            raise
+        return as_response(data)
+
+    def _send(self, request):
+        """Sends request, keeping how long it took for the monitor.
+        Raises: retry.RequestError if no answer came back
+        """
+        started = monotonic()
+        try:
+            return request()
+        except OSError as err:
+            # requests' errors for bad urls are ValueErrors too.
+            if isinstance(err, ValueError):
                 raise
+            raise retry.RequestError(err) from err
+        finally:
+            self._latency = monotonic() - started
 
-    def _store(self, data):
-        if not self.storage.has_space(data):
-            raise OutOfSpaceError(len(data),
-                                  self.storage.available_storage())
-        resumption_token = oai.resumption_token_from_response(data)
-        self.storage.store(data)
-        self.storage.log_resumption(resumption_token)
+    def store_single_request(self, request):
+        # The previous page is the best guess at the size of the next one.
+        response = send_and_store_single_request(self.storage,
+                                                 partial(self._send, request),
+                                                 self._last_size, self.timer)
+        self._last_size = len(response.data)
+        return response
 
+    def _store(self, data):
+        return store(data, self.storage, self.timer)
@@ -0,0 +1,124 @@
+"""Scraper spool module.
+Response bodies written to disk as they download, rather than held in
+memory, so the memory a page takes does not grow with its size.
+
+A Spool stands in for the bytes of a page: len() is its size, chunks()
+reads it back a piece at a time, and a storage in the same directory can
+move the file into place instead of copying it.
+"""
+
+import os
+import shutil
+import time
+import uuid
+import weakref
+import zlib
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Spool:
+    """A response body in a file.
+    The file is removed once the Spool is garbage collected, unless it has
+    been moved into storage with move_to.
+    """
+
+    PREFIX = '.spool-'
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    @classmethod
+    def write(cls, directory, chunks):
+        """Spools chunks (an iterable of bytes) to a file in directory."""
+        # Not mkstemp: its files are private, and this one may become a
+        # stored part.
+        path = os.path.join(directory, cls.PREFIX + uuid.uuid4().hex)
+        size = 0
+        try:
+            with open(path, 'xb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            _remove(path)
+            raise
+        return cls(path, size)
+
+    def __len__(self):
+        return self.size
+
+    def chunks(self, size=CHUNK_SIZE):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def read(self):
+        """The whole body, for the few places that need it in memory."""
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def move_to(self, path):
+        """Moves the file to path, which is only a rename on the same
+        filesystem; it is then kept.
+        """
+        shutil.move(self.path, path)
+        self._finalizer.detach()
+        self.path = path
+
+
+def remove_stale(directory, max_age=3600, clock=time.time):
+    """Removes the spool files harvests that crashed left in directory.
+    max_age - seconds since a file was last written before it is taken to
+    be left behind, as another harvest may be spooling to the directory
+    Return: the number of files removed
+    """
+    now = clock()
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.name.startswith(Spool.PREFIX):
+            continue
+        try:
+            if now - entry.stat().st_mtime < max_age:
+                continue
+        except FileNotFoundError:
+            continue
+        _remove(entry.path)
+        removed += 1
+    return removed
+
+
+def chunks(data, size=CHUNK_SIZE):
+    """Pieces of data, which is bytes or a Spool."""
+    if isinstance(data, Spool):
+        yield from data.chunks(size)
+        return
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def as_bytes(data):
+    return data.read() if isinstance(data, Spool) else data
+
+
+def compress(data, level=6):
+    """zlib compresses data, bytes or a Spool, reading it in chunks."""
+    if not isinstance(data, Spool):
+        return zlib.compress(data, level)
+    compressor = zlib.compressobj(level)
+    pieces = [compressor.compress(chunk) for chunk in data.chunks()]
+    pieces.append(compressor.flush())
+    return b''.join(pieces)
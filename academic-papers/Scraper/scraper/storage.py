@@ -1,6 +1,12 @@
 import os
 import re
+import struct
+import threading
+import time
+import zlib
 from gevent.os import tp_write
+from scraper import spool
+from scraper.manifest import Manifest
 
 
 # Might belong in an architecture specific module...
@@ -13,8 +19,132 @@ def actual_storage_available(path):
 
 # Might belong in an architecture specific module...
 def actual_file_writer(path, mode, data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if 'b' not in mode:
+        mode += 'b'
     with open(path, mode) as f:
-        tp_write(f, data)
+        view = memoryview(data)
+        while view:
+            view = view[tp_write(f.fileno(), view):]
+
+
+class Reservation:
+    """Space set aside for a write that has not happened yet."""
+
+    def __init__(self, nbytes, on_release):
+        self.nbytes = nbytes
+        self._on_release = on_release
+
+    def is_held(self):
+        return self._on_release is not None
+
+    def release(self):
+        if self._on_release is not None:
+            self._on_release(self.nbytes)
+            self._on_release = None
+
+    def settle(self):
+        """Hands the space over to the write it was set aside for, so
+        release no longer frees it.
+        Return: the bytes that were still reserved
+        """
+        if self._on_release is None:
+            return 0
+        self._on_release = None
+        return self.nbytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class SpaceBudget:
+    """Free space accounting shared by every writer in one directory.
+    The filesystem is only measured every refresh_interval seconds; in
+    between, bytes written and reserved since the last measurement are
+    subtracted from it. Use space_budget() to get the shared instance.
+    """
+
+    def __init__(self, directory,
+                 storage_measure=actual_storage_available,
+                 capacity_percent=0.85,
+                 refresh_interval=5.0,
+                 clock=time.monotonic):
+        self._directory = directory
+        self._storage_measure = storage_measure
+        self._capacity_percent = capacity_percent
+        self._refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._measured = 0
+        self._measured_at = None
+        self._written = 0
+        self._reserved = 0
+
+    def _refresh(self):
+        now = self._clock()
+        if self._measured_at is None \
+                or now - self._measured_at >= self._refresh_interval:
+            self._measured = int(self._storage_measure(self._directory) *
+                                 self._capacity_percent)
+            self._measured_at = now
+            self._written = 0
+
+    def _available(self):
+        self._refresh()
+        return self._measured - self._written - self._reserved
+
+    def available(self):
+        with self._lock:
+            return self._available()
+
+    def reserve(self, nbytes):
+        """Set nbytes aside for a coming write.
+        Return: a Reservation, or None if there is not enough space
+        """
+        with self._lock:
+            if nbytes > self._available():
+                return None
+            self._reserved += nbytes
+        return Reservation(nbytes, self._release)
+
+    def _release(self, nbytes):
+        with self._lock:
+            self._reserved -= nbytes
+
+    def charge(self, nbytes, reservation=None):
+        """Account for a write of nbytes, if there is space for it.
+        reservation - Reservation made for the write, whose space counts
+        towards it; settled into the charge if the write may go ahead
+        Return: whether the write may go ahead
+        """
+        with self._lock:
+            reserved = reservation.nbytes \
+                if reservation is not None and reservation.is_held() else 0
+            if nbytes > self._available() + reserved:
+                return False
+            if reservation is not None:
+                self._reserved -= reservation.settle()
+            self._written += nbytes
+            return True
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def space_budget(directory, **kwargs):
+    """The SpaceBudget shared by every storage writing to directory.
+    kwargs - passed to SpaceBudget when the directory is first seen
+    """
+    key = os.path.realpath(directory)
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = SpaceBudget(directory, **kwargs)
+        return _budgets[key]
 
 
 def _get_part_files(directory):
@@ -24,27 +154,61 @@ def _get_part_files(directory):
     return app_filenames
 
 
+def _part_row(directory, filename):
+    stats = os.stat(os.path.join(directory, filename))
+    return (int(filename[len('part_'):]), filename, stats.st_size,
+            stats.st_mtime)
+
+
+def _backfill_manifest(manifest, directory):
+    """Indexes part files written before the directory had a manifest."""
+    manifest.add_many([_part_row(directory, filename)
+                       for filename in _get_part_files(directory)])
+    manifest.commit()
+
+
+def _recover_unindexed_parts(manifest, directory):
+    """Indexes the parts written after the last manifest commit.
+    Manifest rows are only committed on sync, so a crash can leave part
+    files that follow on from the last indexed part without rows.
+    """
+    parts = []
+    part = manifest.last_part() + 1
+    while os.path.exists(os.path.join(directory, f'part_{part:04d}')):
+        parts.append(_part_row(directory, f'part_{part:04d}'))
+        part += 1
+    if parts:
+        manifest.add_many(parts)
+        manifest.commit()
+
+
 class LocalStorage:
+    """One file per page, indexed by a Manifest in the same directory."""
 
     def __init__(self, root_directory,
                  storage_measure=actual_storage_available,
                  capacity_percent=0.85,
-                 write_file=actual_file_writer):
+                 write_file=actual_file_writer,
+                 budget=None):
+        """budget - SpaceBudget to account against; by default the one
+        shared by the directory, or a private one if storage_measure or
+        capacity_percent are overridden
+        """
         self._root_directory = root_directory
-        self._storage_measure = storage_measure
-        self._capacity_percent = capacity_percent
+        self._budget = budget or _default_budget(
+            root_directory, storage_measure, capacity_percent)
         self._write_file = write_file
-        app_filenames = _get_part_files(self._root_directory)
-        if len(app_filenames) == 0:
-            self._filenum = 0
+        self.manifest = Manifest(
+            os.path.join(root_directory, Manifest.FILENAME))
+        if self.manifest.is_empty():
+            _backfill_manifest(self.manifest, root_directory)
         else:
-            self._filenum = max(
-                map(lambda filename: int(filename[len('part_'):]),
-                    app_filenames))
+            _recover_unindexed_parts(self.manifest, root_directory)
+        self._filenum = self.manifest.last_part()
+        self._unsynced = []
 
     def available_storage(self):
-        return int(self._storage_measure(self._root_directory) *
-                   self._capacity_percent)
+        return self._budget.available()
 
     def has_space(self, data):
         """See if storage has enough space.
@@ -52,24 +216,252 @@ class LocalStorage:
         """
         return len(data) <= self.available_storage()
 
-    def store(self, data):
+    def reserve(self, nbytes):
+        """See SpaceBudget.reserve."""
+        return self._budget.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
         """Store data in data store.
-        data - must be bytes
+        data - bytes, or a spool.Spool, which is moved into place
+        records - number of records in data, if known, for the manifest
+        token - the resumption token that follows data, for the manifest
+        items - the oai.Items of data, if parsed, for wrapping storages
+        reservation - see SpaceBudget.charge
+        Return: the part number data was stored as
         """
-        if not self.has_space(data):
+        if not self._budget.charge(len(data), reservation):
             raise RuntimeError('Not enough space remaining to store data.')
         self._filenum += 1
-        filename = f'part_{self._filenum:04d}'
+        part = self._filenum
+        filename = f'part_{part:04d}'
         filepath = os.path.join(self._root_directory, filename)
-        self._write_file(filepath, 'wb', data)
+        if isinstance(data, spool.Spool):
+            data.move_to(filepath)
+        else:
+            self._write_file(filepath, 'wb', data)
+        self._unsynced.append(filepath)
+        self.manifest.add(part, filename, len(data), records, token)
+        return part
 
     def log_resumption(self, token):
-        path = os.path.join(self._root_directory, 'resumption')
-        if token is None:
-            data = 'NONE'
-        else:
-            data = token + '\n'
-        self._write_file(path, 'a', data)
+        _log_resumption(self._write_file, self._root_directory, token)
+
+    def page_count(self):
+        return self._filenum
+
+    def sync(self):
+        """Flushes every part written since the last sync to disk, then
+        commits their manifest rows.
+        """
+        (paths, self._unsynced) = (self._unsynced, [])
+        for path in paths + [_resumption_path(self._root_directory)]:
+            _fsync_path(path)
+        _fsync_path(self._root_directory)
+        self.manifest.commit()
+
+
+def _default_budget(directory, storage_measure, capacity_percent):
+    if storage_measure is actual_storage_available \
+            and capacity_percent == 0.85:
+        return space_budget(directory)
+    return SpaceBudget(directory, storage_measure, capacity_percent)
+
+
+def _fsync_path(path):
+    if not os.path.exists(path):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _resumption_path(directory):
+    return os.path.join(directory, 'resumption')
+
+
+def _log_resumption(write_file, directory, token):
+    path = _resumption_path(directory)
+    if token is None:
+        data = 'NONE'
+    else:
+        data = token + '\n'
+    write_file(path, 'a', data)
+
+
+class SegmentStorage:
+    """Appends zlib compressed pages to rolling segment files.
+    segment_bytes - a segment is rolled over once it grows past this size
+    Each page is compressed on its own, and located through a fixed width
+    index entry, so any page can be read back without scanning.
+    Pages are numbered from 1, like LocalStorage's part files.
+    """
+
+    INDEX_FILENAME = 'segments.idx'
+    # segment number, offset in segment, compressed length
+    INDEX_ENTRY = struct.Struct('<IQI')
+
+    def __init__(self, root_directory,
+                 storage_measure=actual_storage_available,
+                 capacity_percent=0.85,
+                 write_file=actual_file_writer,
+                 segment_bytes=256 * 1024 * 1024,
+                 compression_level=6,
+                 budget=None):
+        self._root_directory = root_directory
+        self._budget = budget or _default_budget(
+            root_directory, storage_measure, capacity_percent)
+        self._write_file = write_file
+        self._segment_bytes = segment_bytes
+        self._compression_level = compression_level
+        self._index_path = os.path.join(root_directory, self.INDEX_FILENAME)
+        self._page_count = 0
+        self._segment = 0
+        self._segment_end = 0
+        if os.path.exists(self._index_path):
+            self._open_existing()
+
+    def _open_existing(self):
+        index_size = os.path.getsize(self._index_path)
+        self._page_count = index_size // self.INDEX_ENTRY.size
+        if index_size % self.INDEX_ENTRY.size:
+            # A torn entry from an interrupted write.
+            os.truncate(self._index_path,
+                        self._page_count * self.INDEX_ENTRY.size)
+        if self._page_count == 0:
+            return
+        (segment, offset, length) = self._index_entry(self._page_count)
+        self._segment = segment
+        self._segment_end = offset + length
+        # Drop anything appended after the last indexed page.
+        segment_path = self._segment_path(segment)
+        if os.path.getsize(segment_path) > self._segment_end:
+            os.truncate(segment_path, self._segment_end)
+
+    def _segment_path(self, segment):
+        return os.path.join(self._root_directory, f'segment_{segment:06d}')
+
+    def _index_entry(self, page):
+        with open(self._index_path, 'rb') as f:
+            f.seek((page - 1) * self.INDEX_ENTRY.size)
+            return self.INDEX_ENTRY.unpack(f.read(self.INDEX_ENTRY.size))
+
+    def available_storage(self):
+        return self._budget.available()
+
+    def has_space(self, data):
+        """See if storage has enough space.
+        data - must by bytes
+        Checks against the uncompressed size, which is an upper bound.
+        """
+        return len(data) <= self.available_storage()
+
+    def reserve(self, nbytes):
+        """See SpaceBudget.reserve."""
+        return self._budget.reserve(nbytes)
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        """Compress and append data to the current segment.
+        data - bytes, or a spool.Spool, which is compressed as it is read
+        Return: the page number data was stored as
+        """
+        compressed = spool.compress(data, self._compression_level)
+        if not self._budget.charge(len(compressed), reservation):
+            raise RuntimeError('Not enough space remaining to store data.')
+        if self._segment_end > 0 \
+                and self._segment_end + len(compressed) > self._segment_bytes:
+            # Rolled segments are complete; flush before moving on.
+            _fsync_path(self._segment_path(self._segment))
+            self._segment += 1
+            self._segment_end = 0
+        self._write_file(self._segment_path(self._segment), 'ab', compressed)
+        entry = self.INDEX_ENTRY.pack(self._segment, self._segment_end,
+                                      len(compressed))
+        self._write_file(self._index_path, 'ab', entry)
+        self._segment_end += len(compressed)
+        self._page_count += 1
+        return self._page_count
+
+    def log_resumption(self, token):
+        _log_resumption(self._write_file, self._root_directory, token)
+
+    def page_count(self):
+        return self._page_count
+
+    def sync(self):
+        """Flushes the current segment and the index to disk."""
+        for path in (self._segment_path(self._segment), self._index_path,
+                     _resumption_path(self._root_directory),
+                     self._root_directory):
+            _fsync_path(path)
+
+    def read(self, page):
+        """The uncompressed data of the given page (numbered from 1)."""
+        if not 1 <= page <= self._page_count:
+            raise IndexError(f'No page {page} in storage.')
+        (segment, offset, length) = self._index_entry(page)
+        with open(self._segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length))
+
+    def pages(self):
+        for page in range(1, self._page_count + 1):
+            yield self.read(page)
+
+
+class SegmentReader:
+    """Read-only access to the pages of a SegmentStorage directory.
+    Unlike SegmentStorage, it never repairs a torn index or segment tail,
+    so it is safe to read from while a harvest is still appending; pages
+    indexed after it was opened are not seen.
+    """
+
+    def __init__(self, root_directory):
+        self._root_directory = root_directory
+        index_path = os.path.join(root_directory,
+                                  SegmentStorage.INDEX_FILENAME)
+        entry_size = SegmentStorage.INDEX_ENTRY.size
+        self._index = open(index_path, 'rb')
+        self._page_count = os.fstat(self._index.fileno()).st_size \
+            // entry_size
+        self._segments = {}
+
+    def page_count(self):
+        return self._page_count
+
+    def read(self, page):
+        """The uncompressed data of the given page (numbered from 1)."""
+        if not 1 <= page <= self._page_count:
+            raise IndexError(f'No page {page} in storage.')
+        entry = SegmentStorage.INDEX_ENTRY
+        self._index.seek((page - 1) * entry.size)
+        (segment, offset, length) = entry.unpack(self._index.read(entry.size))
+        f = self._segments.get(segment)
+        if f is None:
+            f = self._segments[segment] = open(
+                os.path.join(self._root_directory, f'segment_{segment:06d}'),
+                'rb')
+        f.seek(offset)
+        return zlib.decompress(f.read(length))
+
+    def pages(self):
+        for page in range(1, self._page_count + 1):
+            yield self.read(page)
+
+    def close(self):
+        self._index.close()
+        for f in self._segments.values():
+            f.close()
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class MockStorage:
@@ -77,26 +469,46 @@ class MockStorage:
     def __init__(self, capacity_bytes):
         self._capacity_bytes = capacity_bytes
         self.bytes_used = 0
+        self.bytes_reserved = 0
         self.store_count = 0
         self.log_resumption_count = 0
 
     def available_storage(self):
-        return self._capacity_bytes - self.bytes_used
+        return self._capacity_bytes - self.bytes_used - self.bytes_reserved
 
     def has_space(self, data):
         """See if storage has enough space.
         data - must by bytes
         """
-        return self.bytes_used + len(data) <= self._capacity_bytes
+        return len(data) <= self.available_storage()
+
+    def reserve(self, nbytes):
+        if nbytes > self.available_storage():
+            return None
+        self.bytes_reserved += nbytes
+        return Reservation(nbytes, self._release)
 
-    def store(self, data):
+    def _release(self, nbytes):
+        self.bytes_reserved -= nbytes
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
         """Store data in data store.
         data - must be bytes
         """
         if self.bytes_used + len(data) > self._capacity_bytes:
             raise RuntimeError('Not enough space remaining to store data.')
+        if reservation is not None:
+            self.bytes_reserved -= reservation.settle()
         self.bytes_used += len(data)
         self.store_count += 1
+        return self.store_count
 
     def log_resumption(self, token):
         self.log_resumption_count += 1
+
+    def page_count(self):
+        return self.store_count
+
+    def sync(self):
+        pass
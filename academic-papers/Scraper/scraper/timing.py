@@ -0,0 +1,160 @@
+"""Scraper timing module.
+Timers recording how long each phase of fetching and storing a page takes.
+
+Phases are timed with start() and lap(phase, started), which return the
+time the next phase starts from. NULL_TIMER does nothing at all, so code
+can time itself unconditionally, and pays a few no-op calls per page when
+timing is off.
+"""
+
+import json
+import threading
+import time
+
+
+SEND = 'send'            # connecting if needed, and writing the request
+TTFB = 'ttfb'            # request written until the response headers arrive
+DOWNLOAD = 'download'    # response headers until the body is read
+PARSE = 'parse'          # parsing the xml for its token and records
+STORE = 'store'          # writing the page and its token to storage
+SLEEP = 'sleep'          # waiting on the rate limiter
+
+PHASES = (SEND, TTFB, DOWNLOAD, PARSE, STORE, SLEEP)
+
+
+class NullTimer:
+    """Records nothing."""
+
+    def start(self):
+        return 0
+
+    def lap(self, phase, started):
+        return 0
+
+    def record(self, phase, seconds):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(NullTimer):
+    """Base for timers that keep what they record; see record()."""
+
+    def start(self):
+        return time.perf_counter()
+
+    def lap(self, phase, started):
+        """Records the phase that began at started.
+        Return: now, when the next phase starts
+        """
+        now = time.perf_counter()
+        self.record(phase, now - started)
+        return now
+
+
+class HistogramTimer(Timer):
+    """Per-phase histograms with power of two microsecond buckets."""
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._totals = {}
+        self._maxima = {}
+
+    def record(self, phase, seconds):
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            counts = self._counts.get(phase)
+            if counts is None:
+                counts = self._counts[phase] = [0] * self.BUCKETS
+                self._totals[phase] = 0.0
+                self._maxima[phase] = 0.0
+            counts[bucket] += 1
+            self._totals[phase] += seconds
+            self._maxima[phase] = max(self._maxima[phase], seconds)
+
+    def count(self, phase):
+        return sum(self._counts.get(phase, ()))
+
+    def percentile(self, phase, fraction):
+        """Upper bound, in seconds, of the bucket holding the percentile."""
+        counts = self._counts.get(phase)
+        if not counts:
+            return None
+        rank = fraction * sum(counts)
+        seen = 0
+        for (bucket, count) in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << bucket) / 1e6, self._maxima[phase])
+        return self._maxima[phase]
+
+    def summary(self):
+        """Return: {phase: {count, total, mean, p50, p90, p99, max}}"""
+        with self._lock:
+            phases = [phase for phase in PHASES if phase in self._counts]
+            phases += sorted(set(self._counts) - set(phases))
+            summary = {}
+            for phase in phases:
+                count = sum(self._counts[phase])
+                summary[phase] = {
+                    'count': count,
+                    'total': self._totals[phase],
+                    'mean': self._totals[phase] / count,
+                    'p50': self.percentile(phase, 0.50),
+                    'p90': self.percentile(phase, 0.90),
+                    'p99': self.percentile(phase, 0.99),
+                    'max': self._maxima[phase],
+                }
+            return summary
+
+    def report(self):
+        lines = []
+        for (phase, stats) in self.summary().items():
+            lines.append(f'{phase:>8}: {stats["count"]} times, '
+                         f'{stats["total"]:.3f}s total, '
+                         f'mean {stats["mean"] * 1000:.2f}ms, '
+                         f'p50 {stats["p50"] * 1000:.2f}ms, '
+                         f'p99 {stats["p99"] * 1000:.2f}ms')
+        return '\n'.join(lines)
+
+
+class JsonLinesTimer(Timer):
+    """Appends one json object per recorded phase to a file.
+    Each line holds phase, seconds and the wall clock time it was recorded.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1 << 16)
+
+    def record(self, phase, seconds):
+        line = json.dumps({'phase': phase, 'seconds': seconds,
+                           'time': time.time()})
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class TeeTimer(Timer):
+    """Records to several timers at once."""
+
+    def __init__(self, *timers):
+        self._timers = timers
+
+    def record(self, phase, seconds):
+        for timer in self._timers:
+            timer.record(phase, seconds)
+
+    def close(self):
+        for timer in self._timers:
+            timer.close()
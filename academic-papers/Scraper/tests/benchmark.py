@@ -0,0 +1,207 @@
+"""End-to-end harvest benchmark.
+Harvests a chain from the stand-in server (see oai_server) into a scratch
+directory and reports pages/s, MB/s, CPU time and peak RSS of the
+harvesting process. The server runs in a process of its own, so its work
+is not counted.
+
+    python -m tests.benchmark --pages 50 --latency 0.02
+    python -m tests.benchmark --cli --pipeline 2 --json results.jsonl
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from scraper import client
+from scraper import oai
+from scraper import pipeline
+from scraper import scraper
+from scraper import storage
+from tests import oai_server
+
+
+SCRAPER_DIRECTORY = os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))
+
+
+def _serve(server_options, urls):
+    server = oai_server.OaiServer(**server_options)
+    urls.put(server.url)
+    server.serve_forever()
+
+
+def start_server(**server_options):
+    """Starts a stand-in server in a child process.
+    Return: (process, base url)
+    """
+    context = multiprocessing.get_context('spawn')
+    urls = context.Queue()
+    process = context.Process(target=_serve, args=(server_options, urls),
+                              daemon=True)
+    process.start()
+    return (process, urls.get(timeout=30))
+
+
+def _open_storage(directory, storage_kind):
+    if storage_kind == 'segment':
+        return storage.SegmentStorage(directory)
+    return storage.LocalStorage(directory)
+
+
+def stored_totals(directory, storage_kind):
+    """Return: (pages, bytes) stored in directory"""
+    if storage_kind == 'segment':
+        stored = storage.SegmentStorage(directory)
+        return (stored.page_count(),
+                sum(len(data) for data in stored.pages()))
+    parts = storage.LocalStorage(directory).manifest.parts()
+    return (len(parts), sum(part.bytes for part in parts))
+
+
+def harvest(url, directory, storage_kind='local', queue_size=0,
+            spool=False):
+    """Harvests url into directory with a Worker, in this process.
+    spool - download pages to directory rather than into memory
+    """
+    my_storage = _open_storage(directory, storage_kind)
+    with client.SessionHandler(
+            url, spool_directory=directory if spool else None) as handler:
+        if queue_size:
+            worker = pipeline.PipelinedWorker(my_storage, handler,
+                                              queue_size=queue_size)
+        else:
+            worker = scraper.Worker(my_storage, handler)
+        worker.run(lambda: oai.request_list_records(handler))
+    my_storage.sync()
+
+
+def _cpu_seconds(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+def _measured_harvest(url, directory, storage_kind, queue_size, spool,
+                      results):
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    harvest(url, directory, storage_kind, queue_size, spool)
+    seconds = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    results.put((seconds, _cpu_seconds(after) - _cpu_seconds(before),
+                 after.ru_maxrss))
+
+
+def _run_worker(url, directory, storage_kind, queue_size, spool):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(
+        target=_measured_harvest,
+        args=(url, directory, storage_kind, queue_size, spool, results))
+    process.start()
+    measured = results.get()
+    process.join()
+    return measured
+
+
+def _run_cli(url, directory, storage_kind, queue_size, spool):
+    command = [sys.executable, '-m', 'scraper.cli', '-s', url,
+               '-d', directory, '--storage', storage_kind]
+    if queue_size:
+        command += ['--pipeline', str(queue_size)]
+    if spool:
+        command.append('--spool')
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=SCRAPER_DIRECTORY,
+                               stdout=subprocess.DEVNULL)
+    (_, status, usage) = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - started
+    if status != 0:
+        raise RuntimeError(f'cli exited with status {status}')
+    return (seconds, _cpu_seconds(usage), usage.ru_maxrss)
+
+
+def run(pages=20, records_per_page=1000, latency=0, throttle_every=0,
+        retry_after=1, compress=False, storage_kind='local', queue_size=0,
+        use_cli=False, spool=False):
+    """Runs one benchmark against a fresh server and directory.
+    Return: dict of the settings and measurements
+    """
+    (server, url) = start_server(
+        pages=pages, records_per_page=records_per_page, latency=latency,
+        throttle_every=throttle_every, retry_after=retry_after,
+        compress=compress)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            runner = _run_cli if use_cli else _run_worker
+            (seconds, cpu_seconds, peak_rss_kb) = runner(
+                url, directory, storage_kind, queue_size, spool)
+            (stored_pages, stored_bytes) = stored_totals(directory,
+                                                         storage_kind)
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        'pages': stored_pages,
+        'records_per_page': records_per_page,
+        'latency': latency,
+        'throttle_every': throttle_every,
+        'compress': compress,
+        'storage': storage_kind,
+        'pipeline': queue_size,
+        'cli': use_cli,
+        'spool': spool,
+        'seconds': seconds,
+        'pages_per_second': stored_pages / seconds,
+        'mb_per_second': stored_bytes / seconds / 1e6,
+        'cpu_seconds': cpu_seconds,
+        'cpu_percent': 100 * cpu_seconds / seconds,
+        'peak_rss_mb': peak_rss_kb / 1024,
+    }
+
+
+def report(result):
+    return (f'{result["pages"]} pages in {result["seconds"]:.2f}s: '
+            f'{result["pages_per_second"]:.1f} pages/s, '
+            f'{result["mb_per_second"]:.2f} MB/s, '
+            f'cpu {result["cpu_seconds"]:.2f}s '
+            f'({result["cpu_percent"]:.0f}%), '
+            f'peak rss {result["peak_rss_mb"]:.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Harvest benchmark')
+    parser.add_argument('--pages', type=int, default=20,
+                        help='length of the resumption chain')
+    parser.add_argument('--records-per-page', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='server latency per request in seconds')
+    parser.add_argument('--throttle-every', type=int, default=0,
+                        help='answer every nth request with 503')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='seconds asked for by each 503')
+    parser.add_argument('--compress', action='store_true',
+                        help='gzip responses')
+    parser.add_argument('--storage', choices=['local', 'segment'],
+                        default='local')
+    parser.add_argument('--pipeline', metavar='QUEUE_SIZE', type=int,
+                        default=0)
+    parser.add_argument('--cli', action='store_true',
+                        help='harvest with scraper.cli rather than a Worker')
+    parser.add_argument('--spool', action='store_true',
+                        help='download pages to disk rather than memory')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH',
+                        help='append each result to PATH as a json line')
+    args = parser.parse_args()
+    for _ in range(args.repeat):
+        result = run(args.pages, args.records_per_page, args.latency,
+                     args.throttle_every, args.retry_after, args.compress,
+                     args.storage, args.pipeline, args.cli, args.spool)
+        print(report(result))
+        if args.json:
+            with open(args.json, 'a') as f:
+                f.write(json.dumps(result) + '\n')
@@ -0,0 +1,35 @@
+"""Fake OAI-PMH pages and response handlers shared by the tests."""
+
+
+def list_records_page(token):
+    """A one record ListRecords page, followed by token if given."""
+    token_xml = f'<resumptionToken>{token}</resumptionToken>' if token else ''
+    return (f'<OAI-PMH><ListRecords><record/>{token_xml}</ListRecords>'
+            f'</OAI-PMH>').encode()
+
+
+class MockHttpResponse:
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+
+def chain_page(data, length):
+    """Return: (page number requested in data, token of the next page)"""
+    page = int(data.get('resumptionToken', '0'))
+    token = str(page + 1) if page + 1 < length else None
+    return (page, token)
+
+
+def chain_handler(length, requested=None):
+    """Serves a resumption chain of length pages.
+    requested - list each requested page number is appended to
+    """
+    def _handler(data):
+        (page, token) = chain_page(data, length)
+        if requested is not None:
+            requested.append(page)
+        return MockHttpResponse(list_records_page(token))
+    return _handler
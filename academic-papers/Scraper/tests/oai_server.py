@@ -0,0 +1,184 @@
+"""Local OAI-PMH stand-in server.
+Serves ListRecords resumption chains built from the records in the
+tests/data fixtures, with configurable page size, latency, 503 Retry-After
+throttling and OAI error pages, so harvests can be tested and benchmarked
+without a real repository.
+"""
+
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), 'data')
+
+_HEADER = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+           b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">\n'
+           b'<responseDate>2017-08-09T02:22:00Z</responseDate>\n'
+           b'<request verb="%s">http://localhost/oai</request>\n')
+_FOOTER = b'</OAI-PMH>\n'
+_RECORD = re.compile(rb'<record>.*?</record>', re.DOTALL)
+_IDENTIFIER = re.compile(rb'(<header>\s*<identifier>)[^<]*(</identifier>)')
+
+
+def _fixture(filename):
+    with open(os.path.join(DATA_DIRECTORY, filename), 'rb') as f:
+        return f.read()
+
+
+def _record_templates():
+    """Fixture records, split around their identifier."""
+    templates = []
+    data = _fixture('list_records_with_resumption.xml')
+    for record in _RECORD.findall(data):
+        match = _IDENTIFIER.search(record)
+        templates.append((record[:match.end(1)], record[match.start(2):]))
+    return templates
+
+
+class OaiServer:
+    """A ListRecords chain of pages served over http on localhost.
+    pages - length of the resumption chain
+    records_per_page - records in every page; fixture records are reused
+    with new identifiers once they run out
+    latency - seconds slept before answering each request
+    throttle_every - answer every nth request with 503 and Retry-After
+    retry_after - seconds asked for by each 503
+    error_pages - {page: OAI error code} served instead of those pages
+    error_repeats - times each error page is served before the real page
+    compress - gzip responses for clients that accept it
+    """
+
+    def __init__(self, pages=10, records_per_page=100, latency=0,
+                 throttle_every=0, retry_after=1, error_pages=None,
+                 error_repeats=1, compress=False, port=0):
+        self.pages = pages
+        self.records_per_page = records_per_page
+        self.latency = latency
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.error_pages = dict(error_pages or {})
+        self.compress = compress
+        self.requests = 0
+        self.throttled = 0
+        self._errors_left = {page: error_repeats for page in self.error_pages}
+        self._templates = _record_templates()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.oai = self
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._httpd.server_address[1]}/oai'
+
+    def start(self):
+        """Serves from a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def page(self, number):
+        """The xml of page number (1-based) of the chain."""
+        parts = [_HEADER % b'ListRecords', b'<ListRecords>\n']
+        first = (number - 1) * self.records_per_page
+        for index in range(first, first + self.records_per_page):
+            (before, after) = self._templates[index % len(self._templates)]
+            parts += [before, b'oai:standin:%d' % index, after, b'\n']
+        size = self.pages * self.records_per_page
+        token = str(number + 1).encode() if number < self.pages else b''
+        parts.append(b'<resumptionToken cursor="%d" completeListSize="%d">'
+                     b'%s</resumptionToken>\n' % (first, size, token))
+        parts += [b'</ListRecords>\n', _FOOTER]
+        return b''.join(parts)
+
+    def error(self, verb, code):
+        return (_HEADER % verb.encode() +
+                b'<error code="%s">Injected by the stand-in server</error>\n'
+                % code.encode() + _FOOTER)
+
+    def respond(self, arguments):
+        """Return: (http status, headers, body) for request arguments."""
+        verb = arguments.get('verb', '')
+        with self._lock:
+            self.requests += 1
+            throttle = self.throttle_every \
+                and self.requests % self.throttle_every == 0
+            if throttle:
+                self.throttled += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttle:
+            return (503, {'Retry-After': str(self.retry_after)}, b'')
+        if verb == 'Identify':
+            return (200, {}, _fixture('success_response_identify.xml'))
+        if verb == 'ListSets':
+            return (200, {}, _fixture('success_response_list_sets.xml'))
+        if verb != 'ListRecords':
+            return (200, {}, self.error(verb, 'badVerb'))
+        token = arguments.get('resumptionToken')
+        if token is None:
+            number = 1
+        elif token.isdigit() and 1 < int(token) <= self.pages:
+            number = int(token)
+        else:
+            return (200, {}, self.error(verb, 'badResumptionToken'))
+        with self._lock:
+            if self._errors_left.get(number, 0) > 0:
+                self._errors_left[number] -= 1
+                return (200, {}, self.error(verb, self.error_pages[number]))
+        return (200, {}, self.page(number))
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _arguments(self, query):
+        return {key: values[0] for (key, values) in parse_qs(query).items()}
+
+    def do_GET(self):
+        self._answer(self._arguments(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._answer(self._arguments(self.rfile.read(length).decode()))
+
+    def _answer(self, arguments):
+        oai = self.server.oai
+        (status, headers, body) = oai.respond(arguments)
+        if body and oai.compress \
+                and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, compresslevel=1)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,135 @@
+from functools import partial
+import gevent
+import gevent.event
+import zmq.green as zmq
+from scraper import actor
+from scraper import monitor
+from scraper import oai
+from scraper import storage
+from tests.helpers import MockHttpResponse, chain_page, list_records_page
+
+
+def gated_handler(length, requested, gates):
+    """Serves a chain of length pages, holding each page in gates (page
+    number -> gevent.event.Event) until its gate is opened.
+    """
+    def _handler(data):
+        (page, token) = chain_page(data, length)
+        requested.append(page)
+        if page in gates:
+            gates[page].wait()
+        return MockHttpResponse(list_records_page(token))
+    return _handler
+
+
+def start(handler, **kwargs):
+    return actor.WorkerActor.start(
+        storage.MockStorage(10000), handler,
+        partial(oai.request_list_records, handler), **kwargs)
+
+
+def wait_for(condition, timeout=5):
+    with gevent.Timeout(timeout):
+        while not condition():
+            gevent.sleep(0.01)
+
+
+def test_harvests_the_chain():
+    worker = start(gated_handler(3, [], {}))
+    try:
+        wait_for(lambda: worker.ask({'msg': 'status'})['state'] == 'done')
+        status = worker.ask({'msg': 'status'})
+    finally:
+        worker.stop()
+    assert status['pages'] == 3
+    assert status['complete']
+
+
+def test_pause_holds_the_next_request_until_resumed():
+    requested = []
+    gate = gevent.event.Event()
+    worker = start(gated_handler(3, requested, {1: gate}))
+    try:
+        wait_for(lambda: requested == [0, 1])
+        worker.ask({'msg': 'pause'})
+        gate.set()
+        gevent.sleep(0.1)
+        assert requested == [0, 1]
+        assert worker.ask({'msg': 'status'})['state'] == 'paused'
+        assert worker.ask({'msg': 'status'})['pages'] == 2
+        worker.ask({'msg': 'resume'})
+        wait_for(lambda: worker.ask({'msg': 'status'})['state'] == 'done')
+    finally:
+        worker.stop()
+    assert requested == [0, 1, 2]
+
+
+def test_stop_ends_a_wait_slowed_by_rate():
+    requested = []
+    gate = gevent.event.Event()
+    worker = start(gated_handler(3, requested, {0: gate}))
+    try:
+        wait_for(lambda: requested == [0])
+        worker.ask({'msg': 'rate', 'interval': 60})
+        gate.set()
+        gevent.sleep(0.1)
+        assert requested == [0]
+        worker.ask({'msg': 'stop'})
+        wait_for(lambda: worker.ask({'msg': 'status'})['state'] == 'stopped')
+        assert worker.ask({'msg': 'status'})['pages'] == 1
+    finally:
+        worker.stop()
+
+
+def test_monitor_passes_controls_on():
+    gate = gevent.event.Event()
+    handler = gated_handler(2, [], {0: gate})
+    my_monitor = monitor.Monitor.start(None)
+    worker = start(handler, monitor=my_monitor)
+    try:
+        my_monitor.tell({'msg': 'worker', 'worker': worker})
+        port = my_monitor.ask({'msg': 'port'})
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        socket.send_json({'control': 'pause'})
+        socket.recv_json()
+        gate.set()
+        socket.send_json({'control': 'status'})
+        reply = socket.recv_json()
+        socket.close(linger=0)
+    finally:
+        worker.stop()
+        my_monitor.stop()
+    assert reply['response']['state'] == 'paused'
+
+
+def test_monitor_survives_malformed_controls():
+    gate = gevent.event.Event()
+    my_monitor = monitor.Monitor.start(None)
+    worker = start(gated_handler(2, [], {0: gate}))
+    try:
+        my_monitor.tell({'msg': 'worker', 'worker': worker})
+        port = my_monitor.ask({'msg': 'port'})
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 5000)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        replies = []
+        for request in ({'control': 'rate'},
+                        {'control': 'rate', 'interval': 'fast'},
+                        {'control': 'status'}):
+            socket.send_json(request)
+            replies.append(socket.recv_json()['response'])
+        socket.send(b'{not json')
+        replies.append(socket.recv_json()['response'])
+        socket.send_json({'control': 'status'})
+        replies.append(socket.recv_json()['response'])
+        socket.close(linger=0)
+        assert my_monitor.is_alive()
+    finally:
+        gate.set()
+        worker.stop()
+        my_monitor.stop()
+    assert 'error' in replies[0] and 'error' in replies[1]
+    assert replies[2]['state'] == 'running'
+    assert 'error' in replies[3]
+    assert replies[4]['state'] == 'running'
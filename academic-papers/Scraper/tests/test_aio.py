@@ -0,0 +1,112 @@
+import asyncio
+from functools import partial
+from aiohttp import test_utils
+from aiohttp import web
+import pytest
+from scraper import aio
+from scraper import rate
+from scraper import scraper
+from scraper import storage
+from tests.helpers import chain_page, list_records_page
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def chain_handler(length):
+    async def _handler(data):
+        (_, token) = chain_page(data, length)
+        return aio.HttpResponse(200, {}, list_records_page(token))
+    return _handler
+
+
+def test_async_worker_follows_chain_to_end():
+    handler = chain_handler(3)
+    stg = storage.MockStorage(10000)
+    worker = aio.AsyncWorker(stg, handler)
+    count = run(worker.run(partial(aio.request_list_records, handler)))
+    assert count == 3
+    assert stg.store_count == 3
+    assert stg.log_resumption_count == 3
+
+
+def test_async_worker_raises_on_http_error():
+    async def handler(data):
+        return aio.HttpResponse(500, {}, b'')
+    worker = aio.AsyncWorker(storage.MockStorage(100), handler)
+    with pytest.raises(RuntimeError):
+        run(worker.run(partial(aio.request_list_records, handler)))
+
+
+def test_async_worker_stops_out_of_space():
+    handler = chain_handler(3)
+    stg = storage.MockStorage(0)
+    worker = aio.AsyncWorker(stg, handler)
+    assert run(worker.run(partial(aio.request_list_records, handler))) == 0
+
+
+def test_run_chains_runs_concurrently():
+    in_flight = 0
+    most_in_flight = 0
+    async def handler(data):
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return aio.HttpResponse(200, {}, list_records_page(None))
+    stg = storage.MockStorage(10000)
+    chains = [(aio.AsyncWorker(stg, handler),
+               partial(aio.request_list_records, handler))
+              for _ in range(4)]
+    assert run(aio.run_chains(chains)) == [1, 1, 1, 1]
+    assert most_in_flight == 4
+
+
+async def serve(respond, test):
+    """Runs test(handler) with an AiohttpHandler for a local server.
+    respond - takes the posted form as a dict, Return: a web.Response
+    """
+    async def oai_endpoint(request):
+        return respond(dict(await request.post()))
+    app = web.Application()
+    app.router.add_post('/oai', oai_endpoint)
+    async with test_utils.TestServer(app) as server:
+        handler = aio.AiohttpHandler(str(server.make_url('/oai')))
+        try:
+            return await test(handler)
+        finally:
+            await handler.close()
+
+
+def test_aiohttp_handler_follows_chain_from_server():
+    requested = []
+    def respond(form):
+        (page, token) = chain_page(form, 3)
+        requested.append((form['verb'], page))
+        return web.Response(body=list_records_page(token))
+    stg = storage.MockStorage(10000)
+    async def test(handler):
+        worker = aio.AsyncWorker(stg, handler, limiter=rate.RateLimiter())
+        return await worker.run(partial(aio.request_list_records, handler))
+    assert run(serve(respond, test)) == 3
+    assert requested == [('ListRecords', 0), ('ListRecords', 1),
+                         ('ListRecords', 2)]
+    assert stg.store_count == 3
+
+
+def test_aiohttp_handler_passes_retry_after_on():
+    def respond(form):
+        return web.Response(status=503, headers={'Retry-After': '30'})
+    async def test(handler):
+        worker = aio.AsyncWorker(storage.MockStorage(10000), handler)
+        await worker.store_single_request(
+            partial(aio.request_list_records, handler))
+    with pytest.raises(scraper.WaitError) as exc:
+        run(serve(respond, test))
+    assert exc.value.wait == 30
@@ -0,0 +1,98 @@
+from functools import partial
+import os
+import shutil
+import pytest
+from scraper import cache
+from scraper import oai
+from scraper import scraper
+from scraper import storage
+from tests.helpers import MockHttpResponse, chain_handler
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+class Counter:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+def harvest(handler):
+    stg = storage.MockStorage(10000)
+    scraper.Worker(stg, handler).run(
+        partial(oai.request_list_records, handler))
+    return stg.store_count
+
+
+def test_second_harvest_is_answered_from_the_cache(test_directory):
+    requested = []
+    with cache.CachingHandler(chain_handler(3, requested),
+                              test_directory) as handler:
+        assert harvest(handler) == 3
+        assert harvest(handler) == 3
+        assert (handler.hits, handler.misses) == (3, 3)
+    assert requested == [0, 1, 2]
+
+
+def test_replays_without_the_source(test_directory):
+    with cache.CachingHandler(chain_handler(3), test_directory) as handler:
+        harvest(handler)
+    def offline(data):
+        raise AssertionError('the source was asked')
+    with cache.CachingHandler(offline, test_directory,
+                              replay=True) as handler:
+        assert harvest(handler) == 3
+        with pytest.raises(cache.CacheMiss):
+            handler({'verb': 'Identify'})
+
+
+def test_identical_pages_are_kept_once(test_directory):
+    page = MockHttpResponse(b'<OAI-PMH><Identify/></OAI-PMH>')
+    with cache.CachingHandler(lambda data: page, test_directory) as handler:
+        handler({'verb': 'Identify'})
+        handler({'verb': 'Identify', 'extra': 'argument'})
+        assert handler.cached_bytes == len(page.content)
+        handler({'verb': 'Identify', 'extra': 'argument'})
+        assert handler.hits == 1
+
+
+def test_evicts_least_recently_used(test_directory):
+    def handler(data):
+        return MockHttpResponse(
+            f'<OAI-PMH><{data["verb"]}/></OAI-PMH>'.encode())
+    size = len(handler({'verb': 'A'}).content)
+    with cache.CachingHandler(handler, test_directory, max_bytes=2 * size,
+                              clock=Counter()) as cached:
+        cached({'verb': 'A'})
+        cached({'verb': 'B'})
+        cached({'verb': 'A'})
+        cached({'verb': 'C'})
+        assert cached.cached_bytes == 2 * size
+        cached({'verb': 'A'})
+        cached({'verb': 'C'})
+        assert cached.hits == 3
+        cached({'verb': 'B'})
+        assert cached.misses == 4
+
+
+def test_errors_are_not_cached(test_directory):
+    answers = [MockHttpResponse(b'', status_code=503),
+               MockHttpResponse(b'<OAI-PMH><error code="badResumptionToken"/>'
+                                b'</OAI-PMH>'),
+               MockHttpResponse(b'<OAI-PMH><ListRecords><rec')]
+    with cache.CachingHandler(lambda data: answers.pop(),
+                              test_directory) as handler:
+        for _ in range(3):
+            handler({'verb': 'ListRecords'})
+        assert handler.cached_bytes == 0
+        assert handler.misses == 3
@@ -0,0 +1,76 @@
+import pytest
+import os
+import shutil
+from scraper import checkpoint
+from scraper import oai
+from scraper import scraper
+from scraper import storage
+from tests.helpers import chain_handler
+
+#
+# Fixtures
+#
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+#
+# Unit tests
+#
+
+def test_checkpoint_syncs_in_batches(test_directory):
+    syncs = 0
+    def on_sync():
+        nonlocal syncs
+        syncs += 1
+    cp = checkpoint.Checkpoint(test_directory, sync_every=3, on_sync=on_sync)
+    for part in range(1, 6):
+        cp.record(part, f'TOKEN{part}')
+    assert syncs == 1
+    reloaded = checkpoint.Checkpoint(test_directory)
+    assert (reloaded.part, reloaded.token) == (3, 'TOKEN3')
+    cp.close()
+    reloaded = checkpoint.Checkpoint(test_directory)
+    assert (reloaded.part, reloaded.token) == (5, 'TOKEN5')
+    assert not os.path.exists(os.path.join(test_directory,
+                                           'checkpoint.json.tmp'))
+
+def test_checkpoint_syncs_on_completion(test_directory):
+    cp = checkpoint.Checkpoint(test_directory, sync_every=100)
+    cp.record(1, None)
+    assert checkpoint.Checkpoint(test_directory).complete
+
+def test_checkpoint_keeps_the_first_request_arguments(test_directory):
+    cp = checkpoint.Checkpoint(test_directory, sync_every=1)
+    cp.begin({'metadata_prefix': 'oai_dc', 'time_from': '2020-01-01'})
+    cp.record(1, 'TOKEN1')
+    assert checkpoint.Checkpoint(test_directory).arguments == \
+        {'metadata_prefix': 'oai_dc', 'time_from': '2020-01-01'}
+    cp.reset()
+    assert cp.arguments is None
+
+def test_worker_resumes_without_storing_twice(test_directory):
+    requested = []
+    handler = chain_handler(6, requested)
+    stg = storage.MockStorage(10000)
+    cp = checkpoint.Checkpoint(test_directory, sync_every=2)
+    worker = scraper.Worker(stg, handler, checkpoint=cp)
+    worker.run(lambda: oai.request_list_records(handler), max_requests=3)
+    # Simulate losing the unsynced tail of the checkpoint in a crash.
+    cp = checkpoint.Checkpoint(test_directory)
+    assert cp.part == 3
+    stg.store_count = 4
+    (token, skip) = scraper.resume_point(cp, stg)
+    assert (token, skip) == ('3', 1)
+    requested.clear()
+    worker = scraper.Worker(stg, handler, checkpoint=cp)
+    stored = worker.run(
+        lambda: oai.resume_request_list_records(handler, token), skip=skip)
+    assert requested == [3, 4, 5]
+    assert stored == 2
+    assert stg.store_count == 6
+    assert checkpoint.Checkpoint(test_directory).complete
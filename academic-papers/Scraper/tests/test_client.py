@@ -0,0 +1,35 @@
+import httpretty
+import pytest
+from scraper import client
+from scraper import oai
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    return 'http://archive.org/oai'
+
+
+@httpretty.activate
+def test_session_handler_posts_to_url(base_url):
+    httpretty.register_uri(httpretty.POST, base_url, body=b'<OAI-PMH/>')
+    with client.SessionHandler(base_url) as handler:
+        handler({'verb': oai.Verbs.IDENTIFY})
+    assert httpretty.last_request().parsed_body == {'verb': ['Identify']}
+
+
+@httpretty.activate
+def test_session_handler_asks_for_compression(base_url):
+    httpretty.register_uri(httpretty.POST, base_url, body=b'<OAI-PMH/>')
+    with client.SessionHandler(base_url) as handler:
+        handler({'verb': oai.Verbs.IDENTIFY})
+    encoding = httpretty.last_request().headers['Accept-Encoding']
+    assert 'gzip' in encoding
+    assert 'deflate' in encoding
+
+
+@httpretty.activate
+def test_session_handler_works_with_base_oai_request(base_url):
+    httpretty.register_uri(httpretty.POST, base_url, body=b'<OAI-PMH/>')
+    with client.SessionHandler(base_url) as handler:
+        response = oai.base_oai_request(handler, oai.Verbs.IDENTIFY)
+    assert response.data == b'<OAI-PMH/>'
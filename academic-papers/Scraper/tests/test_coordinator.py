@@ -0,0 +1,258 @@
+import requests
+import zmq.green as zmq
+from scraper import coordinator
+from scraper import monitor
+from scraper import oai
+from scraper import partition
+from scraper import retry
+from scraper import storage
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class LocalClient(coordinator.CoordinatorClient):
+    """Calls a Coordinator directly rather than over zmq."""
+
+    def __init__(self, coordinator, worker):
+        super().__init__('inproc://unused', worker)
+        self.coordinator = coordinator
+
+    def _call(self, **request):
+        request['worker'] = self.worker
+        return self.coordinator.handle(request)
+
+
+def partitions(*names):
+    return [partition.Partition(name, None, None, name) for name in names]
+
+
+def page(token=''):
+    return (f'<OAI-PMH><ListRecords><record/>'
+            f'<resumptionToken>{token}</resumptionToken>'
+            f'</ListRecords></OAI-PMH>').encode()
+
+
+def test_claims_hand_out_each_partition_once():
+    coord = coordinator.Coordinator(partitions('a', 'b'))
+    assert coord.claim('w1')[0].name == 'a'
+    assert coord.claim('w2')[0].name == 'b'
+    assert coord.claim('w3') is None
+    assert not coord.finished()
+    assert coord.complete('w1', 'a')
+    assert coord.complete('w2', 'b')
+    assert coord.finished()
+
+
+def test_expired_lease_resumes_from_last_token():
+    clock = FakeClock()
+    coord = coordinator.Coordinator(partitions('a'), lease_seconds=60,
+                                    clock=clock)
+    coord.claim('w1')
+    clock.sleep(50)
+    assert coord.heartbeat('w1', 'a', 'T2', pages=2)
+    clock.sleep(50)
+    assert coord.claim('w2') is None
+    clock.sleep(20)
+    assert coord.claim('w2') == (partitions('a')[0], 'T2', 2)
+    assert not coord.heartbeat('w1', 'a', 'T3')
+    assert not coord.complete('w1', 'a')
+    assert coord.status()['a']['worker'] == 'w2'
+
+
+def test_partition_fails_after_max_attempts():
+    coord = coordinator.Coordinator(partitions('a'), max_attempts=2)
+    coord.claim('w1')
+    coord.fail('w1', 'a', 'badArgument')
+    coord.claim('w1')
+    coord.fail('w1', 'a', 'badArgument')
+    assert coord.claim('w1') is None
+    assert coord.finished()
+    assert coord.status()['a']['state'] == 'failed'
+
+
+def test_drained_once_every_worker_is_told_it_is_finished():
+    coord = coordinator.Coordinator(partitions('a'))
+    coord.handle({'op': 'claim', 'worker': 'w1'})
+    coord.handle({'op': 'claim', 'worker': 'w2'})
+    coord.handle({'op': 'complete', 'worker': 'w1', 'name': 'a'})
+    assert coord.finished()
+    assert not coord.drained()
+    coord.handle({'op': 'claim', 'worker': 'w1'})
+    assert not coord.drained()
+    coord.handle({'op': 'claim', 'worker': 'w2'})
+    assert coord.drained()
+
+
+def test_client_decodes_claims():
+    client = LocalClient(coordinator.Coordinator(partitions('a')), 'w1')
+    assert client.claim() == (partitions('a')[0], None, 0)
+    assert client.claim() is None
+    assert client.complete('a')
+    assert client.claim() is False
+
+
+def test_work_harvests_every_partition(monkeypatch):
+    chains = {'a': [page('a2'), page()], 'b': [page()]}
+    def request_list_records(handler, metadata_prefix, time_from,
+                             time_until, select_set):
+        return chains[select_set].pop(0)
+    def resume_request_list_records(handler, token):
+        return chains[token[0]].pop(0)
+    monkeypatch.setattr(oai, 'request_list_records', request_list_records)
+    monkeypatch.setattr(oai, 'resume_request_list_records',
+                        resume_request_list_records)
+    coord = coordinator.Coordinator(partitions('a', 'b'))
+    stg = storage.MockStorage(10000)
+    assert coordinator.work(LocalClient(coord, 'w1'), stg, None) == 2
+    assert stg.store_count == 3
+    assert coord.status()['a']['pages'] == 2
+    assert coord.finished()
+
+
+def test_work_starts_a_partition_over_when_its_token_expired(monkeypatch):
+    chain = [page('a2'), page('a3'), page()]
+    def request_list_records(handler, metadata_prefix, time_from,
+                             time_until, select_set):
+        chain[:] = [page('a2'), page('a3'), page()]
+        return chain.pop(0)
+    def resume_request_list_records(handler, token):
+        if token == 'expired':
+            return (b'<OAI-PMH><error code="badResumptionToken">expired'
+                    b'</error></OAI-PMH>')
+        return chain.pop(0)
+    monkeypatch.setattr(oai, 'request_list_records', request_list_records)
+    monkeypatch.setattr(oai, 'resume_request_list_records',
+                        resume_request_list_records)
+    coord = coordinator.Coordinator(partitions('a'))
+    coord.claim('w0')
+    coord.heartbeat('w0', 'a', 'expired', pages=2)
+    coord.fail('w0', 'a')
+    stg = storage.MockStorage(10000)
+    assert coordinator.work(LocalClient(coord, 'w1'), stg, None,
+                            sleep=lambda seconds: None,
+                            retry_policy=retry.RetryPolicy()) == 1
+    # The two pages stored before the token are only fetched again.
+    assert stg.store_count == 1
+    assert coord.status()['a']['pages'] == 3
+
+
+def test_work_abandons_partition_when_lease_is_lost(monkeypatch):
+    coord = coordinator.Coordinator(partitions('a'))
+    def request_list_records(handler, **kwargs):
+        # Another worker takes over while this page is in flight.
+        coord.expire = lambda: None
+        coord.fail('w1', 'a')
+        coord.claim('w2')
+        return page('a2')
+    monkeypatch.setattr(oai, 'request_list_records', request_list_records)
+    client = LocalClient(coord, 'w1')
+    sleeps = []
+    def sleep(seconds):
+        sleeps.append(seconds)
+        coord.complete('w2', 'a')
+    stg = storage.MockStorage(10000)
+    assert coordinator.work(client, stg, None, sleep=sleep) == 0
+    assert stg.store_count == 1
+    assert sleeps == [5]
+
+
+def test_work_heartbeats_while_backing_off(monkeypatch):
+    clock = FakeClock()
+    failures = [requests.exceptions.Timeout(), requests.exceptions.Timeout()]
+    def request_list_records(handler, **kwargs):
+        if failures:
+            raise failures.pop(0)
+        return page()
+    monkeypatch.setattr(oai, 'request_list_records', request_list_records)
+    coord = coordinator.Coordinator(partitions('a'), lease_seconds=300,
+                                    clock=clock)
+    policy = retry.RetryPolicy(base_delay=200, max_delay=200,
+                               random=lambda: 1.0)
+    def sleep(seconds):
+        clock.sleep(seconds)
+        coord.expire()
+    # 400 seconds of backoff, longer than the lease.
+    assert coordinator.work(LocalClient(coord, 'w1'),
+                            storage.MockStorage(10000), None,
+                            sleep=sleep, retry_policy=policy) == 1
+    assert clock.now == 400
+    assert coord.status()['a']['attempts'] == 1
+
+
+def test_monitor_answers_coordination_requests():
+    actor = monitor.Monitor.start(None, partitions=partitions('a'))
+    try:
+        port = actor.ask({'msg': 'port'})
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        socket.send_json({'op': 'claim', 'worker': 'w1'})
+        reply = socket.recv_json()
+        socket.close(linger=0)
+        assert not actor.ask({'msg': 'finished'})
+    finally:
+        actor.stop()
+    assert reply['response']['partition']['name'] == 'a'
+
+
+def test_malformed_requests_are_answered_with_an_error():
+    actor = monitor.Monitor.start(None, partitions=partitions('a'))
+    try:
+        port = actor.ask({'msg': 'port'})
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.setsockopt(zmq.RCVTIMEO, 5000)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        replies = []
+        for request in ({'op': 'heartbeat', 'worker': 'w1'},
+                        {'op': 'complete', 'worker': 'w1', 'name': None},
+                        {'op': ['claim'], 'worker': 'w1'},
+                        {'op': 'claim', 'worker': 'w1'}):
+            socket.send_json(request)
+            replies.append(socket.recv_json()['response'])
+        socket.close(linger=0)
+        assert actor.is_alive()
+    finally:
+        actor.stop()
+    assert all('error' in reply for reply in replies[:3])
+    assert replies[3]['partition']['name'] == 'a'
+
+
+def test_work_ends_when_coordinator_stops_after_a_completion(monkeypatch):
+    monkeypatch.setattr(oai, 'request_list_records',
+                        lambda handler, **kwargs: page())
+    coord = coordinator.Coordinator(partitions('a', 'b'))
+    client = LocalClient(coord, 'w1')
+    answered = iter([True, True, False])
+    def claim():
+        if not next(answered):
+            raise zmq.Again()
+        return coordinator.CoordinatorClient.claim(client)
+    client.claim = claim
+    sleeps = []
+    assert coordinator.work(client, storage.MockStorage(10000), None,
+                            sleep=sleeps.append) == 2
+    assert sleeps == []
+
+
+def test_work_asks_again_when_coordinator_is_not_answering_yet():
+    coord = coordinator.Coordinator([])
+    client = LocalClient(coord, 'w1')
+    answered = iter([False, True])
+    def claim():
+        if not next(answered):
+            raise zmq.Again()
+        return coordinator.CoordinatorClient.claim(client)
+    client.claim = claim
+    sleeps = []
+    assert coordinator.work(client, storage.MockStorage(10000), None,
+                            sleep=sleeps.append) == 0
+    assert sleeps == [5]
@@ -0,0 +1,99 @@
+import pytest
+import os
+import shutil
+from scraper import dedup
+from scraper import index
+from scraper import oai
+from scraper import scraper
+from scraper import storage
+
+#
+# Fixtures
+#
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def dedup_storage(test_directory):
+    index = dedup.RecordIndex(os.path.join(test_directory, 'records.sqlite'))
+    delta_path = os.path.join(test_directory, 'delta')
+    stored = []
+    class RecordingStorage(storage.MockStorage):
+        def store(self, data, records=None, token=None, items=None,
+                  reservation=None):
+            stored.append(data)
+            return super().store(data, records, token, items, reservation)
+    yield (dedup.DedupStorage(RecordingStorage(100000), index, delta_path),
+           stored, delta_path)
+    index.close()
+
+
+def page(*headers):
+    records = ''.join(
+        f'<record><header><identifier>{identifier}</identifier>'
+        f'<datestamp>{datestamp}</datestamp></header></record>'
+        for identifier, datestamp in headers)
+    return (f'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            f'<ListRecords>{records}</ListRecords></OAI-PMH>').encode()
+
+
+def identifiers(data):
+    return [element.findtext('{*}header/{*}identifier')
+            for element in oai.Response(data).records()]
+
+#
+# Unit tests
+#
+
+def test_record_index_looks_up_in_batches(test_directory):
+    index = dedup.RecordIndex(os.path.join(test_directory, 'records.sqlite'))
+    index.update((f'id{n}', '2017-01-01') for n in range(1200))
+    found = index.datestamps(f'id{n}' for n in range(0, 2400, 2))
+    assert len(found) == 600
+    index.close()
+
+
+def test_dedup_storage_skips_unchanged_pages(dedup_storage):
+    (stg, stored, delta_path) = dedup_storage
+    data = page(('a', '2017-01-01'), ('b', '2017-01-01'))
+    stg.store(data)
+    stg.store(data)
+    assert stored == [data]
+    assert stg.skipped_records == 2
+
+
+def test_dedup_storage_keeps_only_changed_records(dedup_storage):
+    (stg, stored, delta_path) = dedup_storage
+    stg.store(page(('a', '2017-01-01'), ('b', '2017-01-01')))
+    stg.store(page(('a', '2017-01-01'), ('b', '2017-02-01'),
+                   ('c', '2017-02-01')))
+    assert identifiers(stored[1]) == ['b', 'c']
+    with open(delta_path) as f:
+        lines = f.read().splitlines()
+    assert lines[-2:] == ['b\t2017-02-01\tupdated', 'c\t2017-02-01\tnew']
+
+
+def test_stored_pages_are_parsed_once(test_directory, monkeypatch):
+    parses = []
+    class CountingResponse(oai.Response):
+        def __init__(self, data):
+            parses.append(data)
+            super().__init__(data)
+    monkeypatch.setattr(oai, 'Response', CountingResponse)
+    records = dedup.RecordIndex(os.path.join(test_directory, 'records'))
+    idx = index.InvertedIndex(os.path.join(test_directory, 'index'))
+    stg = dedup.DedupStorage(
+        index.IndexingStorage(storage.MockStorage(100000), idx), records,
+        os.path.join(test_directory, 'delta'))
+    scraper.store(page(('a', '2017-01-01')), stg)
+    scraper.store(page(('a', '2017-01-01')), stg)
+    assert len(parses) == 2
+    assert stg.skipped_records == 1
+    idx.close()
+    records.close()
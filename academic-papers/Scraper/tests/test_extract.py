@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import os
+import shutil
+from scraper import extract
+from scraper import storage
+
+#
+# Fixtures
+#
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def data_file(filename):
+    path = os.path.join(os.path.dirname(__file__), 'data', filename)
+    with open(path, 'rb') as f:
+        return f.read()
+
+#
+# Unit tests
+#
+
+def test_extract_records_reads_header_and_dc_fields():
+    records = extract.extract_records(
+        data_file('list_records_with_resumption.xml'))
+    first = records[0]
+    assert first['identifier'] == 'oai:arXiv.org:0704.0001'
+    assert first['datestamp'] == '2008-11-26'
+    assert first['set_spec'] == ['physics:hep-ph']
+    assert first['title'].startswith('Calculation of prompt diphoton')
+    assert first['creators'] == ['Balázs, C.', 'Berger, E. L.',
+                                 'Nadolsky, P. M.', 'Yuan, C. -P.']
+    assert first['subjects'] == ['High Energy Physics - Phenomenology']
+    assert first['date'] == '2007-04-02'
+
+
+def test_columns_round_trip_through_chunk(test_directory):
+    records = extract.extract_records(
+        data_file('list_records_with_resumption.xml'))
+    path = os.path.join(test_directory, 'chunk.npz')
+    np.savez(path, **extract.to_columns(records))
+    chunk = extract.RecordChunk(path)
+    assert len(chunk) == len(records)
+    assert chunk.column('identifier') == [r['identifier'] for r in records]
+    assert chunk.column('creators') == [r['creators'] for r in records]
+    assert chunk.column('date') == [r['date'] for r in records]
+
+
+def test_extract_chunks_stored_pages(test_directory):
+    harvest = os.path.join(test_directory, 'harvest')
+    out = os.path.join(test_directory, 'out')
+    os.mkdir(harvest)
+    os.mkdir(out)
+    ls = storage.LocalStorage(harvest)
+    page = data_file('success_response_list_records.xml')
+    for _ in range(3):
+        ls.store(page)
+    ls.sync()
+    per_page = len(extract.extract_records(page))
+    chunks = extract.extract(harvest, out, pages_per_chunk=2, processes=2)
+    assert [count for (_, count) in chunks] == [2 * per_page, per_page]
+    assert len(extract.RecordChunk(chunks[0][0])) == 2 * per_page
+
+
+def test_extract_reads_segments_while_harvest_is_open(test_directory):
+    harvest = os.path.join(test_directory, 'harvest')
+    out = os.path.join(test_directory, 'out')
+    os.mkdir(harvest)
+    os.mkdir(out)
+    ss = storage.SegmentStorage(harvest)
+    page = data_file('success_response_list_records.xml')
+    for _ in range(3):
+        ss.store(page)
+    chunks = extract.extract(harvest, out, pages_per_chunk=2, processes=1)
+    assert len(chunks) == 2
+    ss.store(page)
+    assert ss.read(4) == page
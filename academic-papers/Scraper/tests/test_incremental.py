@@ -0,0 +1,65 @@
+import pytest
+import os
+import shutil
+from scraper import incremental
+from tests.helpers import MockHttpResponse
+
+#
+# Fixtures
+#
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def identify_handler(sent):
+    path = os.path.join(os.path.dirname(__file__), 'data',
+                        'success_response_identify.xml')
+    with open(path, 'rb') as f:
+        identify = f.read()
+    def _handler(data):
+        sent.append(data)
+        return MockHttpResponse(identify)
+    return _handler
+
+#
+# Unit tests
+#
+
+def test_identify_reads_granularity_and_date():
+    (granularity, response_date) = incremental.identify(identify_handler([]))
+    assert granularity == incremental.SECONDS_GRANULARITY
+    assert response_date == '2002-02-08T12:00:01Z'
+
+
+def test_format_from_respects_granularity():
+    date = '2017-08-09T02:22:00Z'
+    assert incremental.format_from(
+        date, incremental.SECONDS_GRANULARITY) == date
+    assert incremental.format_from(
+        date, incremental.DAY_GRANULARITY) == '2017-08-09'
+
+
+def test_first_harvest_is_full(test_directory):
+    sent = []
+    state = incremental.IncrementalState(test_directory)
+    request = state.initial_request(identify_handler(sent))
+    assert request.keywords['time_from'] is None
+    assert state.pending == '2002-02-08T12:00:01Z'
+
+
+def test_completed_harvest_sets_next_from(test_directory):
+    state = incremental.IncrementalState(test_directory)
+    state.begin('2017-08-09T02:22:00Z')
+    # An interrupted harvest keeps the date it started from.
+    state = incremental.IncrementalState(test_directory)
+    state.begin('2017-08-10T00:00:00Z')
+    state.finish()
+    state = incremental.IncrementalState(test_directory)
+    assert state.last_harvest == '2017-08-09T02:22:00Z'
+    request = state.initial_request(identify_handler([]))
+    assert request.keywords['time_from'] == '2017-08-09T02:22:00Z'
@@ -0,0 +1,89 @@
+import math
+import pytest
+import os
+import shutil
+from scraper import index
+from scraper import storage
+
+#
+# Fixtures
+#
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def page(*records):
+    body = ''.join(
+        f'<record><header><identifier>{identifier}</identifier></header>'
+        f'<metadata><dc xmlns="http://purl.org/dc/elements/1.1/">'
+        f'<title>{title}</title><description>{abstract}</description>'
+        f'</dc></metadata></record>'
+        for identifier, title, abstract in records)
+    return (f'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            f'<ListRecords>{body}</ListRecords></OAI-PMH>').encode()
+
+#
+# Unit tests
+#
+
+def test_search_matches_all_terms(test_directory):
+    idx = index.InvertedIndex(test_directory)
+    idx.add_page(1, page(('a', 'Graph Decompositions', 'sparse graphs'),
+                         ('b', 'Diphoton production', 'graph of photons')))
+    assert idx.search('graph') == [index.Hit('a', 1, 0), index.Hit('b', 1, 1)]
+    assert idx.search('Graph photons') == [index.Hit('b', 1, 1)]
+    assert idx.search('missing') == []
+    idx.close()
+
+
+def test_search_spans_segments_and_buffer(test_directory):
+    idx = index.InvertedIndex(test_directory, flush_postings=1,
+                              merge_factor=2)
+    for part in range(1, 6):
+        idx.add_page(part, page((f'id{part}', 'common title', f'term{part}')))
+    assert len(idx.search('common')) == 5
+    assert len(os.listdir(test_directory)) <= 3
+    idx.close()
+    idx = index.InvertedIndex(test_directory)
+    assert idx.search('term3') == [index.Hit('id3', 3, 0)]
+    idx.close()
+
+
+def test_merges_keep_write_amplification_logarithmic(test_directory):
+    idx = index.InvertedIndex(test_directory, flush_postings=1,
+                              merge_factor=4)
+    for part in range(1, 201):
+        idx.add_page(part, page((f'id{part}', f'title{part}', '')))
+    assert idx.search('title200') == [index.Hit('id200', 200, 0)]
+    # 200 postings, each rewritten at most once per tier.
+    assert idx.postings_written <= 200 * (1 + math.log(200, 4))
+    idx.merge()
+    assert len(os.listdir(test_directory)) == 1
+    assert len(idx.search('title7')) == 1
+    idx.close()
+
+
+def test_indexing_storage_indexes_stored_part(test_directory):
+    idx = index.InvertedIndex(os.path.join(test_directory, 'index'))
+    stg = index.IndexingStorage(storage.MockStorage(10000), idx)
+    stg.store(page(('a', 'first', '')))
+    stg.store(page(('b', 'second', '')))
+    assert idx.search('second') == [index.Hit('b', 2, 0)]
+    idx.close()
+
+
+def test_indexing_storage_uses_part_returned_by_store(test_directory):
+    class InterleavedStorage(storage.MockStorage):
+        def page_count(self):
+            # Another chain has stored more pages in the meantime.
+            return super().page_count() + 10
+    idx = index.InvertedIndex(os.path.join(test_directory, 'index'))
+    stg = index.IndexingStorage(InterleavedStorage(10000), idx)
+    stg.store(page(('a', 'first', '')))
+    assert idx.search('first') == [index.Hit('a', 1, 0)]
+    idx.close()
@@ -0,0 +1,101 @@
+import threading
+import pytest
+from scraper import listing
+from scraper import oai
+from scraper import rate
+from tests.helpers import MockHttpResponse, chain_page
+
+
+def list_page(verb, item, token, count=2):
+    token_xml = f'<resumptionToken>{token}</resumptionToken>' if token else ''
+    items = ''.join(f'<{item}><identifier>{token}-{n}</identifier></{item}>'
+                    for n in range(count))
+    return (f'<OAI-PMH><{verb}>{items}{token_xml}</{verb}>'
+            f'</OAI-PMH>').encode()
+
+
+def verb_handler(length, requested=None):
+    """Serves chains of length pages for every list verb."""
+    items = {'ListRecords': 'record', 'ListIdentifiers': 'header',
+             'ListSets': 'set'}
+    def _handler(data):
+        (page, token) = chain_page(data, length)
+        if requested is not None:
+            requested.append((data['verb'], page))
+        return MockHttpResponse(list_page(data['verb'], items[data['verb']],
+                                          token))
+    return _handler
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_lists_every_item_of_every_page(prefetch):
+    handler = verb_handler(3)
+    records = list(listing.list_records(handler, prefetch=prefetch))
+    assert len(records) == 6
+    assert all(oai.local_name(record) == 'record' for record in records)
+    # Items are kept intact once the parser has moved past them.
+    assert records[0].findtext('identifier') == '1-0'
+
+
+def test_lists_identifiers_and_sets():
+    requested = []
+    handler = verb_handler(2, requested)
+    headers = list(listing.list_identifiers(handler))
+    sets = list(listing.list_sets(handler))
+    assert [oai.local_name(header) for header in headers] == ['header'] * 4
+    assert [oai.local_name(s) for s in sets] == ['set'] * 4
+    assert requested == [('ListIdentifiers', 0), ('ListIdentifiers', 1),
+                         ('ListSets', 0), ('ListSets', 1)]
+
+
+def test_prefetches_pages_ahead_of_the_consumer():
+    requested = []
+    fetched = threading.Semaphore(0)
+    chain = verb_handler(10, requested)
+    def handler(data):
+        response = chain(data)
+        fetched.release()
+        return response
+    records = listing.list_records(handler, prefetch=3)
+    next(records)
+    # The page being consumed, three queued, and one waiting to be queued.
+    for _ in range(5):
+        assert fetched.acquire(timeout=5)
+    assert not fetched.acquire(timeout=0.3)
+    assert len(requested) == 5
+    records.close()
+
+
+def test_no_records_match_is_an_empty_list():
+    def handler(data):
+        return MockHttpResponse(b'<OAI-PMH><error code="noRecordsMatch"/>'
+                                b'</OAI-PMH>')
+    assert list(listing.list_records(handler)) == []
+
+
+def test_errors_reach_the_consumer_in_order():
+    chain = verb_handler(3)
+    def handler(data):
+        if data.get('resumptionToken') == '2':
+            return MockHttpResponse(b'', status_code=500)
+        return chain(data)
+    records = listing.list_records(handler)
+    assert len([next(records) for _ in range(4)]) == 4
+    with pytest.raises(oai.HttpStatusError):
+        next(records)
+
+
+def test_waits_out_retry_after():
+    class Throttled:
+        status_code = 503
+        headers = {'Retry-After': '20'}
+    chain = verb_handler(2)
+    answers = [Throttled()]
+    def handler(data):
+        return answers.pop() if answers else chain(data)
+    sleeps = []
+    records = listing.list_records(handler, prefetch=0,
+                                   limiter=rate.RateLimiter(),
+                                   sleep=sleeps.append)
+    assert len(list(records)) == 4
+    assert sleeps[:2] == pytest.approx([0, 20], abs=0.1)
@@ -0,0 +1,142 @@
+import pytest
+import zmq.green as zmq
+from scraper import metrics
+from scraper import monitor
+from scraper import oai
+from scraper import rate
+from scraper import scraper
+from scraper import storage
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeMonitor:
+
+    def __init__(self):
+        self.updates = []
+
+    def tell(self, message):
+        assert message['msg'] == 'update'
+        self.updates.append(message['update'])
+
+
+def page(nbytes, latency):
+    return {'kind': 'page', 'bytes': nbytes, 'latency': latency,
+            'headroom': 1000}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert metrics.percentile(values, 0.5) == 51
+    assert metrics.percentile(values, 0.99) == 99
+    assert metrics.percentile([], 0.5) is None
+
+
+def test_rates_cover_the_window():
+    clock = FakeClock()
+    harvest = metrics.HarvestMetrics(window=10, clock=clock)
+    for _ in range(5):
+        clock.sleep(2)
+        harvest.update(page(100, 0.5))
+    snapshot = harvest.snapshot()
+    assert snapshot['pages_per_second'] == pytest.approx(0.5)
+    assert snapshot['bytes_per_second'] == pytest.approx(50)
+    assert snapshot['latency_p50'] == 0.5
+    assert snapshot['storage_headroom'] == 1000
+
+
+def test_old_events_expire_but_totals_remain():
+    clock = FakeClock()
+    harvest = metrics.HarvestMetrics(window=10, clock=clock)
+    harvest.update(page(100, 1.0))
+    harvest.update({'kind': 'sleep', 'seconds': 30, 'retry_after': True})
+    clock.sleep(20)
+    harvest.update(page(100, 2.0))
+    snapshot = harvest.snapshot()
+    assert snapshot['latency_p99'] == 2.0
+    assert snapshot['retry_after_seconds'] == 0
+    assert snapshot['retry_after_seconds_total'] == 30
+    assert snapshot['pages_total'] == 2
+    assert snapshot['bytes_total'] == 200
+
+
+def test_worker_reports_pages_and_retry_after_sleeps(monkeypatch):
+    clock = FakeClock()
+    responses = iter([503, 200, 200])
+    class ThrottledResponse:
+        headers = {'Retry-After': '20'}
+    def request():
+        if next(responses) == 503:
+            raise oai.HttpStatusError(503, ThrottledResponse())
+        return b'<OAI-PMH><ListRecords><record/>' \
+               b'<resumptionToken>T</resumptionToken></ListRecords></OAI-PMH>'
+    monkeypatch.setattr(oai, 'resume_request_list_records',
+                        lambda handler, token: request())
+    fake_monitor = FakeMonitor()
+    worker = scraper.Worker(storage.MockStorage(10000), None,
+                            sleep=clock.sleep,
+                            limiter=rate.RateLimiter(clock=clock),
+                            monitor=fake_monitor)
+    worker.run(request, max_requests=2)
+    kinds = [update['kind'] for update in fake_monitor.updates]
+    assert kinds.count('page') == 2
+    sleeps = [update for update in fake_monitor.updates
+              if update['kind'] == 'sleep']
+    assert sleeps[0]['retry_after']
+    assert sleeps[0]['seconds'] == pytest.approx(20)
+
+
+def test_page_latency_covers_only_the_request(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scraper, 'monotonic', clock)
+    class SlowStorage(storage.MockStorage):
+        def store(self, data, records=None, token=None, items=None,
+                  reservation=None):
+            clock.sleep(2)
+            return super().store(data, records, token, items, reservation)
+    def request():
+        clock.sleep(0.5)
+        return b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'
+    fake_monitor = FakeMonitor()
+    worker = scraper.Worker(SlowStorage(10000), None, sleep=clock.sleep,
+                            monitor=fake_monitor)
+    worker.run(request)
+    (update,) = [update for update in fake_monitor.updates
+                 if update['kind'] == 'page']
+    assert update['latency'] == pytest.approx(0.5)
+
+
+def test_monitor_stops_serving_before_closing_its_socket():
+    actor = monitor.Monitor.start(None)
+    actor.ask({'msg': 'port'})
+    serving = actor._actor._serving
+    actor.stop()
+    assert serving.dead
+    assert serving.successful()
+
+
+def test_monitor_serves_snapshot():
+    actor = monitor.Monitor.start(None)
+    try:
+        port = actor.ask({'msg': 'port'})
+        actor.tell({'msg': 'update', 'update': page(4096, 0.25)})
+        socket = zmq.Context.instance().socket(zmq.REQ)
+        socket.connect(f'tcp://127.0.0.1:{port}')
+        socket.send_json('status')
+        reply = socket.recv_json()
+        socket.close(linger=0)
+    finally:
+        actor.stop()
+    assert reply['request'] == 'status'
+    assert reply['response']['pages_total'] == 1
+    assert reply['response']['bytes_total'] == 4096
@@ -165,7 +165,7 @@ def test_base_oai_request_handles_success(base_url, success_response):
     data = oai.base_oai_request(response_handler, oai.Verbs.LIST_IDENTIFIERS)
     # MAINTENANCE NOTE
     # need to test payload, probably elsewhere
-    assert data == xml_data
+    assert data.data == xml_data
 
 
 @httpretty.activate
@@ -198,4 +198,83 @@ def test_oai_resume_list_records_sends_expected_request(base_url):
     assert outer_data['resumptionToken'] == 'TOKEN'
     assert set(outer_data.keys()) == {'verb', 'resumptionToken'}
 
+
+def test_response_reads_resumption_token():
+    with open(data_file_path('list_records_with_resumption.xml'), 'rb') as f:
+        response = oai.Response(f.read())
+    assert response.error is None
+    assert response.response_date == '2017-08-09T02:22:00Z'
+    token = response.resumption_token
+    assert token.token == '1972930|1001'
+    assert token.cursor == 0
+    assert token.complete_list_size == 1291722
+    assert oai.resumption_token_from_response(response) == '1972930|1001'
+
+
+def test_response_reads_token_attributes():
+    with open(data_file_path('success_response_list_identifiers.xml'),
+              'rb') as f:
+        response = oai.Response(f.read())
+    token = response.resumption_token
+    assert token.token == 'xxx45abttyz'
+    assert token.expiration_date == '2002-06-01T23:20:00Z'
+    assert token.complete_list_size == 6
+    assert token.cursor == 0
+
+
+def test_response_iterates_records_lazily():
+    with open(data_file_path('success_response_list_records.xml'), 'rb') as f:
+        response = oai.Response(f.read())
+    records = response.records()
+    first = next(records)
+    assert oai.local_name(first) == 'record'
+    assert response.record_count == 1
+    remaining = sum(1 for _ in records)
+    assert response.record_count == remaining + 1
+    assert oai.resumption_token_from_response(response) is None
+
+
+def test_response_records_after_token_reparses():
+    with open(data_file_path('success_response_list_records.xml'), 'rb') as f:
+        response = oai.Response(f.read())
+    response.resumption_token
+    count = response.record_count
+    assert count > 0
+    assert sum(1 for _ in response.records()) == count
+
+
+def test_response_reads_error_code(error_response):
+    (filename, code) = error_response
+    with open(data_file_path(filename), 'rb') as f:
+        response = oai.Response(f.read())
+    assert response.error == code
+
+
+def test_response_flags_bad_xml():
+    response = oai.Response(b'some data')
+    assert response.error is None
+    assert response.resumption_token is None
+    assert list(response.records()) == []
+    assert response.malformed
+
+
+def test_truncated_response_is_not_end_of_list():
+    data = b'<OAI-PMH><ListRecords><record/><record>'
+    with pytest.raises(oai.MalformedResponseError):
+        oai.resumption_token_from_response(data)
+
+
+def test_html_response_is_malformed():
+    response = oai.Response(b'<html><body>Proxy error</body></html>')
+    assert response.malformed
+    with pytest.raises(oai.MalformedResponseError):
+        oai.resumption_token_from_response(response)
+
+
+def test_complete_response_is_not_malformed():
+    response = oai.Response(
+        b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>')
+    assert not response.malformed
+    assert oai.resumption_token_from_response(response) is None
+
 # TODO: test requests have required parameters
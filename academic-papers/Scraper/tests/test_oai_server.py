@@ -0,0 +1,88 @@
+import os
+import tempfile
+import pytest
+from scraper import client
+from scraper import oai
+from scraper import rate
+from scraper import scraper
+from scraper import spool
+from scraper import storage
+from tests import benchmark
+from tests import oai_server
+
+
+def harvest(server, **worker_options):
+    stg = storage.MockStorage(10 ** 9)
+    with client.SessionHandler(server.url) as handler:
+        worker = scraper.Worker(stg, handler, **worker_options)
+        worker.run(lambda: oai.request_list_records(handler))
+    return (stg, worker)
+
+
+def test_worker_harvests_whole_chain():
+    with oai_server.OaiServer(pages=5, records_per_page=20) as server:
+        (stg, worker) = harvest(server)
+    assert stg.store_count == 5
+    assert worker.complete
+
+
+def test_pages_have_distinct_identifiers():
+    with oai_server.OaiServer(pages=2, records_per_page=1500) as server:
+        first = oai.Response(server.page(1))
+        second = oai.Response(server.page(2))
+    identifiers = [element.findtext('{*}header/{*}identifier')
+                   for response in (first, second)
+                   for element in response.records()]
+    assert len(set(identifiers)) == 3000
+    assert oai.resumption_token_from_response(first) == '2'
+    assert oai.resumption_token_from_response(second) is None
+
+
+def test_worker_honours_injected_retry_after():
+    with oai_server.OaiServer(pages=4, records_per_page=5, throttle_every=2,
+                              retry_after=0) as server:
+        (stg, _) = harvest(server,
+                           limiter=rate.RateLimiter(max_interval=0))
+        assert server.throttled == 3
+    assert stg.store_count == 4
+
+
+def test_error_page_stops_worker():
+    with oai_server.OaiServer(pages=3, records_per_page=5,
+                              error_pages={2: 'badResumptionToken'}) \
+            as server:
+        with pytest.raises(RuntimeError):
+            harvest(server)
+
+
+def test_compressed_responses():
+    with oai_server.OaiServer(pages=2, records_per_page=5,
+                              compress=True) as server:
+        (stg, _) = harvest(server)
+    assert stg.store_count == 2
+
+
+def test_benchmark_reports_throughput():
+    result = benchmark.run(pages=2, records_per_page=10)
+    assert result['pages'] == 2
+    assert result['pages_per_second'] > 0
+    assert result['peak_rss_mb'] > 0
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_spooled_pages_are_stored_as_served(compress):
+    with oai_server.OaiServer(pages=3, records_per_page=200,
+                              compress=compress) as server, \
+            tempfile.TemporaryDirectory() as directory:
+        stg = storage.LocalStorage(directory)
+        with client.SessionHandler(server.url,
+                                   spool_directory=directory) as handler:
+            worker = scraper.Worker(stg, handler)
+            assert worker.run(lambda: oai.request_list_records(handler)) == 3
+        stg.sync()
+        for number in (1, 2, 3):
+            path = os.path.join(directory, f'part_{number:04d}')
+            with open(path, 'rb') as f:
+                assert f.read() == server.page(number)
+        assert not [name for name in os.listdir(directory)
+                    if name.startswith(spool.Spool.PREFIX)]
@@ -0,0 +1,106 @@
+import datetime
+import os
+import shutil
+import gevent
+import pytest
+from scraper import oai
+from scraper import partition
+from scraper import storage
+from tests.helpers import MockHttpResponse, list_records_page
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def test_window_partitions_cover_range():
+    parts = partition.window_partitions(datetime.date(2017, 1, 1),
+                                        datetime.date(2017, 1, 10), 4)
+    assert [(p.time_from, p.time_until) for p in parts] == [
+        ('2017-01-01', '2017-01-04'),
+        ('2017-01-05', '2017-01-08'),
+        ('2017-01-09', '2017-01-10')]
+
+
+def test_set_partitions_reads_set_specs():
+    path = os.path.join(os.path.dirname(__file__), 'data',
+                        'success_response_list_sets.xml')
+    with open(path, 'rb') as f:
+        data = f.read()
+    parts = partition.set_partitions(lambda args: MockHttpResponse(data))
+    assert len(parts) > 0
+    assert all(p.select_set == p.name for p in parts)
+
+
+def test_harvester_runs_each_partition_into_one_storage():
+    def handler(args):
+        if 'resumptionToken' in args:
+            return MockHttpResponse(list_records_page(None))
+        return MockHttpResponse(list_records_page(args.get('set') + '-2'))
+    parts = [partition.Partition(name, None, None, name)
+             for name in ('a', 'b', 'c')]
+    stg = storage.MockStorage(10000)
+    harvester = partition.PartitionedHarvester(stg, handler, parts,
+                                               concurrency=2)
+    progress = harvester.run()
+    assert stg.store_count == 6
+    assert [p.pages for p in progress] == [2, 2, 2]
+    assert all(p.state == partition.PartitionProgress.DONE for p in progress)
+
+
+def test_harvester_treats_no_records_match_as_done():
+    def handler(args):
+        return MockHttpResponse(b'<OAI-PMH><error code="noRecordsMatch"/>'
+                                b'</OAI-PMH>')
+    parts = [partition.Partition('empty', '2017-01-01', '2017-01-02', None)]
+    harvester = partition.PartitionedHarvester(storage.MockStorage(100),
+                                               handler, parts)
+    (progress,) = harvester.run()
+    assert progress.state == partition.PartitionProgress.DONE
+    assert progress.pages == 0
+
+
+def test_progress_counts_pages_left_unstored_as_skipped():
+    class UnchangedStorage(storage.MockStorage):
+        def store(self, data, records=None, token=None, items=None,
+                  reservation=None):
+            # Like dedup.DedupStorage, when no record changed.
+            return None
+    progress = partition.PartitionProgress(
+        partition.Partition('a', None, None, 'a'))
+    stg = partition.ProgressStorage(UnchangedStorage(100), progress)
+    assert stg.store(b'page') is None
+    assert (progress.pages, progress.bytes, progress.skipped) == (0, 0, 1)
+    assert str(progress) == \
+        'a: pending, 0 pages, 0 bytes, 1 unchanged pages skipped'
+
+
+def test_interleaved_chains_keep_their_own_tokens(test_directory):
+    def handler(args):
+        token = args.get('resumptionToken') or args['set'] + '-1'
+        (name, page) = token.split('-')
+        token = f'{name}-{int(page) + 1}' if int(page) < 5 else None
+        return MockHttpResponse(list_records_page(token))
+    def yielding_writer(path, mode, data):
+        # Like tp_write, let the other chains run while the page is written.
+        gevent.sleep(0)
+        storage.actual_file_writer(path, mode, data)
+    parts = [partition.Partition(name, None, None, name)
+             for name in ('a', 'b', 'c', 'd')]
+    stg = storage.LocalStorage(test_directory, write_file=yielding_writer)
+    partition.PartitionedHarvester(stg, handler, parts, concurrency=4).run()
+    stored = stg.manifest.parts()
+    assert len(stored) == 20
+    for part in stored:
+        with open(os.path.join(test_directory, part.filename), 'rb') as f:
+            data = f.read()
+        assert part.token == oai.resumption_token_from_response(data)
+    with open(os.path.join(test_directory, 'resumption')) as f:
+        logged = [line.split('\t') for line in f.read().splitlines()]
+    for name in ('a', 'b', 'c', 'd'):
+        assert [token for (tagged, token) in logged if tagged == name] == \
+            [f'{name}-{page}' for page in range(2, 6)] + ['NONE']
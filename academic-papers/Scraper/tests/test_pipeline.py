@@ -0,0 +1,54 @@
+import threading
+import pytest
+from scraper import oai
+from scraper import pipeline
+from scraper import storage
+from tests.helpers import chain_handler, list_records_page
+
+
+class BlockingStorage(storage.MockStorage):
+
+    def __init__(self, capacity_bytes):
+        super().__init__(capacity_bytes)
+        self.release = threading.Event()
+        self.released_in_time = True
+
+    def store(self, data, records=None, token=None, items=None,
+              reservation=None):
+        if not self.release.wait(5):
+            self.released_in_time = False
+        return super().store(data, records, token, items, reservation)
+
+
+def test_pipelined_worker_stores_whole_chain_in_order():
+    handler = chain_handler(5)
+    stg = storage.MockStorage(10000)
+    worker = pipeline.PipelinedWorker(stg, handler)
+    assert worker.run(lambda: oai.request_list_records(handler)) == 5
+    assert stg.store_count == 5
+    assert stg.log_resumption_count == 5
+
+
+def test_pipelined_worker_fetches_ahead_of_writer():
+    handler = chain_handler(10)
+    fetched = 0
+    def counting_handler(data):
+        nonlocal fetched
+        fetched += 1
+        if fetched == 4:
+            stg.release.set()
+        return handler(data)
+    stg = BlockingStorage(10000)
+    worker = pipeline.PipelinedWorker(stg, counting_handler, queue_size=2)
+    worker.run(lambda: oai.request_list_records(counting_handler))
+    assert stg.released_in_time
+    assert stg.store_count == 10
+
+
+def test_pipelined_worker_stops_when_pending_writes_fill_storage():
+    handler = chain_handler(10)
+    page_size = len(list_records_page('1'))
+    stg = storage.MockStorage(page_size * 3)
+    worker = pipeline.PipelinedWorker(stg, handler)
+    assert worker.run(lambda: oai.request_list_records(handler)) == 3
+    assert stg.store_count == 3
@@ -0,0 +1,159 @@
+import time
+import gevent
+import pytest
+from scraper import rate
+from scraper import scraper
+from scraper import storage
+from scraper import oai
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_no_wait_without_min_interval():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(clock=clock)
+    for _ in range(3):
+        assert limiter.delay() == 0
+        limiter.acquire()
+
+
+def test_request_latency_is_subtracted_from_wait():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(min_interval=5, clock=clock)
+    limiter.acquire()
+    clock.sleep(2)
+    assert limiter.delay() == pytest.approx(3)
+    clock.sleep(4)
+    assert limiter.delay() == 0
+
+
+def test_retry_after_is_honored_once():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(min_interval=0, clock=clock)
+    limiter.acquire()
+    limiter.on_throttle(30)
+    assert limiter.delay() == pytest.approx(30)
+    clock.sleep(30)
+    limiter.acquire()
+    limiter.on_success()
+    clock.sleep(limiter.interval)
+    assert limiter.delay() < 30
+
+
+def test_recovers_to_min_interval_after_throttling():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(min_interval=1, clock=clock)
+    limiter.on_throttle(10)
+    assert limiter.interval > 1
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.interval == 1
+
+
+def test_worker_waits_on_the_limiter_of_its_host():
+    class Handler:
+        url = 'http://oai.example.org/oai'
+    clock = FakeClock()
+    shared = rate.limiter_for(Handler.url, clock=clock)
+    shared.on_throttle(30)
+    worker = scraper.Worker(storage.MockStorage(10000), Handler(),
+                            sleep=clock.sleep)
+    worker.run(lambda: b'<OAI-PMH><ListRecords/></OAI-PMH>')
+    assert clock.now == 30
+    assert rate.handler_limiter(None) is not rate.handler_limiter(None)
+
+
+def test_limiter_for_shares_per_host():
+    first = rate.limiter_for('http://export.arxiv.org/oai2')
+    second = rate.limiter_for('http://export.arxiv.org/other')
+    third = rate.limiter_for('http://archive.org/oai')
+    assert first is second
+    assert first is not third
+
+
+def test_worker_sleeps_retry_after_once(monkeypatch):
+    clock = FakeClock()
+    responses = iter([503, 200, 200])
+    class ThrottledResponse:
+        headers = {'Retry-After': '20'}
+    def request():
+        if next(responses) == 503:
+            raise oai.HttpStatusError(503, ThrottledResponse())
+        return b'<OAI-PMH><ListRecords><record/>' \
+               b'<resumptionToken>T</resumptionToken></ListRecords></OAI-PMH>'
+    monkeypatch.setattr(oai, 'resume_request_list_records',
+                        lambda handler, token: request())
+    limiter = rate.RateLimiter(clock=clock)
+    worker = scraper.Worker(storage.MockStorage(10000), None,
+                            sleep=clock.sleep, limiter=limiter)
+    assert worker.run(request, max_requests=2) == 2
+    assert clock.now == pytest.approx(20, abs=2)
+
+
+def test_bandwidth_overdraft_is_paid_back():
+    clock = FakeClock()
+    bandwidth = rate.BandwidthLimiter(1000, clock=clock)
+    bandwidth.consume(600)
+    assert bandwidth.delay() == 0
+    bandwidth.consume(2400)
+    assert bandwidth.delay() == pytest.approx(2)
+    clock.sleep(1.5)
+    assert bandwidth.delay() == pytest.approx(0.5)
+    # Idle time only builds up a second's worth of allowance.
+    clock.sleep(10)
+    bandwidth.consume(1500)
+    assert bandwidth.delay() == pytest.approx(0.5)
+
+
+def test_min_interval_can_be_changed():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(clock=clock)
+    limiter.acquire()
+    limiter.set_min_interval(10)
+    assert limiter.delay() == pytest.approx(10)
+    limiter.on_throttle(0)
+    assert limiter.interval == 20
+    limiter.set_min_interval(0)
+    assert limiter.interval == 20
+    limiter.on_success()
+    assert limiter.interval == 10
+
+
+def test_concurrent_callers_are_given_slots_of_their_own():
+    clock = FakeClock()
+    limiter = rate.RateLimiter(min_interval=0.2, clock=clock)
+    assert [limiter.reserve() for _ in range(4)] == \
+        pytest.approx([0, 0.2, 0.4, 0.6])
+    clock.sleep(0.6)
+    limiter.on_throttle(2)
+    # Only one request when the Retry-After runs out, then at the pace.
+    waits = [limiter.reserve() for _ in range(4)]
+    assert waits[0] == pytest.approx(2)
+    assert all(b - a == pytest.approx(limiter.interval)
+               for a, b in zip(waits, waits[1:]))
+
+
+def test_chains_sharing_a_limiter_take_turns():
+    limiter = rate.RateLimiter(min_interval=0.05)
+    sent = []
+    def handler(data):
+        sent.append(time.monotonic())
+        return b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'
+    workers = [scraper.Worker(storage.MockStorage(10000), handler,
+                              sleep=gevent.sleep, limiter=limiter)
+               for _ in range(4)]
+    gevent.joinall([gevent.spawn(worker.run, lambda: handler({}))
+                    for worker in workers])
+    sent.sort()
+    assert len(sent) == 4
+    assert all(b - a >= 0.045 for a, b in zip(sent, sent[1:]))
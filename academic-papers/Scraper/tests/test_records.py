@@ -0,0 +1,82 @@
+import os
+import shutil
+import pytest
+from scraper import records
+from scraper import storage
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def record(identifier, datestamp, title='', deleted=False):
+    status = ' status="deleted"' if deleted else ''
+    metadata = '' if deleted else (
+        f'<metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/'
+        f'OAI/2.0/oai_dc/" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:title>{title}</dc:title></oai_dc:dc></metadata>')
+    return (f'<record><header{status}><identifier>{identifier}</identifier>'
+            f'<datestamp>{datestamp}</datestamp></header>{metadata}'
+            f'</record>')
+
+
+def page(*records):
+    return (f'<OAI-PMH><ListRecords>{"".join(records)}</ListRecords>'
+            f'</OAI-PMH>').encode()
+
+
+def record_storage(directory, batch_size=5000):
+    return records.RecordStorage(
+        directory, batch_size=batch_size,
+        budget=storage.SpaceBudget(directory, lambda path: 10 ** 9))
+
+
+def test_stores_records_of_each_page(test_directory):
+    stg = record_storage(test_directory)
+    assert stg.store(page(record('a', '2020-01-01', 'A'),
+                          record('b', '2020-01-02', 'B'))) == 1
+    assert stg.store(page(record('c', '2020-01-03', 'C'))) == 2
+    stg.sync()
+    assert stg.page_count() == 2
+    stored = stg.get('b')
+    assert (stored.identifier, stored.datestamp, stored.deleted) == \
+        ('b', '2020-01-02', False)
+    assert b'<dc:title>B</dc:title>' in stored.xml
+    assert stg.get('z') is None
+
+
+def test_upserts_on_datestamp(test_directory):
+    stg = record_storage(test_directory)
+    stg.store(page(record('a', '2020-01-02', 'second')))
+    stg.store(page(record('a', '2020-01-01', 'first')))
+    stg.store(page(record('b', '2020-01-01', 'B'),
+                   record('b', '2020-01-03', deleted=True)))
+    assert b'second' in stg.get('a').xml
+    assert stg.get('b').deleted
+    assert [each.identifier for each in stg.export()] == ['a', 'b']
+
+
+def test_writes_in_batches(test_directory):
+    stg = record_storage(test_directory, batch_size=3)
+    stg.store(page(record('a', '2020-01-01'), record('b', '2020-01-01')))
+    reader = records.RecordStorage(test_directory)
+    assert list(reader.export()) == []
+    stg.store(page(record('c', '2020-01-01')))
+    assert len(list(reader.export())) == 3
+    # Pages whose records were not written yet are not counted on reopening.
+    stg.store(page(record('d', '2020-01-01')))
+    assert records.RecordStorage(test_directory).page_count() == 2
+
+
+def test_exports_in_datestamp_order(test_directory):
+    stg = record_storage(test_directory)
+    stg.store(page(record('a', '2020-03-01'), record('b', '2020-01-01'),
+                   record('c', '2020-02-01', deleted=True),
+                   record('d', '2020-02-01')))
+    assert [each.identifier for each in stg.export()] == ['b', 'c', 'd', 'a']
+    assert [each.identifier for each in
+            stg.export(since='2020-02-01', deleted=False)] == ['d', 'a']
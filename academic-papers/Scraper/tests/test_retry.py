@@ -0,0 +1,178 @@
+from functools import partial
+import pytest
+import requests
+from scraper import oai
+from scraper import retry
+from scraper import scraper
+from scraper import storage
+from tests.helpers import MockHttpResponse, chain_handler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+BAD_TOKEN_PAGE = (b'<OAI-PMH><error code="badResumptionToken">expired'
+                  b'</error></OAI-PMH>')
+
+
+def failing_handler(handler, failures):
+    """Answers with the next of failures (an http status or exception)
+    before each request, then with handler once they run out.
+    """
+    failures = list(failures)
+    def _handler(data):
+        if failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return MockHttpResponse(b'', status_code=failure)
+        return handler(data)
+    return _handler
+
+
+def test_classifies_failures():
+    policy = retry.RetryPolicy()
+    assert policy.classify(oai.HttpStatusError(500, None)) == 'transient'
+    assert policy.classify(oai.HttpStatusError(404, None)) == 'fatal'
+    assert policy.classify(oai.ApplicationError(
+        'badResumptionToken', '', b'')) == 'bad_token'
+    assert policy.classify(oai.ApplicationError('badArgument', '', b'')) \
+        == 'fatal'
+    assert policy.classify(retry.RequestError(ConnectionError())) \
+        == 'transient'
+    assert policy.classify(oai.MalformedResponseError(b'<OAI')) \
+        == 'transient'
+    assert policy.classify(ValueError()) == 'fatal'
+
+
+def test_backoff_doubles_with_jitter_up_to_max_delay():
+    low = retry.RetryPolicy(base_delay=2, max_delay=10, random=lambda: 0)
+    high = retry.RetryPolicy(base_delay=2, max_delay=10, random=lambda: 1)
+    assert [low.delay(attempt) for attempt in (1, 2, 3, 4)] == [1, 2, 4, 5]
+    assert [high.delay(attempt) for attempt in (1, 2, 3, 4)] == [2, 4, 8, 10]
+    assert low.allows(8) and not low.allows(9)
+    assert not retry.NO_RETRY.allows(1)
+
+
+def test_circuit_opens_then_lets_one_trial_through():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=60,
+                                   clock=clock)
+    assert not breaker.on_failure()
+    assert breaker.on_failure()
+    assert breaker.delay() == 60
+    clock.sleep(60)
+    assert breaker.delay() == 0
+    assert breaker.delay() == 1
+    assert breaker.on_failure()
+    clock.sleep(60)
+    assert breaker.delay() == 0
+    breaker.on_success()
+    assert breaker.delay() == 0
+    assert breaker.state == 'closed'
+
+
+def test_circuit_lets_another_trial_through_if_one_never_reports():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=10,
+                                   clock=clock)
+    breaker.on_failure()
+    clock.sleep(10)
+    assert breaker.delay() == 0
+    clock.sleep(10)
+    assert breaker.delay() == 0
+
+
+def test_worker_retries_transient_failures():
+    clock = FakeClock()
+    requested = []
+    handler = failing_handler(
+        chain_handler(3, requested),
+        [500, requests.exceptions.ConnectionError('reset'), 503])
+    stg = storage.MockStorage(10000)
+    worker = scraper.Worker(stg, handler, sleep=clock.sleep,
+                            retry_policy=retry.RetryPolicy(random=lambda: 1))
+    assert worker.run(partial(oai.request_list_records, handler)) == 3
+    assert stg.store_count == 3
+    assert requested == [0, 1, 2]
+    assert clock.now == 1 + 2 + 4
+
+
+def test_worker_gives_up_after_max_attempts():
+    handler = failing_handler(chain_handler(3), [500] * 3)
+    worker = scraper.Worker(storage.MockStorage(10000), handler,
+                            sleep=lambda seconds: None,
+                            retry_policy=retry.RetryPolicy(max_attempts=2))
+    with pytest.raises(RuntimeError) as exc:
+        worker.run(partial(oai.request_list_records, handler))
+    assert exc.value.__cause__.code == 500
+
+
+def test_worker_does_not_retry_by_default():
+    handler = failing_handler(chain_handler(3),
+                              [requests.exceptions.Timeout()])
+    worker = scraper.Worker(storage.MockStorage(10000), handler)
+    with pytest.raises(RuntimeError) as exc:
+        worker.run(partial(oai.request_list_records, handler))
+    assert isinstance(exc.value.__cause__, retry.RequestError)
+
+
+def test_worker_follows_chain_again_after_bad_token():
+    requested = []
+    chain = chain_handler(4, requested)
+    expired = []
+    def handler(data):
+        if data.get('resumptionToken') == '2' and not expired:
+            expired.append(True)
+            return MockHttpResponse(BAD_TOKEN_PAGE)
+        return chain(data)
+    stg = storage.MockStorage(10000)
+    worker = scraper.Worker(stg, handler, sleep=lambda seconds: None,
+                            retry_policy=retry.RetryPolicy())
+    assert worker.run(partial(oai.request_list_records, handler)) == 4
+    assert requested == [0, 1, 0, 1, 2, 3]
+    assert stg.store_count == 4
+    assert worker.complete
+
+
+def test_worker_resumed_from_an_expired_token_starts_the_chain_over():
+    requested = []
+    chain = chain_handler(5, requested)
+    def handler(data):
+        if data.get('resumptionToken') == 'expired':
+            return MockHttpResponse(BAD_TOKEN_PAGE)
+        return chain(data)
+    stg = storage.MockStorage(10000)
+    stg.store_count = 3
+    worker = scraper.Worker(stg, handler, sleep=lambda seconds: None,
+                            retry_policy=retry.RetryPolicy())
+    first = partial(oai.request_list_records, handler)
+    assert worker.run(
+        partial(oai.resume_request_list_records, handler, 'expired'),
+        restart=(first, 3)) == 2
+    assert requested == [0, 1, 2, 3, 4]
+    assert stg.store_count == 5
+    assert worker.complete
+
+
+def test_open_circuit_pauses_the_worker():
+    clock = FakeClock()
+    breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=60,
+                                   clock=clock)
+    handler = failing_handler(chain_handler(1), [502])
+    worker = scraper.Worker(storage.MockStorage(10000), handler,
+                            sleep=clock.sleep, breaker=breaker,
+                            retry_policy=retry.RetryPolicy(random=lambda: 1))
+    assert worker.run(partial(oai.request_list_records, handler)) == 1
+    # One second of backoff, then the rest of the minute the circuit is open.
+    assert clock.now == 60
+    assert breaker.state == 'closed'
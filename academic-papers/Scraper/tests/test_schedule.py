@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import threading
+import time
+import pytest
+from scraper import partition
+from scraper import retry
+from scraper import schedule
+from scraper import storage
+from tests.helpers import MockHttpResponse, chain_handler
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def endpoint(name, host, wait=0):
+    return schedule.Endpoint(name, f'http://{host}/oai', wait, 'oai_dc',
+                             None, None, None)
+
+
+def chains(endpoints, length=3, handler=None):
+    return [(each, storage.MockStorage(10000),
+             handler or chain_handler(length))
+            for each in endpoints]
+
+
+def test_harvests_every_endpoint():
+    my_chains = chains([endpoint(name, f'{name}.every.example')
+                        for name in 'abc'])
+    progress = schedule.Scheduler(my_chains).run()
+    assert [each.state for each in progress] == \
+        [partition.PartitionProgress.DONE] * 3
+    assert [stg.store_count for (_, stg, _) in my_chains] == [3, 3, 3]
+
+
+def test_hosts_are_paced_separately():
+    my_chains = chains([endpoint('a', 'a.paced.example', 0.1),
+                        endpoint('b', 'b.paced.example', 0.1),
+                        endpoint('c', 'a.paced.example', 0.1)])
+    started = time.monotonic()
+    schedule.Scheduler(my_chains).run()
+    elapsed = time.monotonic() - started
+    # Six pages from a.paced.example, three from b.paced.example at once.
+    assert 0.5 <= elapsed < 0.8
+
+
+def test_caps_requests_in_flight():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    chain = chain_handler(2)
+    def handler(data):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return chain(data)
+    my_chains = chains([endpoint(name, f'{name}.capped.example')
+                        for name in 'abcd'], handler=handler)
+    schedule.Scheduler(my_chains, concurrency=2).run()
+    assert in_flight[1] == 2
+    assert all(stg.store_count == 2 for (_, stg, _) in my_chains)
+
+
+def test_caps_bandwidth():
+    my_chains = chains([endpoint(name, f'{name}.bandwidth.example')
+                        for name in 'ab'])
+    page_size = len(chain_handler(1)({}).content)
+    started = time.monotonic()
+    schedule.Scheduler(my_chains, bytes_per_second=page_size * 4).run()
+    # Six pages at four a second, after a second's worth at once; the page
+    # that overdraws the allowance is paid back before the last one.
+    assert time.monotonic() - started >= 0.2
+
+
+def test_failing_endpoint_does_not_stop_the_others():
+    chain = chain_handler(3)
+    def handler(data):
+        if data.get('resumptionToken') == '1':
+            return MockHttpResponse(b'', status_code=404)
+        return chain(data)
+    my_chains = chains([endpoint('a', 'a.failing.example')]) \
+        + chains([endpoint('b', 'b.failing.example')], handler=handler)
+    progress = schedule.Scheduler(
+        my_chains, retry_policy=retry.RetryPolicy()).run()
+    assert [each.state for each in progress] == \
+        [partition.PartitionProgress.DONE, partition.PartitionProgress.FAILED]
+    assert progress[1].error.code == 404
+    assert progress[1].pages == 1
+
+
+def test_reads_endpoints(test_directory):
+    path = os.path.join(test_directory, 'endpoints.json')
+    with open(path, 'w') as f:
+        json.dump([{'name': 'a', 'url': 'http://a.example/oai', 'wait': 5},
+                   {'name': 'b', 'url': 'http://b.example/oai',
+                    'from': '2020-01-01', 'set': 'physics'}], f)
+    assert schedule.read_endpoints(path) == [
+        schedule.Endpoint('a', 'http://a.example/oai', 5, 'oai_dc',
+                          None, None, None),
+        schedule.Endpoint('b', 'http://b.example/oai', 0, 'oai_dc',
+                          '2020-01-01', None, 'physics')]
@@ -4,6 +4,10 @@ from scraper import storage
 from scraper import scraper
 
 
+# The smallest response that is a complete OAI-PMH document.
+SOME_DATA = b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'
+
+
 @pytest.fixture(scope='module')
 def response_handler():
     def _response_handler():
@@ -47,13 +51,13 @@ def test_check_wait_no_throw_on_not_503():
 def test_store_throws_on_out_of_space():
     stg = storage.MockStorage(0)
     with pytest.raises(scraper.OutOfSpaceError) as exc:
-        scraper.store(b'some data', stg)
+        scraper.store(SOME_DATA, stg)
     assert stg.store_count == 0
     assert stg.log_resumption_count == 0
 
 def test_store_stores_once_with_available_space():
     stg = storage.MockStorage(100)
-    data = b'some data'
+    data = SOME_DATA
     scraper.store(data, stg)
     assert stg.store_count == 1
     assert stg.log_resumption_count == 1
@@ -61,7 +65,7 @@ def test_store_stores_once_with_available_space():
 # send_and_store_single_request = 3sr
 
 def test_3sr_stores_good_request_once():
-    request = lambda: b'some data'
+    request = lambda: SOME_DATA
     stg = storage.MockStorage(100)
     worker = scraper.Worker(stg, request)
     scraper.send_and_store_single_request(stg, request)
@@ -69,7 +73,7 @@ def test_3sr_stores_good_request_once():
     assert stg.log_resumption_count == 1
 
 def test_3sr_throws_out_of_space():
-    request = lambda: b'some data'
+    request = lambda: SOME_DATA
     stg = storage.MockStorage(0)
     with pytest.raises(scraper.OutOfSpaceError) as exc:
         scraper.send_and_store_single_request(stg, request)
@@ -99,3 +103,54 @@ def test_3sr_passes_application_error():
     with pytest.raises(oai.ApplicationError) as exc:
         scraper.send_and_store_single_request(stg, request)
     assert stg.store_count == 0
+
+def test_worker_stops_at_end_of_list():
+    requests_made = 0
+    def request():
+        nonlocal requests_made
+        requests_made += 1
+        return b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'
+    stg = storage.MockStorage(1000)
+    worker = scraper.Worker(stg, None)
+    assert worker.run(request, max_requests=5) == 1
+    assert requests_made == 1
+    assert stg.store_count == 1
+
+def test_worker_fails_on_truncated_page():
+    stg = storage.MockStorage(1000)
+    worker = scraper.Worker(stg, None)
+    with pytest.raises(RuntimeError):
+        worker.run(lambda: b'<OAI-PMH><ListRecords><record/>')
+    assert not worker.complete
+    assert stg.store_count == 0
+
+def test_3sr_reserves_expected_size_while_requesting():
+    stg = storage.MockStorage(100)
+    def request():
+        assert stg.bytes_reserved == 40
+        return SOME_DATA
+    scraper.send_and_store_single_request(stg, request, expected_size=40)
+    assert stg.bytes_reserved == 0
+    assert stg.store_count == 1
+
+def test_3sr_stores_a_page_in_the_space_it_reserved():
+    stg = storage.MockStorage(len(SOME_DATA))
+    scraper.send_and_store_single_request(stg, lambda: SOME_DATA,
+                                          expected_size=len(SOME_DATA))
+    assert stg.bytes_reserved == 0
+    assert stg.store_count == 1
+
+def test_3sr_releases_reservation_when_request_fails():
+    stg = storage.MockStorage(100)
+    def request():
+        raise oai.HttpStatusError(500, None)
+    with pytest.raises(oai.HttpStatusError):
+        scraper.send_and_store_single_request(stg, request, expected_size=40)
+    assert stg.bytes_reserved == 0
+
+def test_3sr_throws_out_of_space_before_requesting():
+    stg = storage.MockStorage(10)
+    def request():
+        pytest.fail('Should not send a request without space to store it.')
+    with pytest.raises(scraper.OutOfSpaceError):
+        scraper.send_and_store_single_request(stg, request, expected_size=40)
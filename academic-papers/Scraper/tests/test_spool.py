@@ -0,0 +1,76 @@
+import gc
+import os
+import shutil
+import time
+import pytest
+from scraper import client
+from scraper import oai
+from scraper import spool
+from scraper import storage
+from tests.helpers import list_records_page
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+def spooled(directory, data, chunk_size=7):
+    return spool.Spool.write(directory, spool.chunks(data, chunk_size))
+
+
+def test_spool_reads_back_in_chunks(test_directory):
+    body = spooled(test_directory, b'x' * 100)
+    assert len(body) == 100
+    assert [len(chunk) for chunk in body.chunks(40)] == [40, 40, 20]
+    assert spool.as_bytes(body) == b'x' * 100
+
+
+def test_unstored_spool_is_removed(test_directory):
+    body = spooled(test_directory, b'x' * 100)
+    del body
+    gc.collect()
+    assert os.listdir(test_directory) == []
+
+
+def test_stale_spools_are_removed_on_start(test_directory):
+    stale = spooled(test_directory, b'x' * 100)
+    fresh = spooled(test_directory, b'y' * 100)
+    # As if left by a crash two hours ago.
+    stale._finalizer.detach()
+    hours_ago = time.time() - 2 * 3600
+    os.utime(stale.path, (hours_ago, hours_ago))
+    open(os.path.join(test_directory, 'part_0001'), 'wb').close()
+    client.SessionHandler('http://example.org/oai',
+                          spool_directory=test_directory)
+    assert sorted(os.listdir(test_directory)) == \
+        sorted([os.path.basename(fresh.path), 'part_0001'])
+
+
+def test_response_parses_a_spool(test_directory):
+    response = oai.Response(spooled(test_directory, list_records_page('T')))
+    assert response.record_count == 0
+    assert oai.resumption_token_from_response(response) == 'T'
+    assert len(list(response.records())) == 1
+
+
+def test_local_storage_moves_spool_into_place(test_directory):
+    data = list_records_page('T')
+    stg = storage.LocalStorage(test_directory)
+    part = stg.store(spooled(test_directory, data))
+    gc.collect()
+    with open(os.path.join(test_directory, f'part_{part:04d}'), 'rb') as f:
+        assert f.read() == data
+    assert not [name for name in os.listdir(test_directory)
+                if name.startswith(spool.Spool.PREFIX)]
+    assert stg.manifest.parts()[0].bytes == len(data)
+
+
+def test_segment_storage_compresses_spool(test_directory):
+    data = list_records_page('T') * 100
+    stg = storage.SegmentStorage(test_directory)
+    page = stg.store(spooled(test_directory, data))
+    assert stg.read(page) == data
@@ -3,6 +3,7 @@ import os
 import shutil
 import pathlib
 from scraper import storage
+from scraper.manifest import Manifest
 
 #
 # Fixtures
@@ -51,3 +52,129 @@ def test_local_storage_appends_resumption_tokens_to_resumption_file(test_directo
     assert len(tokens) == 2
     assert tokens[0] == 'TOKEN1'
     assert tokens[1] == 'TOKEN2'
+
+def test_segment_storage_reads_back_pages(test_directory):
+    ss = storage.SegmentStorage(test_directory)
+    pages = [b'<page>%d</page>' % n * 100 for n in range(5)]
+    for page in pages:
+        ss.store(page)
+    assert ss.page_count() == 5
+    assert ss.read(3) == pages[2]
+    assert list(ss.pages()) == pages
+    assert os.path.getsize(os.path.join(test_directory, 'segment_000000')) \
+        < sum(map(len, pages))
+
+def test_segment_storage_rolls_segments(test_directory):
+    ss = storage.SegmentStorage(test_directory, segment_bytes=64)
+    pages = [os.urandom(40) for _ in range(3)]
+    for page in pages:
+        ss.store(page)
+    assert os.path.isfile(os.path.join(test_directory, 'segment_000002'))
+    assert ss.read(2) == pages[1]
+
+def test_segment_storage_reopens_and_appends(test_directory):
+    ss = storage.SegmentStorage(test_directory)
+    ss.store(b'first')
+    with open(os.path.join(test_directory, 'segment_000000'), 'ab') as f:
+        f.write(b'torn write')
+    ss = storage.SegmentStorage(test_directory)
+    assert ss.page_count() == 1
+    ss.store(b'second')
+    assert list(ss.pages()) == [b'first', b'second']
+
+def test_segment_reader_leaves_unindexed_tail_alone(test_directory):
+    ss = storage.SegmentStorage(test_directory)
+    ss.store(b'first')
+    segment_path = os.path.join(test_directory, 'segment_000000')
+    # A page appended to the segment, but not yet to the index.
+    with open(segment_path, 'ab') as f:
+        f.write(b'in flight')
+    size = os.path.getsize(segment_path)
+    with storage.SegmentReader(test_directory) as reader:
+        assert reader.page_count() == 1
+        assert list(reader.pages()) == [b'first']
+    assert os.path.getsize(segment_path) == size
+
+def test_space_budget_measures_on_interval():
+    measurements = 0
+    now = 0.0
+    def measure(path):
+        nonlocal measurements
+        measurements += 1
+        return 1000
+    budget = storage.SpaceBudget('.', measure, 1.0, refresh_interval=10,
+                                 clock=lambda: now)
+    assert budget.available() == 1000
+    assert budget.charge(300)
+    assert budget.available() == 700
+    assert measurements == 1
+    now = 11.0
+    assert budget.available() == 1000
+    assert measurements == 2
+
+def test_space_budget_reservations_hold_space():
+    budget = storage.SpaceBudget('.', lambda path: 100, 1.0)
+    first = budget.reserve(60)
+    assert first is not None
+    assert budget.reserve(60) is None
+    assert not budget.charge(60)
+    first.release()
+    assert budget.charge(60)
+
+def test_space_budget_settles_a_reservation_into_its_charge():
+    budget = storage.SpaceBudget('.', lambda path: 100, 1.0)
+    reservation = budget.reserve(60)
+    assert not budget.charge(50)
+    assert budget.charge(50, reservation)
+    # Released only if the write did not go ahead, so this frees nothing.
+    reservation.release()
+    assert budget.available() == 50
+
+def test_local_storages_share_directory_budget(test_directory):
+    first = storage.LocalStorage(test_directory)
+    second = storage.LocalStorage(test_directory)
+    reservation = first.reserve(first.available_storage())
+    assert reservation is not None
+    assert not second.has_space(b'a')
+    reservation.release()
+    assert second.has_space(b'a')
+
+def test_local_storage_records_parts_in_manifest(test_directory):
+    ls = storage.LocalStorage(test_directory)
+    assert ls.store(b'a' * 50, records=3, token='TOKEN1') == 1
+    assert ls.store(b'b' * 20) == 2
+    parts = ls.manifest.parts()
+    assert [(p.part, p.filename, p.bytes, p.records, p.token)
+            for p in parts] == [(1, 'part_0001', 50, 3, 'TOKEN1'),
+                                (2, 'part_0002', 20, None, None)]
+
+def test_local_storage_opens_from_manifest(test_directory):
+    ls = storage.LocalStorage(test_directory)
+    ls.store(b'a' * 50)
+    ls.manifest.close()
+    # Files the manifest does not know about are not scanned for.
+    pathlib.Path(os.path.join(test_directory, 'part_0009')).touch()
+    ls = storage.LocalStorage(test_directory)
+    ls.store(b'a' * 50)
+    assert os.path.isfile(os.path.join(test_directory, 'part_0002'))
+
+def test_local_storage_commits_manifest_on_sync(test_directory):
+    ls = storage.LocalStorage(test_directory)
+    ls.store(b'a' * 50)
+    ls.sync()
+    ls.store(b'b' * 20, token='TOKEN2')
+    reader = Manifest(os.path.join(test_directory, Manifest.FILENAME))
+    assert [p.part for p in reader.parts()] == [1]
+    ls.sync()
+    assert [p.token for p in reader.parts()] == [None, 'TOKEN2']
+
+def test_local_storage_recovers_parts_stored_after_last_sync(test_directory):
+    ls = storage.LocalStorage(test_directory)
+    ls.store(b'a' * 50)
+    ls.sync()
+    ls.store(b'b' * 20)
+    # Crash before the next sync: the second row is never committed.
+    ls.manifest._connection.close()
+    ls = storage.LocalStorage(test_directory)
+    assert [p.bytes for p in ls.manifest.parts()] == [50, 20]
+    assert ls.store(b'c' * 10) == 3
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import httpretty
+import pytest
+from scraper import client
+from scraper import oai
+from scraper import rate
+from scraper import scraper
+from scraper import storage
+from scraper import timing
+
+
+@pytest.fixture
+def test_directory():
+    directory = os.path.join(os.path.dirname(__file__), 'test_data')
+    os.mkdir(directory)
+    yield directory
+    shutil.rmtree(directory)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_null_timer_records_nothing():
+    timer = timing.NULL_TIMER
+    started = timer.start()
+    assert timer.lap(timing.PARSE, started) == 0
+
+
+def test_histogram_percentiles_bound_recorded_times():
+    timer = timing.HistogramTimer()
+    for _ in range(99):
+        timer.record(timing.PARSE, 0.001)
+    timer.record(timing.PARSE, 0.5)
+    assert timer.count(timing.PARSE) == 100
+    assert 0.001 <= timer.percentile(timing.PARSE, 0.5) < 0.002
+    assert timer.percentile(timing.PARSE, 1.0) == 0.5
+    summary = timer.summary()[timing.PARSE]
+    assert summary['max'] == 0.5
+    assert summary['mean'] == pytest.approx((99 * 0.001 + 0.5) / 100)
+    assert timer.percentile(timing.STORE, 0.5) is None
+
+
+def test_json_lines_timer_writes_each_phase(test_directory):
+    path = os.path.join(test_directory, 'timings.jsonl')
+    timer = timing.JsonLinesTimer(path)
+    timer.lap(timing.STORE, timer.start())
+    timer.record(timing.SLEEP, 2.0)
+    timer.close()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['phase'] for line in lines] == ['store', 'sleep']
+    assert lines[1]['seconds'] == 2.0
+
+
+def test_worker_times_parse_store_and_sleep(monkeypatch):
+    clock = FakeClock()
+    pages = iter([b'<OAI-PMH><ListRecords><record/>'
+                  b'<resumptionToken>T</resumptionToken>'
+                  b'</ListRecords></OAI-PMH>',
+                  b'<OAI-PMH><ListRecords><record/></ListRecords></OAI-PMH>'])
+    monkeypatch.setattr(oai, 'resume_request_list_records',
+                        lambda handler, token: next(pages))
+    timer = timing.HistogramTimer()
+    worker = scraper.Worker(storage.MockStorage(10000), None,
+                            sleep=clock.sleep,
+                            limiter=rate.RateLimiter(min_interval=1,
+                                                     clock=clock),
+                            timer=timer)
+    assert worker.run(lambda: next(pages)) == 2
+    assert timer.count(timing.PARSE) == 2
+    assert timer.count(timing.STORE) == 2
+    assert timer.count(timing.SLEEP) == 1
+
+
+@httpretty.activate
+def test_session_handler_times_http_phases():
+    base_url = 'http://archive.org/oai'
+    httpretty.register_uri(httpretty.POST, base_url, body=b'<OAI-PMH/>')
+    timer = timing.HistogramTimer()
+    with client.SessionHandler(base_url, timer=timer) as handler:
+        response = oai.base_oai_request(handler, oai.Verbs.IDENTIFY)
+    assert response.data == b'<OAI-PMH/>'
+    for phase in (timing.SEND, timing.TTFB, timing.DOWNLOAD):
+        assert timer.count(phase) == 1